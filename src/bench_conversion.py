@@ -0,0 +1,65 @@
+"""Compares converting orm artists into `schemas.Artist` with `from_orm`
+(validating every field through the getter dict) and `from_orm_trusted`
+(constructing the models without validation).
+
+Run with `python bench_conversion.py [number of artists]`"""
+import sys
+import time
+
+import models
+import schemas
+
+
+def _artists(count: int) -> list[models.Artist]:
+    genres = [models.Genre(name=f"genre {i}") for i in range(50)]
+    return [
+        models.Artist(
+            id=f"artist{i}",
+            type="artist",
+            href=f"https://api.spotify.com/v1/artists/artist{i}",
+            name=f"artist {i}",
+            popularity=i % 100,
+            uri=f"spotify:artist:artist{i}",
+            genres=genres[i % 50 : i % 50 + 3],
+            external_urls=models.ExternalUrls(
+                id=f"artist{i}",
+                spotify=f"https://open.spotify.com/artist/artist{i}",
+            ),
+            followers=models.Followers(id=f"artist{i}", href=None, total=i),
+            images=[
+                models.Image(
+                    url=f"https://i.scdn.co/image/{i}-{size}", height=size, width=size
+                )
+                for size in [64, 320, 640]
+            ],
+        )
+        for i in range(count)
+    ]
+
+
+def _conversions_per_second(artists: list[models.Artist], convert) -> float:
+    start = time.perf_counter()
+    for artist in artists:
+        convert(artist)
+    return len(artists) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    artists = _artists(count)
+    fields = schemas.artist_fields(["name", "popularity"])
+    projection = schemas.artist_projection(fields)
+
+    print(f"{count} artists, conversions per second")
+    for name, convert in [
+        ("Artist.from_orm", schemas.Artist.from_orm),
+        ("Artist.from_orm_trusted", schemas.Artist.from_orm_trusted),
+        ("projection from_orm", projection.from_orm),
+        ("projection from_orm_trusted", projection.from_orm_trusted),
+    ]:
+        rate = max(_conversions_per_second(artists, convert) for _ in range(3))
+        print(f"{name:30} {rate:12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
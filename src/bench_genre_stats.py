@@ -0,0 +1,70 @@
+"""Compares the genre statistics aggregated over all artists on demand with
+reading the precomputed genre_stats table, and measures what keeping the
+table up to date adds to an update cycle (on SQLite).
+
+Run with `python bench_genre_stats.py [number of artists]`"""
+import asyncio
+import sys
+import time
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from catalog import Catalog
+from crud import ArtistCrud, GenreStatsCrud
+from db import Base
+from queries import count_queries
+
+
+async def _best_of(repeat: int, run: Callable[[], Awaitable[Any]]) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+async def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    catalog = Catalog(size=count)
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    await catalog.fill_database(session_maker)
+
+    async with session_maker() as session:
+
+        async def aggregate() -> None:
+            async with session.begin():
+                query = GenreStatsCrud._aggregate_query()
+                (await session.execute(query)).all()
+
+        async def read_table() -> None:
+            await GenreStatsCrud.read_stats(session, limit=10_000)
+
+        print(f"{count} artists, {len(catalog.vocabulary)} genres")
+        for name, run in [
+            ("aggregate on demand", aggregate),
+            ("read table", read_table),
+        ]:
+            duration = await _best_of(5, run)
+            print(f"{name:24} {duration * 1000:9.2f} ms")
+
+        batch = [catalog.artist(i, snapshot=1) for i in range(500)]
+        with count_queries() as log:
+            start = time.perf_counter()
+            await ArtistCrud.update_artists(session, batch)
+            duration = time.perf_counter() - start
+        stats_duration = log.duration("ArtistCrud._write_genre_stats")
+        print(
+            f"update of 500 artists     {duration * 1000:9.2f} ms,"
+            f" genre stats {stats_duration * 1000:.2f} ms"
+            f" in {log.count('ArtistCrud._write_genre_stats')} statement"
+        )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+"""Measures the memory used by artists held as validated `schemas.Artist`
+models, as `ArtistRecord`s and in a full `ArtistCache`.
+
+Run with `python bench_records.py [number of artists]`"""
+import gc
+import sys
+import tracemalloc
+from typing import Any, Callable
+
+import orjson
+
+from cache import ArtistCache
+from catalog import Catalog
+from records import ArtistRecord
+import schemas
+
+
+def _artist_data(catalog: Catalog, i: int) -> dict[str, Any]:
+    # fresh strings per artist, like rows read from the database
+    return orjson.loads(orjson.dumps(catalog.artist_data(i)))
+
+
+def _allocated_mb(build: Callable[[], Any]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    held = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return size / 1024 / 1024
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    catalog = Catalog(size=count)
+    artists = [schemas.Artist.parse_obj(_artist_data(catalog, i)) for i in range(count)]
+
+    def build_cache() -> ArtistCache:
+        cache = ArtistCache(count)
+        for artist in artists:
+            cache.put(artist, artist.content_hash())
+        return cache
+
+    print(f"{count} artists")
+    for name, build in [
+        (
+            "schemas.Artist",
+            lambda: [
+                schemas.Artist.parse_obj(_artist_data(catalog, i)) for i in range(count)
+            ],
+        ),
+        ("ArtistRecord", lambda: [ArtistRecord.from_artist(a) for a in artists]),
+        ("ArtistCache (records + hashes)", build_cache),
+    ]:
+        size = _allocated_mb(build)
+        print(f"{name:32} {size:8.1f} MB {size * 1024 * 1024 / count:8.0f} B/artist")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Compares the per artist cost of FastAPI's default response serialization
+(response model validation, jsonable_encoder and json) with FastJSONResponse.
+
+Run with `python bench_serialization.py [number of artists]`"""
+import asyncio
+import sys
+import timeit
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from mocks import MockArtistCrud
+from responses import FastJSONResponse
+import schemas
+
+
+def _artists(count: int) -> list[schemas.Artist]:
+    template = MockArtistCrud.artists["a"]
+    return [template.copy(update={"id": str(i)}, deep=True) for i in range(count)]
+
+
+async def _default_render(artists: list[schemas.Artist]) -> bytes:
+    field = create_response_field(name="bench", type_=list[schemas.Artist])
+    content = await serialize_response(field=field, response_content=artists)
+    return JSONResponse(content).body
+
+
+def _fast_render(artists: list[schemas.Artist]) -> bytes:
+    return FastJSONResponse(artists).body
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    artists = _artists(count)
+    loop = asyncio.new_event_loop()
+    runs = 10
+
+    default_time = timeit.timeit(
+        lambda: loop.run_until_complete(_default_render(artists)), number=runs
+    )
+    fast_time = timeit.timeit(lambda: _fast_render(artists), number=runs)
+
+    default_per_artist = default_time / runs / count * 1e6
+    fast_per_artist = fast_time / runs / count * 1e6
+    print(f"artists:  {count}")
+    print(f"default:  {default_per_artist:.2f} us per artist")
+    print(f"fast:     {fast_per_artist:.2f} us per artist")
+    print(f"speedup:  {default_per_artist / fast_per_artist:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Measures cold start of the api and worker entry points and of the startup
+schema handling (create_all as before versus the schema version check).
+Every measurement runs in a fresh interpreter.
+
+Run with `python bench_startup.py [runs]`"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+_IMPORT = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+_STARTUP = """
+import asyncio
+import time
+import main
+from db import Base, create_db_and_tables, get_engine
+
+
+async def create_all():
+    async with get_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+
+start = time.perf_counter()
+asyncio.run({function}())
+print(time.perf_counter() - start)
+"""
+
+
+def _run(code: str, env: dict[str, str]) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def _median_ms(code: str, env: dict[str, str], runs: int) -> float:
+    return statistics.median(_run(code, env) for _ in range(runs)) * 1000
+
+
+def main() -> None:
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite+aiosqlite:///{directory}/bench.db",
+        }
+        print(f"median of {runs} runs")
+        for module in ["main", "worker"]:
+            duration = _median_ms(_IMPORT.format(module=module), env, runs)
+            print(f"import {module:30} {duration:8.1f} ms")
+
+        # the first run creates the tables and stores the schema version
+        _run(_STARTUP.format(function="create_db_and_tables"), env)
+        for function in ["create_all", "create_db_and_tables"]:
+            duration = _median_ms(_STARTUP.format(function=function), env, runs)
+            print(f"startup {function:29} {duration:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Measures time to first byte and peak memory of listing all artists,
+streamed by GET /artists versus materialized into one response body.
+
+Run with `python bench_streaming.py [number of artists]`"""
+import asyncio
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, AsyncGenerator
+
+from fastapi import FastAPI
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from crud import ArtistCrud
+from db import Base, DbSessionDependency, get_session
+from main import app
+from mocks import MockArtistCrud
+import schemas
+
+
+async def _fill_database(
+    session_maker: async_sessionmaker[AsyncSession], count: int
+) -> None:
+    template = MockArtistCrud.artists["a"]
+    for start in range(0, count, 1000):
+        artists = [
+            template.copy(update={"id": f"{i:08}"}, deep=True)
+            for i in range(start, min(start + 1000, count))
+        ]
+        async with session_maker() as session:
+            await ArtistCrud.update_artists(session, artists)
+
+
+async def _request(asgi_app: Any, path: str) -> tuple[float, float, int]:
+    """Returns time to first byte, total time and body size"""
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "server": ("localhost", 80),
+        "client": ("localhost", 1234),
+    }
+    start = time.perf_counter()
+    first_byte: float | None = None
+    size = 0
+
+    request_sent = False
+    response_done = asyncio.Event()
+
+    async def receive() -> dict[str, Any]:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict[str, Any]) -> None:
+        nonlocal first_byte, size
+        if message["type"] == "http.response.body" and message.get("body"):
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(message["body"])
+        if message["type"] == "http.response.body" and not message.get("more_body"):
+            response_done.set()
+
+    await asyncio.wait_for(asgi_app(scope, receive, send), timeout=600)
+    response_done.set()
+    total = time.perf_counter() - start
+    return first_byte or total, total, size
+
+
+async def _measure(asgi_app: Any, path: str) -> None:
+    tracemalloc.start()
+    first_byte, total, size = await _request(asgi_app, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{path:22} ttfb {first_byte * 1000:8.1f} ms  total {total * 1000:8.1f} ms  "
+        f"peak memory {peak / 2**20:7.1f} MiB  body {size / 2**20:5.1f} MiB"
+    )
+
+
+async def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{directory}/bench.db")
+        session_maker = async_sessionmaker(engine, expire_on_commit=False)
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await _fill_database(session_maker, count)
+
+        async def get_bench_session() -> AsyncGenerator[AsyncSession, None]:
+            async with session_maker() as session:
+                yield session
+
+        # the same listing without streaming, as a plain endpoint would return it
+        materialized_app = FastAPI()
+
+        @materialized_app.get("/artists_materialized")
+        async def get_artists_materialized(  # type: ignore
+            db_session: DbSessionDependency,
+        ) -> list[schemas.Artist]:
+            artists: list[schemas.Artist] = []
+            async for batch in ArtistCrud.iter_artists(db_session):
+                artists.extend(batch)
+            return artists
+
+        app.dependency_overrides[get_session] = get_bench_session
+        materialized_app.dependency_overrides[get_session] = get_bench_session
+
+        print(f"artists: {count}")
+        await _measure(materialized_app, "/artists_materialized")
+        await _measure(app, "/artists")
+
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+import random
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Iterable
+from weakref import WeakKeyDictionary
+
+from sqlalchemy.engine import Connection, Engine
+
+from config import get_settings
+from records import ArtistRecord
+import schemas
+
+
+class ArtistCache:
+    """The least recently used artists of this process as compact records.
+    Entries are stored with their content hash and a lookup only hits if the
+    caller's (current) hash matches, so stale entries are never returned."""
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[str, tuple[str, ArtistRecord]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, artist_id: str, content_hash: str) -> schemas.Artist | None:
+        entry = self._entries.get(artist_id)
+        if entry is None or entry[0] != content_hash:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(artist_id)
+        self.hits += 1
+        return entry[1].to_artist()
+
+    def put(self, artist: schemas.Artist, content_hash: str) -> None:
+        """Adds the artist read with the stored `content_hash` (of the artist
+        as written, e.g. with the genres in another order than read)"""
+        if self.max_size <= 0:
+            return
+        record = ArtistRecord.from_artist(artist)
+        self._entries[artist.id] = (content_hash, record)
+        self._entries.move_to_end(artist.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def warm(self, artist: schemas.Artist, content_hash: str) -> bool:
+        """Adds a preloaded artist as the least recently used one, so it never
+        evicts artists of requests. Returns False once the cache is full."""
+        if len(self._entries) >= self.max_size:
+            return False
+        if artist.id not in self._entries:
+            self._entries[artist.id] = (content_hash, ArtistRecord.from_artist(artist))
+            self._entries.move_to_end(artist.id, last=False)
+        return True
+
+    def memory_usage(self, sample_size: int = 100) -> int:
+        """Estimated bytes of the entries, extrapolated from a sample"""
+        if len(self._entries) == 0:
+            return sys.getsizeof(self._entries)
+        sample = random.sample(list(self._entries.items()), min(sample_size, len(self)))
+        seen: set[int] = set()
+        sample_bytes = sum(_deep_size(entry, seen) for entry in sample)
+        return sys.getsizeof(self._entries) + sample_bytes * len(self) // len(sample)
+
+    def discard(self, artist_id: str) -> None:
+        self._entries.pop(artist_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+@lru_cache()
+def get_artist_cache() -> ArtistCache:
+    return ArtistCache(get_settings().artist_cache_size)
+
+
+class GenreCache:
+    """Ids by genre name, so writes of artists with known genres skip their
+    lookup. Genres are never renamed or deleted, so entries stay valid while
+    the tables exist (`create_db_and_tables` clears the cache). Only genres of
+    committed transactions may be added."""
+
+    def __init__(self) -> None:
+        self._ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get_many(self, names: Iterable[str]) -> dict[str, int]:
+        return {name: self._ids[name] for name in names if name in self._ids}
+
+    def add_many(self, genres: Iterable[tuple[str, int]]) -> None:
+        """Adds (name, id) pairs"""
+        self._ids.update(genres)
+
+    def discard(self, name: str) -> None:
+        self._ids.pop(name, None)
+
+    def memory_usage(self) -> int:
+        seen: set[int] = set()
+        return sys.getsizeof(self._ids) + sum(
+            _deep_size(item, seen) for item in self._ids.items()
+        )
+
+    def clear(self) -> None:
+        self._ids.clear()
+
+
+# per engine, ids are only valid in the database they were read from
+_genre_caches: WeakKeyDictionary[Engine, GenreCache] = WeakKeyDictionary()
+
+
+def get_genre_cache(bind: Engine | Connection) -> GenreCache:
+    engine = bind.engine
+    cache = _genre_caches.get(engine)
+    if cache is None:
+        cache = _genre_caches[engine] = GenreCache()
+    return cache
+
+
+def _deep_size(value: Any, seen: set[int]) -> int:
+    """Bytes of the value and everything it holds, shared objects counted once"""
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list)):
+        size += sum(_deep_size(item, seen) for item in value)
+    elif isinstance(value, ArtistRecord):
+        size += sum(
+            _deep_size(getattr(value, name), seen) for name in ArtistRecord.__slots__
+        )
+    return size
@@ -0,0 +1,366 @@
+"""Deterministic synthetic artist catalog for scale tests, benchmarks and the
+fake Spotify client (see mocks.CatalogSpotifyClient).
+
+Artists look like replies of the Spotify api: followers are Zipf distributed
+over the catalog (popularity grows with their logarithm), genres are drawn
+from a vocabulary whose use is Zipf distributed as well, and most artists
+have three images. Every artist is derived from the seed and its index
+alone, so any slice of a catalog of millions can be generated without the
+rest. Snapshots model churn: between two snapshots a fraction `churn` of
+the artists changes (followers and popularity, sometimes images or genres).
+
+Run with `python catalog.py [--size 1000000] [--seed 0] [--snapshot 0]
+    [--churn 0.1] [--genres 2000] [--output artists.ndjson | --database-url URL]`
+Without --output or --database-url the NDJSON is written to stdout."""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import cached_property
+from itertools import accumulate
+from typing import Any, BinaryIO, Iterator
+
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from crud import ArtistCrud
+from db import create_db_and_tables
+import schemas
+
+_IMAGE_SIZES = [640, 320, 160]
+
+_GENRE_BASES = [
+    *["pop", "rock", "hip hop", "rap", "jazz", "techno", "house", "folk"],
+    *["metal", "punk", "soul", "r&b", "indie", "trap", "ambient", "blues"],
+    *["country", "reggae", "classical", "edm", "drill", "funk", "disco", "emo"],
+]
+_GENRE_MODIFIERS = [
+    *["", "german", "uk", "dutch", "indie", "dark", "chill", "alternative"],
+    *["deep", "modern", "latin", "k", "j", "nordic", "french", "italian"],
+    *["brazilian", "dream", "progressive", "experimental", "melodic", "lo-fi"],
+]
+_SYLLABLES = [
+    *["ka", "lo", "mi", "ra", "ven", "tor", "sa", "el", "no", "bi", "dan", "rey"],
+    *["zu", "fen", "ta", "mor", "li", "qua", "sen", "do", "ri", "gal", "ny", "os"],
+]
+
+_ALBUM_TYPES = ["album", "single", "compilation"]
+_ALBUM_TYPE_WEIGHTS = [30, 60, 10]
+_TOP_TRACKS = 10
+
+# parts of an artist derived from their own random stream
+_BASE, _CHURN, _FOLLOWERS, _IMAGES, _GENRES, _ALBUMS, _TRACKS = range(7)
+# of the changes of an artist, every n-th replaces the images / the genres
+_IMAGE_CHANGE_EVERY = 5
+_GENRE_CHANGE_EVERY = 10
+
+
+def artist_id(index: int) -> str:
+    """22 characters, like Spotify ids"""
+    return f"{index:022d}"
+
+
+def album_id(index: int, position: int) -> str:
+    """Of the album at `position` in the releases of artist `index`"""
+    return f"{index:012d}a{position:09d}"
+
+
+def artist_index(artist_id: str) -> int | None:
+    """Index of a catalog artist id, None for other ids"""
+    if len(artist_id) != 22 or not artist_id.isdigit():
+        return None
+    return int(artist_id)
+
+
+def genre_vocabulary(size: int) -> list[str]:
+    """`size` distinct genre names, the most used first"""
+    combined = [
+        f"{modifier} {base}".strip()
+        for modifier in _GENRE_MODIFIERS
+        for base in _GENRE_BASES
+        if modifier != base
+    ]
+    names = combined[:size]
+    names.extend(
+        f"{combined[i % len(combined)]} {i // len(combined) + 1}"
+        for i in range(len(combined), size)
+    )
+    return names
+
+
+@dataclass(frozen=True)
+class Catalog:
+    size: int = 1000
+    seed: int = 0
+    genres: int = 2000  # size of the genre vocabulary
+    # relative frequency of artists with 0, 1, 2, ... genres / images
+    genre_count_weights: tuple[float, ...] = (25, 20, 20, 15, 10, 6, 4)
+    image_count_weights: tuple[float, ...] = (8, 2, 2, 88)
+    # followers of the artist of rank r are max_followers / r**exponent
+    followers_exponent: float = 1.5
+    # the genre of rank r is chosen with a weight of 1 / r**exponent
+    genre_exponent: float = 1.0
+    max_followers: int = 100_000_000
+    # albums of the artist of rank r are max(1, max_albums / r**exponent)
+    max_albums: int = 1000
+    albums_exponent: float = 0.75
+    churn: float = 0.1  # fraction of the artists changed from one snapshot to the next
+
+    @cached_property
+    def vocabulary(self) -> list[str]:
+        return genre_vocabulary(self.genres)
+
+    @cached_property
+    def _genre_cum_weights(self) -> list[float]:
+        return list(
+            accumulate(
+                1 / rank**self.genre_exponent for rank in range(1, self.genres + 1)
+            )
+        )
+
+    @cached_property
+    def _rank_step(self) -> int:
+        # ranks are the affine permutation (step * index + offset) mod size
+        step = random.Random(self.seed).randrange(1, max(self.size, 2)) | 1
+        while math.gcd(step, self.size) != 1:
+            step += 1
+        return step
+
+    def _random(self, index: int, part: int, version: int = 0) -> random.Random:
+        return random.Random((self.seed << 96) | (index << 40) | (version << 8) | part)
+
+    def rank(self, index: int) -> int:
+        """Position of the artist by followers, 1 is the most followed"""
+        offset = self.seed % self.size
+        return (self._rank_step * index + offset) % self.size + 1
+
+    def version(self, index: int, snapshot: int) -> int:
+        """Number of changes of the artist up to the snapshot"""
+        churn = self._random(index, _CHURN)
+        return sum(churn.random() < self.churn for _ in range(snapshot))
+
+    def changed(self, index: int, snapshot: int) -> bool:
+        """Whether the artist differs from the previous snapshot"""
+        return snapshot > 0 and self.version(index, snapshot) != self.version(
+            index, snapshot - 1
+        )
+
+    def _followers(self, index: int, version: int) -> int:
+        followers = self.max_followers / self.rank(index) ** self.followers_exponent
+        if version > 0:
+            followers *= 1 + self._random(index, _FOLLOWERS, version).uniform(
+                -0.05, 0.1
+            )
+        return round(followers)
+
+    def _genres(self, index: int, version: int) -> list[str]:
+        rng = self._random(index, _GENRES, version // _GENRE_CHANGE_EVERY)
+        count = rng.choices(
+            range(len(self.genre_count_weights)), self.genre_count_weights
+        )[0]
+        chosen: dict[str, None] = {}
+        while len(chosen) < min(count, self.genres):
+            position = bisect_left(
+                self._genre_cum_weights, rng.random() * self._genre_cum_weights[-1]
+            )
+            chosen[self.vocabulary[min(position, self.genres - 1)]] = None
+        return list(chosen)
+
+    def _images(self, index: int, version: int) -> list[dict[str, Any]]:
+        image_version = version // _IMAGE_CHANGE_EVERY
+        rng = self._random(index, _IMAGES, image_version)
+        count = rng.choices(
+            range(len(self.image_count_weights)), self.image_count_weights
+        )[0]
+        key = rng.getrandbits(96)
+        return [
+            {
+                "url": f"https://i.scdn.co/image/{key:024x}{size:04x}",
+                "height": size,
+                "width": size,
+            }
+            for size in _IMAGE_SIZES[:count]
+        ]
+
+    def artist_data(self, index: int, snapshot: int = 0) -> dict[str, Any]:
+        """The artist as returned by the Spotify api"""
+        id = artist_id(index)
+        version = self.version(index, snapshot)
+        rng = self._random(index, _BASE)
+        words = [
+            "".join(rng.choices(_SYLLABLES, k=rng.randint(1, 3))).capitalize()
+            for _ in range(rng.randint(1, 2))
+        ]
+        followers = self._followers(index, version)
+        return {
+            "id": id,
+            "type": "artist",
+            "href": f"https://api.spotify.com/v1/artists/{id}",
+            "name": " ".join(words),
+            "popularity": min(
+                100, round(100 * math.log1p(followers) / math.log1p(self.max_followers))
+            ),
+            "uri": f"spotify:artist:{id}",
+            "genres": self._genres(index, version),
+            "external_urls": {"spotify": f"https://open.spotify.com/artist/{id}"},
+            "followers": {"href": None, "total": followers},
+            "images": self._images(index, version),
+        }
+
+    def album_count(self, index: int) -> int:
+        return max(1, round(self.max_albums / self.rank(index) ** self.albums_exponent))
+
+    def album_data(self, index: int, position: int) -> dict[str, Any]:
+        """The album as listed by the artist albums endpoint, newest first"""
+        id = album_id(index, position)
+        rng = self._random(index, _ALBUMS, position)
+        album_type = rng.choices(_ALBUM_TYPES, _ALBUM_TYPE_WEIGHTS)[0]
+        # a few releases per year, also of the most prolific artists
+        year = max(1950, 2024 - position // 4)
+        month = 12 - position % 4 * 3
+        return {
+            "id": id,
+            "type": "album",
+            "name": " ".join(
+                "".join(rng.choices(_SYLLABLES, k=rng.randint(1, 3))).capitalize()
+                for _ in range(rng.randint(1, 3))
+            ),
+            "album_type": album_type,
+            "album_group": album_type,
+            "release_date": f"{year}-{month:02d}-{rng.randint(1, 28):02d}",
+            "release_date_precision": "day",
+            "total_tracks": 1 if album_type == "single" else rng.randint(6, 20),
+            "uri": f"spotify:album:{id}",
+            "href": f"https://api.spotify.com/v1/albums/{id}",
+        }
+
+    def albums_page(self, index: int, offset: int, limit: int) -> dict[str, Any]:
+        """A paging object of the artist albums endpoint"""
+        total = self.album_count(index)
+        stop = min(offset + limit, total)
+        return {
+            "items": [self.album_data(index, p) for p in range(offset, stop)],
+            "total": total,
+            "offset": offset,
+            "limit": limit,
+            "next": None if stop >= total else f"?offset={stop}&limit={limit}",
+        }
+
+    def top_tracks_data(self, index: int) -> list[dict[str, Any]]:
+        """The tracks of the artist top tracks endpoint, most popular first"""
+        rng = self._random(index, _TRACKS)
+        popularity = self.artist_data(index)["popularity"]
+        tracks = []
+        for position in range(_TOP_TRACKS):
+            id = f"{index:012d}t{position:09d}"
+            album = self.album_data(index, rng.randrange(self.album_count(index)))
+            tracks.append(
+                {
+                    "id": id,
+                    "type": "track",
+                    "name": album["name"]
+                    if position == 0
+                    else f"{album['name']} {position}",
+                    "popularity": max(0, popularity - position * rng.randint(0, 3)),
+                    "duration_ms": rng.randint(90_000, 360_000),
+                    "uri": f"spotify:track:{id}",
+                    "album": album,
+                }
+            )
+        return tracks
+
+    def artist(self, index: int, snapshot: int = 0) -> schemas.Artist:
+        return schemas.Artist.parse_obj(self.artist_data(index, snapshot))
+
+    def iter_data(
+        self, snapshot: int = 0, start: int = 0, stop: int | None = None
+    ) -> Iterator[dict[str, Any]]:
+        for index in range(start, self.size if stop is None else stop):
+            yield self.artist_data(index, snapshot)
+
+    def iter_artists(
+        self, snapshot: int = 0, batch_size: int = 500
+    ) -> Iterator[list[schemas.Artist]]:
+        for start in range(0, self.size, batch_size):
+            stop = min(start + batch_size, self.size)
+            yield [self.artist(index, snapshot) for index in range(start, stop)]
+
+    def write_ndjson(self, file: BinaryIO, snapshot: int = 0) -> int:
+        """Writes one artist per line, returns the number of artists"""
+        for data in self.iter_data(snapshot):
+            file.write(orjson.dumps(data) + b"\n")
+        return self.size
+
+    async def fill_database(
+        self,
+        session_maker: async_sessionmaker[AsyncSession],
+        snapshot: int = 0,
+        batch_size: int = 500,
+    ) -> None:
+        """Writes the snapshot through the crud, in batches like the update cycle"""
+        for artists in self.iter_artists(snapshot, batch_size):
+            async with session_maker() as session:
+                await ArtistCrud.update_artists(session, artists)
+
+
+PLACEHOLDER_SETTINGS = {
+    "BASE_URL": "http://localhost:8000",
+    "POSTGRES_DB": "unused",
+    "POSTGRES_USER": "unused",
+    "POSTGRES_HOST": "unused",
+    "POSTGRES_PASSWORD": "unused",
+    "CELERY_BROKER_URL": "redis://localhost:6379/0",
+    "CELERY_RESULT_BACKEND": "redis://localhost:6379/0",
+    "SPOTIFY_CLIENT_ID": "unused",
+    "SPOTIFY_CLIENT_SECRET": "unused",
+    "ARTISTS_TO_TRACK": "[]",
+}
+
+
+def use_placeholder_settings() -> None:
+    """Sets the app settings that the environment does not configure, so the
+    crud (e.g. its change bus) works outside of the app"""
+    for key, value in PLACEHOLDER_SETTINGS.items():
+        os.environ.setdefault(key, value)
+
+
+async def _fill(catalog: Catalog, database_url: str, snapshot: int) -> None:
+    engine = create_async_engine(database_url)
+    await create_db_and_tables(engine)
+    await catalog.fill_database(
+        async_sessionmaker(engine, expire_on_commit=False), snapshot
+    )
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--snapshot", type=int, default=0)
+    parser.add_argument("--churn", type=float, default=0.1)
+    parser.add_argument("--genres", type=int, default=2000)
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--output")
+    output.add_argument("--database-url")
+    args = parser.parse_args()
+    catalog = Catalog(
+        size=args.size, seed=args.seed, genres=args.genres, churn=args.churn
+    )
+
+    if args.database_url is not None:
+        use_placeholder_settings()
+        asyncio.run(_fill(catalog, args.database_url, args.snapshot))
+    elif args.output is not None:
+        with open(args.output, "wb") as file:
+            catalog.write_ndjson(file, args.snapshot)
+    else:
+        catalog.write_ndjson(sys.stdout.buffer, args.snapshot)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from base64 import b64encode
 from functools import lru_cache
-from typing import Annotated
+from typing import Annotated, Literal
 from fastapi import Depends
 from pydantic import BaseSettings, AnyHttpUrl, AnyUrl
 
@@ -12,6 +12,8 @@ class Settings(BaseSettings):
     postgres_user: str
     postgres_host: str
     postgres_password: str
+    # overrides the postgres settings above, e.g. sqlite+aiosqlite:///artists.db
+    database_url: str | None = None
 
     celery_broker_url: AnyUrl
     celery_result_backend: AnyUrl
@@ -21,10 +23,81 @@ class Settings(BaseSettings):
 
     artists_to_track: list[str]
 
+    # concurrent Spotify requests per token of the token pool (see token_pool.py)
+    spotify_max_concurrent_requests: int = 4
+    # rate limit per app token of the client credentials flow (the login token is
+    # not limited): requests per second and requests sent at once after a pause
+    spotify_requests_per_second: float = 5.0
+    spotify_request_burst: int = 10
+
+    # fetch artists with app tokens of the client credentials flow instead of the
+    # token of /login, spread over this app and the extra "client_id:client_secret" apps
+    spotify_client_credentials: bool = False
+    spotify_extra_credentials: list[str] = []
+
+    # market (country code) of the top tracks of artists
+    spotify_market: str = "US"
+
+    # responses smaller than this (bytes) are not compressed
+    compression_minimum_size: int = 1024
+
+    # redis to publish artist changes to all processes (needed with the celery worker)
+    change_bus_backend: Literal["redis", "memory"] = "memory"
+
+    # directory shared by all processes (e.g. uvicorn workers) to aggregate metrics
+    metrics_dir: str | None = None
+    metrics_write_interval: float = 5.0
+
+    # render artist responses with orjson, skipping response model validation
+    fast_json_responses: bool = False
+
+    # artists kept in memory per process for GET /artist/{artist_id} (0 disables)
+    artist_cache_size: int = 100_000
+
+    # preloading of the most popular artists and all genres into the caches at
+    # startup (in the background), limited by artists and seconds
+    cache_warmup: bool = True
+    cache_warmup_artists: int = 10000
+    cache_warmup_seconds: float = 30.0
+
+    # upper limit of artists in one bulk edit request (PUT /artists)
+    bulk_edit_max_artists: int = 10000
+
+    # tracing of requests, jobs, Spotify calls and crud methods (see tracing.py)
+    trace_exporter: Literal["none", "console", "file"] = "none"
+    trace_file: str = "traces.jsonl"
+
+    # seconds between the periodic jobs (run by celery beat or the embedded scheduler)
+    update_artists_interval: float = 60.0
+    refresh_token_interval: float = 30.0
+    prune_outbox_interval: float = 3600.0
+    update_releases_interval: float = 86400.0
+
+    # days the artist change outbox keeps its records (GET /artists/outbox)
+    outbox_retention_days: float = 7.0
+
+    # run the periodic jobs inside the api process instead of celery (see scheduler.py)
+    embedded_scheduler: bool = False
+    scheduler_jitter: float = 5.0
+
+    # prevents overlapping update cycles (see lock.py)
+    update_lock_backend: Literal["redis", "postgres", "memory"] = "redis"
+    update_lock_ttl: float = 120.0
+
     def get_auth_header(self) -> str:
-        return b64encode(
-            self.spotify_client_id.encode() + b":" + self.spotify_client_secret.encode()
-        ).decode("utf-8")
+        return auth_header(self.spotify_client_id, self.spotify_client_secret)
+
+    def get_app_credentials(self) -> list[tuple[str, str]]:
+        """(client id, client secret) of this app and the extra apps"""
+        credentials = [(self.spotify_client_id, self.spotify_client_secret)]
+        for extra in self.spotify_extra_credentials:
+            client_id, _, client_secret = extra.partition(":")
+            credentials.append((client_id, client_secret))
+        return credentials
+
+
+def auth_header(client_id: str, client_secret: str) -> str:
+    return b64encode(client_id.encode() + b":" + client_secret.encode()).decode("utf-8")
 
 
 @lru_cache()
@@ -0,0 +1,15 @@
+from typing import Iterator
+
+import pytest
+
+from queries import QueryLog, count_queries
+
+
+@pytest.fixture
+def query_log() -> Iterator[QueryLog]:
+    """Records every statement executed during the test (also by TestClient
+    requests). Assert query budgets with e.g.
+    `query_log.count("ArtistCrud.read_artist")`, `query_log.report()` lists the
+    statements per operation."""
+    with count_queries(all_tasks=True) as log:
+        yield log
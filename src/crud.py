@@ -1,21 +1,44 @@
+import hashlib
+from datetime import datetime, timezone
 from logging import getLogger
-from typing import Annotated, Sequence
+from typing import Annotated, Any, AsyncGenerator, Sequence
 from fastapi import Depends
 
-from sqlalchemy import Select, select, delete, insert
-from sqlalchemy.ext.asyncio import AsyncSessionTransaction
-from sqlalchemy.orm import selectinload
+from sqlalchemy import Select, and_, bindparam, exists, func, or_, select, delete
+from sqlalchemy import insert, inspect, text, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncSessionTransaction
+from sqlalchemy.orm import load_only, raiseload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
 
+from cache import get_genre_cache
 import models
 import schemas
 from db import DbSessionDependency
+from events import get_change_bus
+from metrics import operation
 
 
 _logger = getLogger(__file__)
 
+# artist fields stored in their own tables
+_ARTIST_RELATIONS = {"genres", "external_urls", "followers", "images"}
+
+_image_links = models.image_association_table.c
+_genre_stats = models.GenreStats.__table__.c
+# genre ids, popularity and followers of an artist, what the genre stats count
+_GenreState = tuple[tuple[int, ...], int, int]
+_album_links = models.album_association_table.c
+# transaction level advisory lock of the outbox writers on postgres
+_OUTBOX_LOCK_ID = int.from_bytes(
+    hashlib.sha256(b"spotify_artists:artist_outbox").digest()[:8], "big", signed=True
+)
+
 
 class AuthTokenCrud:
     @staticmethod
+    @operation("AuthTokenCrud.replace_auth_token")
     async def replace_auth_token(
         db_session: DbSessionDependency, new_token: schemas.AuthToken
     ) -> None:
@@ -30,6 +53,7 @@ class AuthTokenCrud:
             await db_session.execute(create_query)
 
     @staticmethod
+    @operation("AuthTokenCrud.read_auth_token")
     async def read_auth_token(
         db_session: DbSessionDependency,
     ) -> schemas.AuthToken | None:
@@ -45,6 +69,7 @@ class AuthTokenCrud:
 
 class ArtistCrud:
     @staticmethod
+    @operation("ArtistCrud.update_artist")
     async def update_artist(
         db_session: DbSessionDependency,
         updated_artist: schemas.Artist,
@@ -57,18 +82,58 @@ class ArtistCrud:
         return ret[0]
 
     @staticmethod
+    @operation("ArtistCrud.update_artists")
     async def update_artists(
         db_session: DbSessionDependency,
         updated_artists: Sequence[schemas.Artist],
         skip_modified_manually: bool = True,
         manual: bool = False,
     ) -> Sequence[schemas.Artist]:
+        artists, _ = await ArtistCrud._write_artists(
+            db_session, updated_artists, skip_modified_manually, manual
+        )
+        return artists
+
+    @staticmethod
+    @operation("ArtistCrud.bulk_update_artists")
+    async def bulk_update_artists(
+        db_session: DbSessionDependency, updated_artists: Sequence[schemas.Artist]
+    ) -> list[schemas.BulkArtistResult]:
+        """Manual edits of many artists in one transaction (created if missing)"""
+        artists, created = await ArtistCrud._write_artists(
+            db_session, updated_artists, False, True
+        )
+        artists_dict = {artist.id: artist for artist in artists}
+        return [
+            schemas.BulkArtistResult(
+                id=artist.id,
+                status=schemas.BulkArtistStatus.created
+                if artist.id in created
+                else schemas.BulkArtistStatus.updated,
+                artist=artists_dict[artist.id],
+            )
+            for artist in updated_artists
+        ]
+
+    @staticmethod
+    async def _write_artists(
+        db_session: DbSessionDependency,
+        updated_artists: Sequence[schemas.Artist],
+        skip_modified_manually: bool,
+        manual: bool,
+    ) -> tuple[list[schemas.Artist], set[str]]:
+        """Returns the written artists and the ids of the newly created ones"""
+        created: set[str] = set()
         async with db_session.begin() as transaction:
             # create genres beforhand (creating when creating the artists leads to errors of missing id values)
             genres = await ArtistCrud._create_genres_if_missing(
                 transaction,
                 [genre.name for artist in updated_artists for genre in artist.genres],
             )
+            images = await ArtistCrud._create_images_if_missing(
+                transaction,
+                [image for artist in updated_artists for image in artist.images],
+            )
 
             artists_in_db_query = ArtistCrud._select_artists_with_relations().where(
                 models.Artist.id.in_([a.id for a in updated_artists])
@@ -78,12 +143,22 @@ class ArtistCrud:
                 (await db_session.execute(artists_in_db_query)).scalars().all()
             )
             artists_in_db_dict = {a.id: a for a in artists_in_db}
+            genres_dict = {g.name: g for g in genres}
+            refreshed = datetime.now(timezone.utc)
+            changes: list[schemas.ArtistChange] = []
+            genre_states: list[tuple[_GenreState | None, _GenreState]] = []
+            removed_links: list[tuple[str, int]] = []
+            added_links: list[dict[str, Any]] = []
 
             for updated_artist in updated_artists:
                 artist_in_db = artists_in_db_dict.get(updated_artist.id)
 
-                artist_dict = updated_artist.dict()
-                artist_dict["genres"] = genres
+                artist_dict = updated_artist.dict(exclude={"images"})
+                artist_dict["content_hash"] = updated_artist.content_hash()
+                artist_dict["refreshed"] = refreshed
+                artist_dict["genres"] = [
+                    genres_dict[genre.name] for genre in updated_artist.genres
+                ]
                 artist_dict["external_urls"] = models.ExternalUrls(
                     **updated_artist.external_urls.dict(), id=updated_artist.id
                 )
@@ -91,14 +166,23 @@ class ArtistCrud:
                     **updated_artist.followers.dict(), id=updated_artist.id
                 )
 
-                if artist_in_db is None:
-                    artist_dict["images"] = [
-                        models.Image(**image.dict()) for image in updated_artist.images
-                    ]
+                # a url listed twice is linked once
+                artist_images = list(
+                    {
+                        images[str(image.url)].id: images[str(image.url)]
+                        for image in updated_artist.images
+                    }.values()
+                )
 
+                if artist_in_db is None:
                     artist = models.Artist(**artist_dict)
                     artist.modified_manually = manual
                     db_session.add(artist)
+                    artists_in_db_dict[artist.id] = artist
+                    created.add(updated_artist.id)
+                    changes.append(ArtistCrud._artist_change(None, updated_artist))
+                    genre_states.append((None, ArtistCrud._genre_state(artist)))
+                    old_image_ids: list[int] = []
                 else:
                     if (
                         not manual
@@ -107,25 +191,76 @@ class ArtistCrud:
                     ):
                         continue
 
-                    artist_dict["images"] = ArtistCrud._update_images(
-                        updated_artist.images, artist_in_db.images
+                    content_changed = (
+                        artist_in_db.content_hash != artist_dict["content_hash"]
                     )
+                    if content_changed:
+                        changes.append(
+                            ArtistCrud._artist_change(
+                                schemas.Artist.from_orm_trusted(artist_in_db),
+                                updated_artist,
+                            )
+                        )
+                        old_state = ArtistCrud._genre_state(artist_in_db)
 
                     artist_dict["modified_manually"] = manual
 
                     for key in artist_dict.keys():
                         setattr(artist_in_db, key, artist_dict[key])
-            artists_in_db = (
-                (await db_session.execute(artists_in_db_query)).scalars().all()
+                    if content_changed:
+                        genre_states.append(
+                            (old_state, ArtistCrud._genre_state(artist_in_db))
+                        )
+                    artist = artist_in_db
+                    old_image_ids = [image.id for image in artist_in_db.images]
+
+                removed, added = ArtistCrud._diff_image_links(
+                    old_image_ids, [image.id for image in artist_images]
+                )
+                removed_links.extend((artist.id, image_id) for image_id in removed)
+                added_links.extend(
+                    {"artist_id": artist.id, "image_id": image_id, "position": position}
+                    for position, image_id in added
+                )
+                # the links are written below, the relationship is read only
+                set_committed_value(artist, "images", artist_images)
+
+            # new artists have to exist before they are linked
+            await db_session.flush()
+            await ArtistCrud._write_image_links(transaction, removed_links, added_links)
+            await ArtistCrud._write_genre_stats(
+                transaction, ArtistCrud._genre_stats_deltas(genre_states)
+            )
+            await ArtistCrud._write_outbox(
+                transaction,
+                changes,
+                {id: artist.content_hash for id, artist in artists_in_db_dict.items()},
+                refreshed,
             )
-            return [schemas.Artist.from_orm(artist) for artist in artists_in_db]
+
+            # the session holds the written state, no need to select it again
+            ret = [
+                schemas.Artist.from_orm_trusted(artists_in_db_dict[artist_id])
+                for artist_id in dict.fromkeys(a.id for a in updated_artists)
+            ]
+
+        # only cached and published once committed
+        get_genre_cache(db_session.get_bind()).add_many(
+            (genre.name, genre.id) for genre in genres
+        )
+        await ArtistCrud._publish(changes)
+        return ret, created
 
     @staticmethod
+    @operation("ArtistCrud.read_artist")
     async def read_artist(
-        db_session: DbSessionDependency, artist_id: str
-    ) -> schemas.Artist | None:
+        db_session: DbSessionDependency,
+        artist_id: str,
+        fields: tuple[str, ...] | None = None,
+    ) -> schemas.Artist | schemas.ArtistProjection | None:
+        """Only the given fields (see `schemas.artist_fields`) are loaded if set"""
         async with db_session.begin():
-            query = ArtistCrud._select_artists_with_relations().where(
+            query = ArtistCrud._select_artists_with_relations(fields).where(
                 models.Artist.id == artist_id
             )
 
@@ -133,9 +268,106 @@ class ArtistCrud:
             if artist_db is None:
                 return
 
-        return schemas.Artist.from_orm(artist_db)
+        return ArtistCrud._to_schema(artist_db, fields)
+
+    @staticmethod
+    @operation("ArtistCrud.iter_artists")
+    async def iter_artists(
+        db_session: DbSessionDependency,
+        batch_size: int = 500,
+        fields: tuple[str, ...] | None = None,
+    ) -> AsyncGenerator[list[schemas.Artist | schemas.ArtistProjection], None]:
+        # keyset pagination, so no transaction is held open between batches
+        last_id = ""
+        while True:
+            async with db_session.begin():
+                query = (
+                    ArtistCrud._select_artists_with_relations(fields)
+                    .where(models.Artist.id > last_id)
+                    .order_by(models.Artist.id)
+                    .limit(batch_size)
+                )
+                artists_db = (await db_session.execute(query)).scalars().all()
+                batch = [ArtistCrud._to_schema(artist, fields) for artist in artists_db]
+
+            if len(batch) == 0:
+                return
+            yield batch
+            last_id = batch[-1].id
 
     @staticmethod
+    @operation("ArtistCrud.iter_popular_artists")
+    async def iter_popular_artists(
+        db_session: DbSessionDependency, batch_size: int = 500
+    ) -> AsyncGenerator[list[tuple[schemas.Artist, str]], None]:
+        """Artists with their content hash, the most popular first (e.g. to warm
+        caches). Keyset pagination like `iter_artists`."""
+        last: tuple[int, str] | None = None
+        while True:
+            async with db_session.begin():
+                query = (
+                    ArtistCrud._select_artists_with_relations()
+                    .order_by(models.Artist.popularity.desc(), models.Artist.id)
+                    .limit(batch_size)
+                )
+                if last is not None:
+                    query = query.where(
+                        or_(
+                            models.Artist.popularity < last[0],
+                            and_(
+                                models.Artist.popularity == last[0],
+                                models.Artist.id > last[1],
+                            ),
+                        )
+                    )
+                artists_db = (await db_session.execute(query)).scalars().all()
+                batch = [
+                    (schemas.Artist.from_orm_trusted(artist), artist.content_hash)
+                    for artist in artists_db
+                ]
+
+            if len(batch) == 0:
+                return
+            yield batch
+            last = (batch[-1][0].popularity, batch[-1][0].id)
+
+    @staticmethod
+    @operation("ArtistCrud.read_genres")
+    async def read_genres(db_session: DbSessionDependency) -> list[tuple[str, int]]:
+        """(name, id) of all genres"""
+        async with db_session.begin():
+            query = select(models.Genre.name, models.Genre.id)
+            return [tuple(row) for row in await db_session.execute(query)]
+
+    @staticmethod
+    @operation("ArtistCrud.read_artist_version")
+    async def read_artist_version(
+        db_session: DbSessionDependency, artist_id: str
+    ) -> schemas.ArtistVersion | None:
+        async with db_session.begin():
+            # only the version columns, no relations are loaded
+            query = select(
+                models.Artist.content_hash,
+                models.Artist.refreshed,
+                models.Artist.modified_manually,
+            ).where(models.Artist.id == artist_id)
+
+            row = (await db_session.execute(query)).one_or_none()
+            if row is None:
+                return None
+
+        refreshed = row.refreshed
+        if refreshed.tzinfo is None:
+            # sqlite does not store time zones
+            refreshed = refreshed.replace(tzinfo=timezone.utc)
+        return schemas.ArtistVersion(
+            content_hash=row.content_hash,
+            refreshed=refreshed,
+            modified_manually=row.modified_manually,
+        )
+
+    @staticmethod
+    @operation("ArtistCrud.create_artist")
     async def create_artist(
         db_session: DbSessionDependency, artist: schemas.Artist
     ) -> schemas.Artist:
@@ -144,8 +376,12 @@ class ArtistCrud:
                 transaction,
                 [genres.name for genres in artist.genres],
             )
+            images = await ArtistCrud._create_images_if_missing(
+                transaction, artist.images
+            )
 
-            artist_dict = artist.dict()
+            artist_dict = artist.dict(exclude={"images"})
+            artist_dict["content_hash"] = artist.content_hash()
             artist_dict["genres"] = genres
             artist_dict["external_urls"] = models.ExternalUrls(
                 **artist.external_urls.dict(), id=artist.id
@@ -153,73 +389,829 @@ class ArtistCrud:
             artist_dict["followers"] = models.Followers(
                 **artist.followers.dict(), id=artist.id
             )
-            artist_dict["images"] = [
-                models.Image(**image.dict()) for image in artist.images
-            ]
+            artist_images = list(
+                {
+                    images[str(i.url)].id: images[str(i.url)] for i in artist.images
+                }.values()
+            )
             artist_db = models.Artist(**artist_dict)
             artist_db.modified_manually = True
             db_session.add(artist_db)
+            set_committed_value(artist_db, "images", artist_images)
+
+            await db_session.flush()
+            await ArtistCrud._write_image_links(
+                transaction,
+                [],
+                [
+                    {"artist_id": artist.id, "image_id": image.id, "position": position}
+                    for position, image in enumerate(artist_images)
+                ],
+            )
+            await ArtistCrud._write_genre_stats(
+                transaction,
+                ArtistCrud._genre_stats_deltas(
+                    [(None, ArtistCrud._genre_state(artist_db))]
+                ),
+            )
+            change = ArtistCrud._artist_change(None, artist)
+            await ArtistCrud._write_outbox(
+                transaction,
+                [change],
+                {artist.id: artist_dict["content_hash"]},
+                datetime.now(timezone.utc),
+            )
 
-        return schemas.Artist.from_orm(artist_db)
+        get_genre_cache(db_session.get_bind()).add_many(
+            (genre.name, genre.id) for genre in genres
+        )
+        await ArtistCrud._publish([change])
+        return schemas.Artist.from_orm_trusted(artist_db)
 
     @staticmethod
+    @operation("ArtistCrud.delete_artist")
     async def delete_artist(db_session: DbSessionDependency, artist_id: str) -> None:
-        async with db_session.begin():
+        async with db_session.begin() as transaction:
+            genres_query = (
+                select(models.Genre.id, models.Genre.name)
+                .join(models.Genre.artists)
+                .where(models.Artist.id == artist_id)
+            )
+            genres = (await db_session.execute(genres_query)).all()
+            genre_names = [genre.name for genre in genres]
+            counted_query = (
+                select(models.Artist.popularity, models.Followers.total)
+                .outerjoin(models.Artist.followers)
+                .where(models.Artist.id == artist_id)
+            )
+            counted = (await db_session.execute(counted_query)).one_or_none()
+
+            # explicitly, SQLite does not enforce the cascade of the foreign key
+            links_query = (
+                delete(models.image_association_table)
+                .where(_image_links.artist_id == artist_id)
+                .returning(_image_links.image_id)
+            )
+            image_ids = (await db_session.execute(links_query)).scalars().all()
+            await ArtistCrud._delete_unused_images(db_session, image_ids)
+            await ReleaseCrud._delete_releases(db_session, [artist_id])
+
             query = delete(models.Artist).where(models.Artist.id == artist_id)
 
-            await db_session.execute(query)
+            result = await db_session.execute(query)
+
+            change = schemas.ArtistChange(
+                artist_id=artist_id, genres=list(genre_names), deleted=True
+            )
+            if counted is not None:
+                old_state = (
+                    tuple(genre.id for genre in genres),
+                    counted.popularity,
+                    counted.total or 0,
+                )
+                await ArtistCrud._write_genre_stats(
+                    transaction, ArtistCrud._genre_stats_deltas([(old_state, None)])
+                )
+            # last, it serializes the writers until they commit
+            if result.rowcount != 0:
+                await ArtistCrud._write_outbox(
+                    transaction, [change], {}, datetime.now(timezone.utc)
+                )
+
+        if result.rowcount != 0:
+            await ArtistCrud._publish([change])
 
     @staticmethod
+    @operation("ArtistCrud._create_genres_if_missing")
     async def _create_genres_if_missing(
         transaction: AsyncSessionTransaction, genre_names: Sequence[str]
     ) -> Sequence[models.Genre]:
-        async with transaction.session.begin_nested():
+        """Genres known to the genre cache are not looked up. Add the returned
+        genres to the cache once the transaction is committed."""
+        session = transaction.session
+        genre_cache = get_genre_cache(session.get_bind())
+        cached_genres: list[models.Genre] = []
+        for name, genre_id in genre_cache.get_many(genre_names).items():
+            genre = ArtistCrud._attach_genre(session, name, genre_id)
+            if genre is not None:
+                cached_genres.append(genre)
+            else:
+                _logger.warning("cached id of genre %s is outdated", name)
+                genre_cache.discard(name)
+        cached_names = {genre.name for genre in cached_genres}
+        # batches usually contain the same genre several times
+        uncached_names = [
+            g for g in dict.fromkeys(genre_names) if g not in cached_names
+        ]
+        if len(uncached_names) == 0:
+            return cached_genres
+
+        async with session.begin_nested():
             genres_in_db_query = select(models.Genre).where(
-                models.Genre.name.in_(genre_names)
-            )
-            genres_in_db = (
-                (await transaction.session.execute(genres_in_db_query)).scalars().all()
+                models.Genre.name.in_(uncached_names)
             )
-            present_genre_names = [g.name for g in genres_in_db]
+            genres_in_db = (await session.execute(genres_in_db_query)).scalars().all()
+            present_genre_names = {g.name for g in genres_in_db}
             missing_genre_names = [
-                g for g in genre_names if g not in present_genre_names
+                g for g in uncached_names if g not in present_genre_names
             ]
 
-            if len(missing_genre_names) != 0:
-                insert_genres_query = insert(models.Genre).values(
-                    [{"name": name} for name in missing_genre_names]
+            if len(missing_genre_names) == 0:
+                return [*cached_genres, *genres_in_db]
+
+            insert_genres_query = insert(models.Genre).returning(models.Genre)
+            created_genres = (
+                await session.scalars(
+                    insert_genres_query,
+                    [{"name": name} for name in missing_genre_names],
                 )
-                await transaction.session.execute(insert_genres_query)
+            ).all()
+            # every genre has its stats row, so they are only updated later
+            await session.execute(
+                insert(models.GenreStats),
+                [{"genre_id": genre.id} for genre in created_genres],
+            )
+            return [*cached_genres, *genres_in_db, *created_genres]
+
+    @staticmethod
+    def _attach_genre(
+        session: AsyncSession, name: str, genre_id: int
+    ) -> models.Genre | None:
+        """The genre as a persistent object of the session, without a query.
+        None if the session loaded another genre with this id (outdated cache)."""
+        loaded = session.identity_map.get(identity_key(models.Genre, genre_id))
+        if loaded is not None:
+            # without loading expired attributes
+            return loaded if inspect(loaded).dict.get("name") == name else None
+        genre = models.Genre(id=genre_id, name=name)
+        make_transient_to_detached(genre)
+        session.add(genre)
+        return genre
+
+    @staticmethod
+    def _genre_state(artist: models.Artist) -> _GenreState:
+        followers = artist.followers.total if artist.followers is not None else 0
+        genre_ids = tuple(dict.fromkeys(genre.id for genre in artist.genres))
+        return genre_ids, artist.popularity, followers
+
+    @staticmethod
+    def _genre_stats_deltas(
+        states: Sequence[tuple[_GenreState | None, _GenreState | None]],
+    ) -> dict[int, tuple[int, int, int]]:
+        """Changes of (artist count, popularity sum, followers sum) per genre id
+        for artists going from the old to the new state (None if not stored)"""
+        deltas: dict[int, list[int]] = {}
+        for old, new in states:
+            for state, sign in [(old, -1), (new, 1)]:
+                if state is None:
+                    continue
+                genre_ids, popularity, followers = state
+                for genre_id in genre_ids:
+                    delta = deltas.setdefault(genre_id, [0, 0, 0])
+                    delta[0] += sign
+                    delta[1] += sign * popularity
+                    delta[2] += sign * followers
+        return {
+            genre_id: (count, popularity, followers)
+            for genre_id, (count, popularity, followers) in deltas.items()
+            if count != 0 or popularity != 0 or followers != 0
+        }
 
-            all_genres_query = select(models.Genre).where(
-                models.Genre.name.in_(genre_names)
+    @staticmethod
+    @operation("ArtistCrud._write_genre_stats")
+    async def _write_genre_stats(
+        transaction: AsyncSessionTransaction,
+        deltas: dict[int, tuple[int, int, int]],
+    ) -> None:
+        """Adds the deltas in one statement, increments instead of read and
+        write, so concurrent transactions do not lose updates"""
+        if len(deltas) == 0:
+            return
+        query = (
+            update(models.GenreStats.__table__)
+            .where(_genre_stats.genre_id == bindparam("b_genre_id"))
+            .values(
+                artist_count=_genre_stats.artist_count + bindparam("b_count"),
+                popularity_sum=_genre_stats.popularity_sum + bindparam("b_popularity"),
+                followers_sum=_genre_stats.followers_sum + bindparam("b_followers"),
             )
-            return (await transaction.session.execute(all_genres_query)).scalars().all()
+        )
+        await transaction.session.execute(
+            query,
+            [
+                {
+                    "b_genre_id": genre_id,
+                    "b_count": count,
+                    "b_popularity": popularity,
+                    "b_followers": followers,
+                }
+                for genre_id, (count, popularity, followers) in deltas.items()
+            ],
+        )
 
     @staticmethod
-    def _update_images(
-        new_images: list[schemas.Image], old_images: list[models.Image]
-    ) -> list[models.Image]:
-        old_urls = [image.url for image in old_images]
-        new_urls = [image.url for image in new_images]
-        missing_images = [image for image in new_images if image.url not in old_urls]
-        old_images_to_keep = [image for image in old_images if image.url in new_urls]
-        new_images_to_create = [
-            models.Image(**image.dict()) for image in missing_images
-        ]
+    @operation("ArtistCrud._write_outbox")
+    async def _write_outbox(
+        transaction: AsyncSessionTransaction,
+        changes: Sequence[schemas.ArtistChange],
+        versions: dict[str, str],
+        created: datetime,
+    ) -> None:
+        """Records the changes for consumers (see ArtistOutboxCrud) in one statement.
+        Call it last in the transaction, writers wait for each other from here
+        until they commit."""
+        if len(changes) == 0:
+            return
+        if transaction.session.get_bind().dialect.name == "postgresql":
+            # positions are assigned in commit order: a concurrent writer only
+            # gets its positions once this transaction ended, so no record can
+            # commit behind the cursor of a consumer (SQLite serializes writers)
+            await transaction.session.execute(
+                text("SELECT pg_advisory_xact_lock(:lock_id)"),
+                {"lock_id": _OUTBOX_LOCK_ID},
+            )
+        await transaction.session.execute(
+            insert(models.ArtistOutbox),
+            [
+                {
+                    "artist_id": change.artist_id,
+                    "fields": list(change.changes),
+                    "version": versions.get(change.artist_id, ""),
+                    "deleted": change.deleted,
+                    "created": created,
+                }
+                for change in changes
+            ],
+        )
+
+    @staticmethod
+    async def _publish(changes: Sequence[schemas.ArtistChange]) -> None:
+        # after the commit, the outbox holds the changes even if the bus fails
+        try:
+            await get_change_bus().publish(changes)
+        except Exception:
+            _logger.exception("publishing %d artist changes failed", len(changes))
+
+    @staticmethod
+    def _artist_change(
+        old_artist: schemas.Artist | None, new_artist: schemas.Artist
+    ) -> schemas.ArtistChange:
+        new_dict = new_artist.dict()
+        genres = [genre.name for genre in new_artist.genres]
+        if old_artist is None:
+            return schemas.ArtistChange(
+                artist_id=new_artist.id, genres=genres, changes=new_dict
+            )
+
+        old_dict = old_artist.dict()
+        # subscribers of a removed genre are notified as well
+        genres.extend(
+            genre.name for genre in old_artist.genres if genre.name not in genres
+        )
+        return schemas.ArtistChange(
+            artist_id=new_artist.id,
+            genres=genres,
+            changes={
+                key: value
+                for key, value in new_dict.items()
+                if old_dict.get(key) != value
+            },
+        )
+
+    @staticmethod
+    @operation("ArtistCrud._create_images_if_missing")
+    async def _create_images_if_missing(
+        transaction: AsyncSessionTransaction, images: Sequence[schemas.Image]
+    ) -> dict[str, models.Image]:
+        """The stored images by url, the missing ones are inserted in one statement"""
+        images_by_url = {str(image.url): image for image in images}
+        if len(images_by_url) == 0:
+            return {}
+
+        session = transaction.session
+        async with session.begin_nested():
+            images_in_db_query = select(models.Image).where(
+                models.Image.url.in_(images_by_url)
+            )
+            images_in_db = {
+                image.url: image
+                for image in (await session.execute(images_in_db_query)).scalars()
+            }
+            missing_images = [
+                {"url": url, "height": image.height, "width": image.width}
+                for url, image in images_by_url.items()
+                if url not in images_in_db
+            ]
+            if len(missing_images) != 0:
+                insert_images_query = insert(models.Image).returning(models.Image)
+                created_images = await session.scalars(
+                    insert_images_query, missing_images
+                )
+                images_in_db.update((image.url, image) for image in created_images)
+
+            for url, image in images_in_db.items():
+                # the same url with another size, keep the latest
+                new_image = images_by_url[url]
+                if (image.height, image.width) != (new_image.height, new_image.width):
+                    image.height = new_image.height
+                    image.width = new_image.width
+        return images_in_db
+
+    @staticmethod
+    def _diff_image_links(
+        old_image_ids: Sequence[int], new_image_ids: Sequence[int]
+    ) -> tuple[set[int], list[tuple[int, int]]]:
+        """The image ids to unlink and the (position, image id) pairs to link,
+        an image that moved in the list is unlinked and linked again"""
+        old_links = set(enumerate(old_image_ids))
+        new_links = set(enumerate(new_image_ids))
+        removed = {image_id for _, image_id in old_links - new_links}
+        return removed, sorted(new_links - old_links)
+
+    @staticmethod
+    @operation("ArtistCrud._write_image_links")
+    async def _write_image_links(
+        transaction: AsyncSessionTransaction,
+        removed_links: Sequence[tuple[str, int]],
+        added_links: Sequence[dict[str, Any]],
+    ) -> None:
+        """Deletes and inserts only the changed links, each in one statement"""
+        session = transaction.session
+        if len(removed_links) != 0:
+            delete_links_query = delete(models.image_association_table).where(
+                tuple_(_image_links.artist_id, _image_links.image_id).in_(removed_links)
+            )
+            await session.execute(delete_links_query)
+        if len(added_links) != 0:
+            await session.execute(insert(models.image_association_table), added_links)
+        await ArtistCrud._delete_unused_images(
+            session, {image_id for _, image_id in removed_links}
+        )
 
-        old_images_to_keep.extend(new_images_to_create)
-        return old_images_to_keep
+    @staticmethod
+    async def _delete_unused_images(
+        session: AsyncSession, image_ids: Sequence[int] | set[int]
+    ) -> None:
+        """Of the given images, deletes the ones no artist links anymore"""
+        if len(image_ids) == 0:
+            return
+        linked = exists().where(_image_links.image_id == models.Image.id)
+        delete_images_query = (
+            delete(models.Image)
+            .where(models.Image.id.in_(image_ids), ~linked)
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(delete_images_query)
 
     @staticmethod
-    def _select_artists_with_relations() -> Select[tuple[models.Artist]]:
+    def _select_artists_with_relations(
+        fields: tuple[str, ...] | None = None,
+    ) -> Select[tuple[models.Artist]]:
+        if fields is None:
+            return select(models.Artist).options(
+                selectinload(models.Artist.genres),
+                selectinload(models.Artist.external_urls),
+                selectinload(models.Artist.followers),
+                selectinload(models.Artist.images),
+            )
+
+        columns = [f for f in fields if f not in _ARTIST_RELATIONS]
+        relations = [f for f in fields if f in _ARTIST_RELATIONS]
         return select(models.Artist).options(
-            selectinload(models.Artist.genres),
-            selectinload(models.Artist.external_urls),
-            selectinload(models.Artist.followers),
-            selectinload(models.Artist.images),
+            load_only(*[getattr(models.Artist, column) for column in columns]),
+            *[selectinload(getattr(models.Artist, r)) for r in relations],
+            # not requested relations fail loudly instead of being lazy loaded
+            raiseload("*"),
         )
 
+    @staticmethod
+    def _to_schema(
+        artist: models.Artist, fields: tuple[str, ...] | None
+    ) -> schemas.Artist | schemas.ArtistProjection:
+        if fields is None:
+            return schemas.Artist.from_orm_trusted(artist)
+        return schemas.artist_projection(fields).from_orm_trusted(artist)
+
+
+class ArtistOutboxCrud:
+    """Incremental sync of artist changes: consumers keep the cursor of the
+    last page and fetch the records after it"""
+
+    @staticmethod
+    @operation("ArtistOutboxCrud.read_changes")
+    async def read_changes(
+        db_session: DbSessionDependency, after: int = 0, limit: int = 1000
+    ) -> schemas.OutboxPage:
+        """The oldest `limit` records after the cursor `after`. Writers assign
+        positions in commit order (see `ArtistCrud._write_outbox`), so records
+        never appear behind a cursor."""
+        async with db_session.begin():
+            query = (
+                select(
+                    models.ArtistOutbox.id,
+                    models.ArtistOutbox.artist_id,
+                    models.ArtistOutbox.fields,
+                    models.ArtistOutbox.version,
+                    models.ArtistOutbox.deleted,
+                    models.ArtistOutbox.created,
+                )
+                .where(models.ArtistOutbox.id > after)
+                .order_by(models.ArtistOutbox.id)
+                .limit(limit)
+            )
+            rows = (await db_session.execute(query)).all()
+
+        # written by the crud, no need to validate
+        records = [
+            schemas.OutboxRecord.construct(
+                position=row.id,
+                artist_id=row.artist_id,
+                fields=row.fields,
+                version=row.version,
+                deleted=row.deleted,
+                created=row.created if row.created.tzinfo is not None
+                # sqlite does not store time zones
+                else row.created.replace(tzinfo=timezone.utc),
+            )
+            for row in rows
+        ]
+        cursor = records[-1].position if len(records) != 0 else after
+        return schemas.OutboxPage.construct(records=records, cursor=cursor)
+
+    @staticmethod
+    @operation("ArtistOutboxCrud.prune_changes")
+    async def prune_changes(
+        db_session: DbSessionDependency, older_than: datetime, batch_size: int = 10000
+    ) -> int:
+        """Deletes the records created before `older_than`, one transaction per
+        batch to keep locks short. Returns the number of deleted records."""
+        deleted = 0
+        while True:
+            async with db_session.begin():
+                batch = (
+                    select(models.ArtistOutbox.id)
+                    .where(models.ArtistOutbox.created < older_than)
+                    .order_by(models.ArtistOutbox.id)
+                    .limit(batch_size)
+                )
+                query = (
+                    delete(models.ArtistOutbox)
+                    .where(models.ArtistOutbox.id.in_(batch.scalar_subquery()))
+                    .execution_options(synchronize_session=False)
+                )
+                result = await db_session.execute(query)
+            deleted += result.rowcount
+            if result.rowcount < batch_size:
+                return deleted
+
+
+class ReleaseCrud:
+    """Albums and top tracks of artists. Albums are written in batches while
+    their pages are fetched, links not seen by a complete fetch are pruned."""
+
+    @staticmethod
+    @operation("ReleaseCrud.read_stored_artist_ids")
+    async def read_stored_artist_ids(
+        db_session: DbSessionDependency, artist_ids: Sequence[str]
+    ) -> list[str]:
+        """The given artists that are stored, in the given order"""
+        async with db_session.begin():
+            query = select(models.Artist.id).where(models.Artist.id.in_(artist_ids))
+            stored = set((await db_session.scalars(query)).all())
+        return [artist_id for artist_id in artist_ids if artist_id in stored]
+
+    @staticmethod
+    @operation("ReleaseCrud.write_artist_albums")
+    async def write_artist_albums(
+        db_session: DbSessionDependency,
+        artist_albums: Sequence[tuple[str, schemas.Album]],
+        refreshed: datetime,
+    ) -> int:
+        """Writes the new and changed albums and links them to their artists, all
+        in one transaction. Returns the number of written albums."""
+        albums = {album.id: album for _, album in artist_albums}
+        if len(albums) == 0:
+            return 0
+
+        async with db_session.begin():
+            stored_query = select(
+                models.Album.id,
+                models.Album.name,
+                models.Album.album_type,
+                models.Album.release_date,
+                models.Album.total_tracks,
+                models.Album.uri,
+            ).where(models.Album.id.in_(albums))
+            stored = {
+                row.id: tuple(row) for row in await db_session.execute(stored_query)
+            }
+            new_albums: list[dict[str, Any]] = []
+            changed_albums: list[dict[str, Any]] = []
+            for album in albums.values():
+                values = album.dict(exclude={"album_group"})
+                if album.id not in stored:
+                    new_albums.append(values)
+                elif stored[album.id] != tuple(values.values()):
+                    changed_albums.append(values)
+            if len(new_albums) != 0:
+                await db_session.execute(insert(models.Album), new_albums)
+            if len(changed_albums) != 0:
+                # bulk update by primary key
+                await db_session.execute(update(models.Album), changed_albums)
+
+            links = {(artist_id, album.id): album for artist_id, album in artist_albums}
+            pairs = list(links)
+            links_query = select(
+                _album_links.artist_id, _album_links.album_id, _album_links.album_group
+            ).where(tuple_(_album_links.artist_id, _album_links.album_id).in_(pairs))
+            linked = {
+                (row.artist_id, row.album_id): row.album_group
+                for row in await db_session.execute(links_query)
+            }
+            unchanged = [
+                pair
+                for pair, group in linked.items()
+                if links[pair].album_group == group
+            ]
+            if len(unchanged) != 0:
+                refresh_links_query = (
+                    update(models.album_association_table)
+                    .where(
+                        tuple_(_album_links.artist_id, _album_links.album_id).in_(
+                            unchanged
+                        )
+                    )
+                    .values(refreshed=refreshed)
+                )
+                await db_session.execute(refresh_links_query)
+            # e.g. reclassified by Spotify from appears_on to album
+            regrouped = [
+                {
+                    "b_artist_id": artist_id,
+                    "b_album_id": album_id,
+                    "b_group": links[(artist_id, album_id)].album_group,
+                }
+                for (artist_id, album_id), group in linked.items()
+                if links[(artist_id, album_id)].album_group != group
+            ]
+            if len(regrouped) != 0:
+                regroup_query = (
+                    update(models.album_association_table)
+                    .where(
+                        _album_links.artist_id == bindparam("b_artist_id"),
+                        _album_links.album_id == bindparam("b_album_id"),
+                    )
+                    .values(album_group=bindparam("b_group"), refreshed=refreshed)
+                )
+                await db_session.execute(regroup_query, regrouped)
+            new_links = [
+                {
+                    "artist_id": artist_id,
+                    "album_id": album.id,
+                    "album_group": album.album_group,
+                    "refreshed": refreshed,
+                }
+                for (artist_id, _), album in links.items()
+                if (artist_id, album.id) not in linked
+            ]
+            if len(new_links) != 0:
+                await db_session.execute(
+                    insert(models.album_association_table), new_links
+                )
+        return len(new_albums) + len(changed_albums)
+
+    @staticmethod
+    @operation("ReleaseCrud.prune_artist_albums")
+    async def prune_artist_albums(
+        db_session: DbSessionDependency,
+        artist_ids: Sequence[str],
+        refreshed_before: datetime,
+    ) -> int:
+        """Unlinks the albums of the artists that were not refreshed since
+        `refreshed_before` (call after fetching all of their albums) and deletes
+        albums no artist links anymore. Returns the number of removed links."""
+        if len(artist_ids) == 0:
+            return 0
+        async with db_session.begin():
+            links_query = (
+                delete(models.album_association_table)
+                .where(
+                    _album_links.artist_id.in_(artist_ids),
+                    _album_links.refreshed < refreshed_before,
+                )
+                .returning(_album_links.album_id)
+            )
+            album_ids = (await db_session.execute(links_query)).scalars().all()
+            await ReleaseCrud._delete_unused_albums(db_session, set(album_ids))
+        return len(album_ids)
+
+    @staticmethod
+    @operation("ReleaseCrud.write_top_tracks")
+    async def write_top_tracks(
+        db_session: DbSessionDependency,
+        top_tracks: Sequence[tuple[str, Sequence[schemas.Track]]],
+    ) -> None:
+        """Replaces the top tracks of the artists in one transaction"""
+        if len(top_tracks) == 0:
+            return
+        rows = [
+            {
+                "artist_id": artist_id,
+                "position": position,
+                "track_id": track.id,
+                "name": track.name,
+                "popularity": track.popularity,
+                "duration_ms": track.duration_ms,
+                "uri": track.uri,
+                "album_id": track.album_id,
+            }
+            for artist_id, tracks in top_tracks
+            for position, track in enumerate(tracks)
+        ]
+        async with db_session.begin():
+            delete_query = delete(models.TopTrack).where(
+                models.TopTrack.artist_id.in_(
+                    [artist_id for artist_id, _ in top_tracks]
+                )
+            )
+            await db_session.execute(delete_query)
+            if len(rows) != 0:
+                await db_session.execute(insert(models.TopTrack), rows)
+
+    @staticmethod
+    @operation("ReleaseCrud.read_artist_albums")
+    async def read_artist_albums(
+        db_session: DbSessionDependency,
+        artist_id: str,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> list[schemas.Album]:
+        """The albums of the artist, newest first"""
+        async with db_session.begin():
+            query = (
+                select(models.Album, _album_links.album_group)
+                .join(
+                    models.album_association_table,
+                    _album_links.album_id == models.Album.id,
+                )
+                .where(_album_links.artist_id == artist_id)
+                .order_by(models.Album.release_date.desc(), models.Album.id)
+                .offset(offset)
+                .limit(limit)
+            )
+            rows = (await db_session.execute(query)).all()
+        # written by the crud, no need to validate
+        return [
+            schemas.Album.construct(
+                id=album.id,
+                name=album.name,
+                album_type=album.album_type,
+                album_group=album_group,
+                release_date=album.release_date,
+                total_tracks=album.total_tracks,
+                uri=album.uri,
+            )
+            for album, album_group in rows
+        ]
+
+    @staticmethod
+    @operation("ReleaseCrud.read_top_tracks")
+    async def read_top_tracks(
+        db_session: DbSessionDependency, artist_id: str
+    ) -> list[schemas.Track]:
+        async with db_session.begin():
+            query = (
+                select(models.TopTrack)
+                .where(models.TopTrack.artist_id == artist_id)
+                .order_by(models.TopTrack.position)
+            )
+            tracks = (await db_session.scalars(query)).all()
+        return [
+            schemas.Track.construct(
+                id=track.track_id,
+                name=track.name,
+                popularity=track.popularity,
+                duration_ms=track.duration_ms,
+                uri=track.uri,
+                album_id=track.album_id,
+            )
+            for track in tracks
+        ]
+
+    @staticmethod
+    async def _delete_releases(session: AsyncSession, artist_ids: list[str]) -> None:
+        """Explicitly, SQLite does not enforce the cascade of the foreign keys"""
+        links_query = (
+            delete(models.album_association_table)
+            .where(_album_links.artist_id.in_(artist_ids))
+            .returning(_album_links.album_id)
+        )
+        album_ids = (await session.execute(links_query)).scalars().all()
+        await ReleaseCrud._delete_unused_albums(session, set(album_ids))
+        await session.execute(
+            delete(models.TopTrack).where(models.TopTrack.artist_id.in_(artist_ids))
+        )
+
+    @staticmethod
+    async def _delete_unused_albums(session: AsyncSession, album_ids: set[str]) -> None:
+        """Of the given albums, deletes the ones no artist links anymore"""
+        if len(album_ids) == 0:
+            return
+        linked = exists().where(_album_links.album_id == models.Album.id)
+        delete_albums_query = (
+            delete(models.Album)
+            .where(models.Album.id.in_(album_ids), ~linked)
+            .execution_options(synchronize_session=False)
+        )
+        await session.execute(delete_albums_query)
+
+
+class GenreStatsCrud:
+    """Artist count, average popularity and total followers per genre, read
+    from the precomputed genre_stats table instead of aggregating all artists"""
+
+    _ORDER = {
+        "artist_count": _genre_stats.artist_count,
+        "popularity": _genre_stats.popularity_sum / _genre_stats.artist_count,
+        "followers": _genre_stats.followers_sum,
+    }
+
+    @staticmethod
+    @operation("GenreStatsCrud.read_stats")
+    async def read_stats(
+        db_session: DbSessionDependency,
+        genres: Sequence[str] = (),
+        order_by: str = "artist_count",
+        limit: int = 100,
+    ) -> list[schemas.GenreStats]:
+        """Of the given genres (all if empty) with at least one artist,
+        the first `limit` in descending order of `order_by`"""
+        async with db_session.begin():
+            query = (
+                select(
+                    models.Genre.name,
+                    _genre_stats.artist_count,
+                    _genre_stats.popularity_sum,
+                    _genre_stats.followers_sum,
+                )
+                .join(models.Genre, models.Genre.id == _genre_stats.genre_id)
+                .where(_genre_stats.artist_count > 0)
+                .order_by(GenreStatsCrud._ORDER[order_by].desc(), models.Genre.name)
+                .limit(limit)
+            )
+            if len(genres) != 0:
+                query = query.where(models.Genre.name.in_(genres))
+            rows = (await db_session.execute(query)).all()
+
+        return [
+            schemas.GenreStats.construct(
+                name=row.name,
+                artist_count=row.artist_count,
+                average_popularity=row.popularity_sum / row.artist_count,
+                total_followers=row.followers_sum,
+            )
+            for row in rows
+        ]
+
+    @staticmethod
+    def _aggregate_query() -> Select[tuple[int, int, int, int]]:
+        """The stats computed from all artists, what the table keeps up to date"""
+        return (
+            select(
+                models.Genre.id,
+                func.count(models.Artist.id),
+                func.coalesce(func.sum(models.Artist.popularity), 0),
+                func.coalesce(func.sum(models.Followers.total), 0),
+            )
+            .select_from(models.Genre)
+            .outerjoin(
+                models.association_table,
+                models.association_table.c.right_id == models.Genre.id,
+            )
+            .outerjoin(
+                models.Artist, models.Artist.id == models.association_table.c.left_id
+            )
+            .outerjoin(models.Followers, models.Followers.artist_id == models.Artist.id)
+            .group_by(models.Genre.id)
+        )
+
+    @staticmethod
+    @operation("GenreStatsCrud.rebuild_stats")
+    async def rebuild_stats(db_session: DbSessionDependency) -> int:
+        """Recomputes the table from all artists, e.g. after it was created for
+        an existing catalog. Returns the number of genres."""
+        async with db_session.begin():
+            await db_session.execute(delete(models.GenreStats))
+            insert_query = insert(models.GenreStats).from_select(
+                ["genre_id", "artist_count", "popularity_sum", "followers_sum"],
+                GenreStatsCrud._aggregate_query(),
+            )
+            result = await db_session.execute(insert_query)
+        return result.rowcount
+
 
 ArtistCrudDependency = Annotated[ArtistCrud, Depends(ArtistCrud)]
 AuthTokenCrudDependency = Annotated[AuthTokenCrud, Depends(AuthTokenCrud)]
+ArtistOutboxCrudDependency = Annotated[ArtistOutboxCrud, Depends(ArtistOutboxCrud)]
+ReleaseCrudDependency = Annotated[ReleaseCrud, Depends(ReleaseCrud)]
+GenreStatsCrudDependency = Annotated[GenreStatsCrud, Depends(GenreStatsCrud)]
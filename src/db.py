@@ -1,9 +1,13 @@
+from functools import lru_cache
+from logging import getLogger
 from typing import Annotated, Any, AsyncGenerator
 from fastapi import Depends
 
 
+from sqlalchemy import Column, Connection, Integer, MetaData, Table, inspect, select
 from sqlalchemy.ext.asyncio import (
     AsyncAttrs,
+    AsyncEngine,
     AsyncSession,
     async_sessionmaker,
     create_async_engine,
@@ -11,10 +15,26 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy.orm import DeclarativeBase
 
 
+from cache import get_genre_cache
 from config import get_settings
 
 
-DATABASE_URL = f"postgresql+asyncpg://{get_settings().postgres_user}:{get_settings().postgres_password}@{get_settings().postgres_host}/{get_settings().postgres_db}"
+_logger = getLogger(__file__)
+
+# increase whenever the models change, so startup creates the missing tables again
+SCHEMA_VERSION = 5
+
+# tables of older versions by the version that replaced them, dropped when
+# upgrading (e.g. `image` has a foreign key to artist without ON DELETE CASCADE)
+_REPLACED_TABLES = {"image": 2}
+
+
+@lru_cache()
+def get_database_url() -> str:
+    settings = get_settings()
+    if settings.database_url is not None:
+        return settings.database_url
+    return f"postgresql+asyncpg://{settings.postgres_user}:{settings.postgres_password}@{settings.postgres_host}/{settings.postgres_db}"
 
 
 class Base(AsyncAttrs, DeclarativeBase):
@@ -28,17 +48,96 @@ class Base(AsyncAttrs, DeclarativeBase):
         return f"{class_name}({fields_string})"
 
 
-engine = create_async_engine(DATABASE_URL)
-session_maker = async_sessionmaker(engine, expire_on_commit=False)
+schema_version_table = Table(
+    "schema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+)
 
 
-async def create_db_and_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+@lru_cache()
+def get_engine() -> AsyncEngine:
+    # created on first use, so importing this module stays cheap
+    return create_async_engine(get_database_url())
+
+
+@lru_cache()
+def get_session_maker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(get_engine(), expire_on_commit=False)
+
+
+def _read_schema_version(conn: Connection) -> int | None:
+    if not inspect(conn).has_table(schema_version_table.name):
+        return None
+    query = select(schema_version_table.c.version)
+    return conn.execute(query).scalar_one_or_none()
+
+
+class SchemaMismatch(RuntimeError):
+    """Existing tables differ from the models and have to be migrated by hand"""
+
+
+def _schema_differences(conn: Connection) -> list[str]:
+    """Columns of the existing tables that the models do not match"""
+    inspector = inspect(conn)
+    existing_tables = set(inspector.get_table_names())
+    differences: list[str] = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing_columns = {
+            column["name"] for column in inspector.get_columns(table.name)
+        }
+        model_columns = {column.name for column in table.columns}
+        missing = sorted(model_columns - existing_columns)
+        unknown = sorted(existing_columns - model_columns)
+        if len(missing) != 0:
+            differences.append(f"{table.name} lacks {', '.join(missing)}")
+        if len(unknown) != 0:
+            differences.append(f"{table.name} has unknown {', '.join(unknown)}")
+    return differences
+
+
+def _create_tables(conn: Connection, version: int | None) -> None:
+    # create_all only creates missing tables, changed ones must not be stamped
+    differences = _schema_differences(conn)
+    if len(differences) != 0:
+        raise SchemaMismatch(
+            f"the database schema differs from version {SCHEMA_VERSION}: "
+            + "; ".join(differences)
+        )
+    for name, replaced_in in _REPLACED_TABLES.items():
+        if (version is None or version < replaced_in) and inspect(conn).has_table(name):
+            _logger.warning("dropping table %s of schema version %s", name, version)
+            Table(name, MetaData()).drop(conn)
+    Base.metadata.create_all(conn)
+    # genre ids cached for the engine may belong to dropped tables
+    get_genre_cache(conn).clear()
+    conn.execute(schema_version_table.delete())
+    conn.execute(schema_version_table.insert().values(version=SCHEMA_VERSION))
+
+
+async def create_db_and_tables(engine: AsyncEngine | None = None) -> bool:
+    """Creates the tables unless the stored schema version is current.
+    Returns whether they were created. Raises `SchemaMismatch` without changing
+    anything if existing tables differ from the models."""
+    async with (engine or get_engine()).begin() as conn:
+        version = await conn.run_sync(_read_schema_version)
+        if version == SCHEMA_VERSION:
+            return False
+
+        if version is not None:
+            _logger.warning(
+                "schema version %d is outdated (current %d), creating missing tables",
+                version,
+                SCHEMA_VERSION,
+            )
+        await conn.run_sync(_create_tables, version)
+    return True
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    async with session_maker() as session:
+    async with get_session_maker()() as session:
         yield session
 
 
@@ -0,0 +1,172 @@
+import asyncio
+from functools import lru_cache
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, Sequence
+
+import orjson
+from pydantic import parse_obj_as
+
+from config import get_settings
+from responses import dumps
+import schemas
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+
+_logger = getLogger(__file__)
+
+
+class ChangeSubscription:
+    """Changes of the subscribed artists and genres (everything if both are empty).
+    Only the newest `max_queued` changes are kept for slow subscribers."""
+
+    def __init__(
+        self,
+        bus: "ChangeBus",
+        artist_ids: set[str],
+        genres: set[str],
+        max_queued: int = 100,
+    ) -> None:
+        self.bus = bus
+        self.artist_ids = artist_ids
+        self.genres = genres
+        self.queue: asyncio.Queue[schemas.ArtistChange] = asyncio.Queue(max_queued)
+        self.dropped = 0
+
+    def put(self, change: schemas.ArtistChange) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(change)
+
+    async def get(self) -> schemas.ArtistChange:
+        return await self.queue.get()
+
+    def __enter__(self) -> "ChangeSubscription":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.bus.unsubscribe(self)
+
+
+class ChangeBus:
+    """Fans out artist changes to the subscribers of this process.
+    Subscriptions are indexed by artist and genre, so a change only
+    touches the subscribers interested in it."""
+
+    def __init__(self) -> None:
+        self._subscribe_all: set[ChangeSubscription] = set()
+        self._by_artist: dict[str, set[ChangeSubscription]] = {}
+        self._by_genre: dict[str, set[ChangeSubscription]] = {}
+
+    @property
+    def subscriber_count(self) -> int:
+        subscriptions = set(self._subscribe_all)
+        for index in [self._by_artist, self._by_genre]:
+            for index_subscriptions in index.values():
+                subscriptions.update(index_subscriptions)
+        return len(subscriptions)
+
+    def subscribe(
+        self, artist_ids: Sequence[str] = (), genres: Sequence[str] = ()
+    ) -> ChangeSubscription:
+        subscription = ChangeSubscription(self, set(artist_ids), set(genres))
+        if len(subscription.artist_ids) == 0 and len(subscription.genres) == 0:
+            self._subscribe_all.add(subscription)
+        for artist_id in subscription.artist_ids:
+            self._by_artist.setdefault(artist_id, set()).add(subscription)
+        for genre in subscription.genres:
+            self._by_genre.setdefault(genre, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: ChangeSubscription) -> None:
+        self._subscribe_all.discard(subscription)
+        for key, index in [
+            (subscription.artist_ids, self._by_artist),
+            (subscription.genres, self._by_genre),
+        ]:
+            for value in key:
+                subscriptions = index.get(value)
+                if subscriptions is None:
+                    continue
+                subscriptions.discard(subscription)
+                if len(subscriptions) == 0:
+                    del index[value]
+
+    async def publish(self, changes: Sequence[schemas.ArtistChange]) -> None:
+        self.dispatch(changes)
+
+    def dispatch(self, changes: Sequence[schemas.ArtistChange]) -> None:
+        for change in changes:
+            receivers = set(self._subscribe_all)
+            receivers.update(self._by_artist.get(change.artist_id, ()))
+            for genre in change.genres:
+                receivers.update(self._by_genre.get(genre, ()))
+            for subscription in receivers:
+                subscription.put(change)
+
+
+class RedisChangeBus(ChangeBus):
+    """Publishes changes through redis pub/sub, so subscribers of every process
+    (api workers, also for changes made by the celery worker) receive them.
+    Each process holds a single redis subscription and fans out locally."""
+
+    channel = "spotify_artists:artist_changes"
+    # seconds to wait before reconnecting, doubled after each failure
+    reconnect_delay = 0.5
+    max_reconnect_delay = 30.0
+
+    def __init__(self, redis: "Redis[Any]") -> None:
+        super().__init__()
+        self._redis = redis
+        self._listener: asyncio.Task[None] | None = None
+
+    async def publish(self, changes: Sequence[schemas.ArtistChange]) -> None:
+        if len(changes) != 0:
+            await self._redis.publish(self.channel, dumps(changes))
+
+    def subscribe(
+        self, artist_ids: Sequence[str] = (), genres: Sequence[str] = ()
+    ) -> ChangeSubscription:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+        return super().subscribe(artist_ids, genres)
+
+    async def _listen(self) -> None:
+        # a lost connection is reopened, waiting longer after each failure
+        delay = self.reconnect_delay
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:  # type: ignore
+                    await pubsub.subscribe(self.channel)
+                    delay = self.reconnect_delay
+                    async for message in pubsub.listen():
+                        self._dispatch_message(message)
+                _logger.warning("artist change subscription ended, reconnecting")
+            except Exception:
+                _logger.exception("artist change subscription failed, reconnecting")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _dispatch_message(self, message: dict[str, Any]) -> None:
+        if message["type"] != "message":
+            return
+        try:
+            changes = parse_obj_as(
+                list[schemas.ArtistChange], orjson.loads(message["data"])
+            )
+        except ValueError:
+            _logger.exception("invalid artist change message")
+            return
+        self.dispatch(changes)
+
+
+@lru_cache()
+def get_change_bus() -> ChangeBus:
+    settings = get_settings()
+    if settings.change_bus_backend == "redis":
+        from redis.asyncio import Redis
+
+        return RedisChangeBus(Redis.from_url(settings.celery_broker_url))
+    return ChangeBus()
@@ -0,0 +1,59 @@
+import secrets
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging import getLogger
+from typing import Awaitable, Callable
+
+import schemas
+
+
+_logger = getLogger(__file__)
+
+
+class UpdateJobRegistry:
+    """Keeps track of the update jobs of this process. Only one job runs at a time,
+    starting a job while one is running returns the running job instead."""
+
+    def __init__(self, max_history: int = 100) -> None:
+        self.max_history = max_history
+        self._jobs: OrderedDict[str, schemas.UpdateJob] = OrderedDict()
+        self._running: schemas.UpdateJob | None = None
+
+    def get(self, job_id: str) -> schemas.UpdateJob | None:
+        return self._jobs.get(job_id)
+
+    def start(self) -> tuple[schemas.UpdateJob, bool]:
+        """Returns the job to report and whether it was newly created"""
+        if self._running is not None:
+            return self._running, False
+
+        job = schemas.UpdateJob(id=secrets.token_hex(8))
+        self._running = job
+        self._jobs[job.id] = job
+        while len(self._jobs) > self.max_history:
+            self._jobs.popitem(last=False)
+        return job, True
+
+    async def run(
+        self,
+        job: schemas.UpdateJob,
+        update: Callable[[schemas.UpdateJob], Awaitable[object]],
+    ) -> None:
+        try:
+            await update(job)
+            # errors that did not stop the update (e.g. skipped batches) fail it too
+            if len(job.errors) == 0:
+                job.status = schemas.UpdateJobStatus.succeeded
+            else:
+                job.status = schemas.UpdateJobStatus.failed
+        except Exception as e:
+            _logger.exception("update job %s failed", job.id)
+            job.errors.append(repr(e))
+            job.status = schemas.UpdateJobStatus.failed
+        finally:
+            job.finished = datetime.now(timezone.utc)
+            if self._running is job:
+                self._running = None
+
+
+update_jobs = UpdateJobRegistry()
@@ -0,0 +1,253 @@
+"""Load test of the api: starts uvicorn on localhost with a synthetic artist
+catalog (see catalog.py) and sends a weighted mix of requests from concurrent
+clients. Reports throughput and latency percentiles per request type.
+
+Run with `python loadtest.py [--catalog 1000] [--concurrency 16] [--duration 10]
+    [--mix get_artist=80,get_artist_fields=10,put_artist=10]
+    [--database-url postgresql+asyncpg://...] [--workers 1] [--seed 0]
+    [--output results.json]`
+
+Without --database-url a temporary SQLite database is used, so no external
+services are needed (e.g. in CI). Settings that are not configured by the
+environment get placeholder values, the Spotify api is never called."""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import httpx
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from catalog import Catalog, artist_id, use_placeholder_settings
+from db import create_db_and_tables
+
+# a request of artist i of the catalog
+_Request = Callable[[httpx.AsyncClient, Catalog, int], Awaitable[httpx.Response]]
+
+REQUESTS: dict[str, _Request] = {
+    "get_artist": lambda client, catalog, i: client.get(f"/artist/{artist_id(i)}"),
+    "get_artist_fields": lambda client, catalog, i: client.get(
+        f"/artist/{artist_id(i)}", params={"fields": "name,popularity"}
+    ),
+    # a later snapshot, as if the artist changed on Spotify
+    "put_artist": lambda client, catalog, i: client.put(
+        f"/artist/{artist_id(i)}",
+        json=catalog.artist_data(i, snapshot=random.randrange(1, 20)),
+    ),
+    "get_artists_fields": lambda client, catalog, i: client.get(
+        "/artists", params={"fields": "name"}
+    ),
+}
+
+
+@dataclass
+class _Stats:
+    latencies: list[float] = field(default_factory=list)  # seconds
+    errors: int = 0
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    if len(sorted_values) == 0:
+        return 0.0
+    index = round(percentile / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+def summarize(stats: dict[str, _Stats], duration: float) -> dict[str, Any]:
+    """Throughput (successful requests per second) and latency percentiles (ms)"""
+    summary: dict[str, Any] = {}
+    all_latencies: list[float] = []
+    all_errors = 0
+    for name, request_stats in [*stats.items(), ("total", None)]:
+        if request_stats is None:
+            latencies, errors = sorted(all_latencies), all_errors
+        else:
+            latencies, errors = sorted(request_stats.latencies), request_stats.errors
+            all_latencies.extend(latencies)
+            all_errors += errors
+        summary[name] = {
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput": round(len(latencies) / duration, 1),
+            **{
+                f"p{p}_ms": round(_percentile(latencies, p) * 1000, 2)
+                for p in [50, 95, 99]
+            },
+        }
+    return summary
+
+
+def _parse_mix(mix: str) -> dict[str, float]:
+    weights: dict[str, float] = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        if name not in REQUESTS:
+            raise ValueError(f"unknown request {name}, known: {', '.join(REQUESTS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+async def _fill_catalog(database_url: str, catalog: Catalog) -> None:
+    engine = create_async_engine(database_url)
+    await create_db_and_tables(engine)
+    await catalog.fill_database(async_sessionmaker(engine, expire_on_commit=False))
+    await engine.dispose()
+
+
+async def _run_clients(
+    base_url: str,
+    catalog: Catalog,
+    concurrency: int,
+    duration: float,
+    weights: dict[str, float],
+) -> dict[str, _Stats]:
+    stats = {name: _Stats() for name in weights}
+    names = list(weights)
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=30.0
+    ) as client:
+
+        async def worker() -> None:
+            while time.perf_counter() < deadline:
+                name = random.choices(names, weights=list(weights.values()))[0]
+                start = time.perf_counter()
+                try:
+                    response = await REQUESTS[name](
+                        client, catalog, random.randrange(catalog.size)
+                    )
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                if failed:
+                    stats[name].errors += 1
+                else:
+                    stats[name].latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return stats
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_ready(base_url: str, server: subprocess.Popen[bytes]) -> None:
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("uvicorn exited during startup")
+        try:
+            httpx.get(f"{base_url}/", timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError("uvicorn did not start within 30 s")
+
+
+def run(
+    catalog: int = 1000,
+    concurrency: int = 16,
+    duration: float = 10.0,
+    mix: str = "get_artist=80,get_artist_fields=10,put_artist=10",
+    database_url: str | None = None,
+    workers: int = 1,
+    seed: int = 0,
+) -> dict[str, Any]:
+    weights = _parse_mix(mix)
+    with tempfile.TemporaryDirectory() as directory:
+        # the crud (e.g. its change bus) reads the settings as well
+        use_placeholder_settings()
+        database_url = database_url or f"sqlite+aiosqlite:///{directory}/loadtest.db"
+        artists = Catalog(size=catalog, seed=seed)
+        asyncio.run(_fill_catalog(database_url, artists))
+        env = {**os.environ, "DATABASE_URL": database_url}
+
+        port = _free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                *["-m", "uvicorn", "main:app", "--port", str(port)],
+                *["--workers", str(workers), "--log-level", "warning"],
+            ],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+        )
+        try:
+            _wait_until_ready(base_url, server)
+            stats = asyncio.run(
+                _run_clients(base_url, artists, concurrency, duration, weights)
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    return {
+        "catalog": catalog,
+        "seed": seed,
+        "concurrency": concurrency,
+        "duration": duration,
+        "workers": workers,
+        "database": database_url.split(":")[0],
+        "results": summarize(stats, duration),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--mix", default="get_artist=80,get_artist_fields=10,put_artist=10"
+    )
+    parser.add_argument("--database-url")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    report = run(
+        args.catalog,
+        args.concurrency,
+        args.duration,
+        args.mix,
+        args.database_url,
+        args.workers,
+        args.seed,
+    )
+
+    print(
+        f"{report['catalog']} artists, {report['concurrency']} clients,"
+        f" {report['duration']} s, {report['database']}"
+    )
+    print(
+        f"{'request':20} {'requests':>9} {'errors':>7} {'req/s':>9}"
+        f" {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    for name, result in report["results"].items():
+        print(
+            f"{name:20} {result['requests']:9} {result['errors']:7}"
+            f" {result['throughput']:9.1f} {result['p50_ms']:8.2f}"
+            f" {result['p95_ms']:8.2f} {result['p99_ms']:8.2f}"
+        )
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+import secrets
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from logging import getLogger
+from typing import TYPE_CHECKING, Any, AsyncGenerator
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from config import Settings
+
+if TYPE_CHECKING:
+    from redis.asyncio import Redis
+
+
+_logger = getLogger(__file__)
+
+
+class LeaseLock(ABC):
+    """A lock that is only held for `ttl` seconds unless it is renewed.
+    A crashed holder therefore cannot block other holders forever."""
+
+    def __init__(self, key: str, ttl: float) -> None:
+        self.key = key
+        self.ttl = ttl
+        self.contended = 0
+
+    @abstractmethod
+    async def acquire(self) -> bool:
+        ...
+
+    @abstractmethod
+    async def renew(self) -> bool:
+        ...
+
+    @abstractmethod
+    async def release(self) -> None:
+        ...
+
+
+class MemoryLeaseLock(LeaseLock):
+    """In-process lock, used for tests and single process deployments"""
+
+    _leases: dict[str, tuple[str, float]] = {}
+
+    def __init__(self, key: str, ttl: float) -> None:
+        super().__init__(key, ttl)
+        self._token = secrets.token_hex(16)
+
+    async def acquire(self) -> bool:
+        lease = self._leases.get(self.key)
+        now = time.monotonic()
+        if lease is not None and lease[0] != self._token and lease[1] > now:
+            return False
+
+        self._leases[self.key] = (self._token, now + self.ttl)
+        return True
+
+    async def renew(self) -> bool:
+        lease = self._leases.get(self.key)
+        if lease is None or lease[0] != self._token:
+            return False
+
+        self._leases[self.key] = (self._token, time.monotonic() + self.ttl)
+        return True
+
+    async def release(self) -> None:
+        lease = self._leases.get(self.key)
+        if lease is not None and lease[0] == self._token:
+            del self._leases[self.key]
+
+
+class RedisLeaseLock(LeaseLock):
+    """Lock stored as a redis key with an expiry. Only the holder
+    (identified by a random token) may renew or delete it."""
+
+    _RENEW_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("pexpire", KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+
+    _RELEASE_SCRIPT = """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, redis: "Redis[Any]", key: str, ttl: float) -> None:
+        super().__init__(key, ttl)
+        self._redis = redis
+        self._token = secrets.token_hex(16)
+
+    async def acquire(self) -> bool:
+        acquired = await self._redis.set(
+            self.key, self._token, nx=True, px=int(self.ttl * 1000)
+        )
+        return bool(acquired)
+
+    async def renew(self) -> bool:
+        renewed = await self._redis.eval(  # type: ignore
+            self._RENEW_SCRIPT, 1, self.key, self._token, int(self.ttl * 1000)
+        )
+        return bool(renewed)
+
+    async def release(self) -> None:
+        await self._redis.eval(  # type: ignore
+            self._RELEASE_SCRIPT, 1, self.key, self._token
+        )
+
+
+class PostgresAdvisoryLeaseLock(LeaseLock):
+    """Session level postgres advisory lock. The lock is bound to a dedicated
+    connection, so postgres releases it when the holder disconnects.
+    Renewing checks that the connection (and therefore the lock) is still alive."""
+
+    def __init__(self, engine: AsyncEngine, key: str, ttl: float) -> None:
+        super().__init__(key, ttl)
+        self._engine = engine
+        self._lock_id = int.from_bytes(
+            hashlib.sha256(key.encode()).digest()[:8], "big", signed=True
+        )
+        self._connection: AsyncConnection | None = None
+
+    async def acquire(self) -> bool:
+        connection = await self._engine.connect()
+        acquired = (
+            await connection.execute(
+                text("SELECT pg_try_advisory_lock(:lock_id)"),
+                {"lock_id": self._lock_id},
+            )
+        ).scalar_one()
+        if not acquired:
+            await connection.close()
+            return False
+
+        self._connection = connection
+        return True
+
+    async def renew(self) -> bool:
+        if self._connection is None:
+            return False
+
+        try:
+            await self._connection.execute(text("SELECT 1"))
+        except Exception:
+            _logger.exception("advisory lock connection lost")
+            return False
+        return True
+
+    async def release(self) -> None:
+        if self._connection is None:
+            return
+
+        try:
+            await self._connection.execute(
+                text("SELECT pg_advisory_unlock(:lock_id)"),
+                {"lock_id": self._lock_id},
+            )
+        finally:
+            await self._connection.close()
+            self._connection = None
+
+
+class LockLost(Exception):
+    """Raised in the holder of `hold_lock` when the lease could not be renewed,
+    another holder may have the lock by now"""
+
+    def __init__(self, key: str) -> None:
+        super().__init__(f"lost lock {key} while holding it")
+        self.key = key
+
+
+async def _renew_periodically(
+    lock: LeaseLock, interval: float, holder: asyncio.Task[Any], lost: asyncio.Event
+) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        if not await lock.renew():
+            _logger.error("lost lock %s while holding it", lock.key)
+            # the holder must not go on without the lease
+            lost.set()
+            holder.cancel()
+            return
+
+
+@asynccontextmanager
+async def hold_lock(lock: LeaseLock) -> AsyncGenerator[bool, None]:
+    """Try to acquire the lock and keep renewing it until the block is left.
+    Yields False (and counts the contention) if another holder has the lock.
+    If a renewal fails the block is cancelled and `LockLost` is raised."""
+    if not await lock.acquire():
+        lock.contended += 1
+        _logger.info(
+            "lock %s is held elsewhere (contended %d times)", lock.key, lock.contended
+        )
+        yield False
+        return
+
+    holder = asyncio.current_task()
+    assert holder is not None
+    lost = asyncio.Event()
+    renew_task = asyncio.create_task(
+        _renew_periodically(lock, lock.ttl / 3, holder, lost)
+    )
+    try:
+        yield True
+    except asyncio.CancelledError:
+        # only the cancellation of the renewal, others are passed on
+        if lost.is_set() and holder.uncancel() == 0:
+            raise LockLost(lock.key) from None
+        raise
+    finally:
+        renew_task.cancel()
+        await lock.release()
+
+
+def create_update_lock(settings: Settings, engine: AsyncEngine) -> LeaseLock:
+    """Lock guarding the update_artists cycle for the configured backend"""
+    key = "spotify_artists:update_artists"
+    if settings.update_lock_backend == "redis":
+        # imported here, so the api does not pay for it when not using redis
+        from redis.asyncio import Redis
+
+        redis = Redis.from_url(settings.celery_broker_url)
+        return RedisLeaseLock(redis, key, settings.update_lock_ttl)
+    if settings.update_lock_backend == "postgres":
+        return PostgresAdvisoryLeaseLock(engine, key, settings.update_lock_ttl)
+    return MemoryLeaseLock(key, settings.update_lock_ttl)
@@ -1,28 +1,198 @@
+import asyncio
 import secrets
 import string
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from logging import getLogger
-from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse
-
-from config import SettingsDependency
-from db import DbSessionDependency, create_db_and_tables
+from typing import Annotated, Any, AsyncIterator, Literal
+from fastapi import (
+    BackgroundTasks,
+    Body,
+    FastAPI,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.responses import PlainTextResponse, RedirectResponse, StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Settings, SettingsDependency, get_settings
+from db import (
+    DbSessionDependency,
+    create_db_and_tables,
+    get_engine,
+    get_session_maker,
+)
 import schemas
-from crud import AuthTokenCrudDependency, ArtistCrudDependency
-from spotify import SpotifyClientDependency
+from crud import (
+    ArtistCrud,
+    ArtistOutboxCrud,
+    ArtistOutboxCrudDependency,
+    AuthTokenCrud,
+    AuthTokenCrudDependency,
+    ArtistCrudDependency,
+    GenreStatsCrud,
+    GenreStatsCrudDependency,
+    ReleaseCrud,
+    ReleaseCrudDependency,
+)
+from events import ChangeSubscription, get_change_bus
+from jobs import update_jobs
+from lock import LeaseLock, create_update_lock, hold_lock
+import metrics
+from cache import get_artist_cache, get_genre_cache
+from compression import CompressionMiddleware
+from responses import FastJSONResponse, JSONArrayStreamingResponse, dumps
+from scheduler import PeriodicJob, Scheduler
+import tracing
+from spotify import (
+    SPOTIFY_MAX_ARTISTS_PER_REQUEST,
+    SpotifyClient,
+    SpotifyClientDependency,
+    SpotifyRequestFailed,
+    close_http_client,
+)
+from token_pool import get_token_pool
+from warmup import WarmupReport, warm_up_caches
+from write_buffer import ArtistWriteBuffer, FlushFailed, FlushStats, WriteBuffer
 
 _logger = getLogger(__file__)
 
 app = FastAPI()
+app.add_middleware(
+    CompressionMiddleware, minimum_size=get_settings().compression_minimum_size
+)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+
+_scheduler: Scheduler | None = None
+_metrics_writer: asyncio.Task[None] | None = None
+_warmup: asyncio.Task[WarmupReport] | None = None
 
 
 @app.on_event("startup")
 async def startup():
-    await create_db_and_tables()
+    global _scheduler, _metrics_writer, _warmup
+    settings = get_settings()
+    tracing.configure(settings.trace_exporter, settings.trace_file)
+    if await create_db_and_tables():
+        # the genre stats of artists written before the table existed
+        async with get_session_maker()() as db_session:
+            await GenreStatsCrud.rebuild_stats(db_session)
+
+    if settings.embedded_scheduler:
+        _scheduler = _create_embedded_scheduler()
+        _scheduler.start()
+
+    if settings.metrics_dir is not None:
+        _metrics_writer = asyncio.create_task(
+            _write_metrics_periodically(
+                settings.metrics_dir, settings.metrics_write_interval
+            )
+        )
+
+    if settings.cache_warmup:
+        # in the background, requests are served meanwhile
+        _warmup = asyncio.create_task(
+            warm_up_caches(
+                get_session_maker(),
+                get_artist_cache(),
+                settings.cache_warmup_artists,
+                settings.cache_warmup_seconds,
+            )
+        )
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    pass
+    global _scheduler, _metrics_writer, _warmup
+    if _warmup is not None:
+        _warmup.cancel()
+        _warmup = None
+    if _scheduler is not None:
+        await _scheduler.stop()
+        _scheduler = None
+    if _metrics_writer is not None:
+        _metrics_writer.cancel()
+        _metrics_writer = None
+        # final, so the file is folded into the archive of exited processes
+        metrics.write_process_metrics(get_settings().metrics_dir, exited=True)
+    await close_http_client()
+
+
+async def _write_metrics_periodically(directory: str, interval: float) -> None:
+    """Every process stores its metrics, so any of them can serve the sum"""
+    while True:
+        metrics.write_process_metrics(directory)
+        await asyncio.sleep(interval)
+
+
+def _create_embedded_scheduler() -> Scheduler:
+    """Periodic jobs run inside the api process (replaces the celery worker and beat)"""
+    settings = get_settings()
+    update_lock = create_update_lock(settings, get_engine())
+
+    async def update_artists_job() -> None:
+        async with hold_lock(update_lock) as acquired:
+            if not acquired:
+                _logger.info("skipping update_artists, previous cycle still running")
+                metrics.jobs_skipped.inc(job="update artists")
+                return
+
+            async with get_session_maker()() as db_session:
+                await update_artists_from_spotify(
+                    settings, db_session, AuthTokenCrud(), ArtistCrud(), SpotifyClient()
+                )
+
+    async def refresh_token_job() -> None:
+        async with get_session_maker()() as db_session:
+            await refresh_auth_token(
+                settings, db_session, AuthTokenCrud(), SpotifyClient()
+            )
+
+    async def prune_outbox_job() -> None:
+        async with get_session_maker()() as db_session:
+            await prune_outbox(settings, db_session, ArtistOutboxCrud())
+
+    async def update_releases_job() -> None:
+        async with get_session_maker()() as db_session:
+            await update_releases_from_spotify(
+                settings, db_session, AuthTokenCrud(), ReleaseCrud(), SpotifyClient()
+            )
+
+    return Scheduler(
+        [
+            PeriodicJob(
+                "update artists",
+                settings.update_artists_interval,
+                update_artists_job,
+                settings.scheduler_jitter,
+            ),
+            PeriodicJob(
+                "check refresh token",
+                settings.refresh_token_interval,
+                refresh_token_job,
+                settings.scheduler_jitter,
+            ),
+            PeriodicJob(
+                "prune outbox",
+                settings.prune_outbox_interval,
+                prune_outbox_job,
+                settings.scheduler_jitter,
+            ),
+            PeriodicJob(
+                "update releases",
+                settings.update_releases_interval,
+                update_releases_job,
+                settings.scheduler_jitter,
+            ),
+        ]
+    )
 
 
 @app.get("/")
@@ -30,6 +200,40 @@ async def root():
     return {"msg": "Hello World"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(settings: SettingsDependency) -> str:
+    """Metrics in the Prometheus text format (summed over all processes
+    if METRICS_DIR is set)"""
+    if settings.metrics_dir is not None:
+        collected = metrics.collect_all_processes(settings.metrics_dir)
+    else:
+        collected = metrics.registry.collect()
+    return metrics.render(collected)
+
+
+@app.get("/caches")
+async def get_caches() -> dict[str, Any]:
+    """Sizes and estimated memory of the caches of this process, and the
+    report of the startup warm-up (None while it runs)"""
+    artist_cache = get_artist_cache()
+    genre_cache = get_genre_cache(get_engine().sync_engine)
+    warmup: dict[str, Any] | None = None
+    if _warmup is not None and _warmup.done() and not _warmup.cancelled():
+        if _warmup.exception() is None:
+            warmup = _warmup.result().dict()
+    return {
+        "artists": {
+            "size": len(artist_cache),
+            "max_size": artist_cache.max_size,
+            "hits": artist_cache.hits,
+            "misses": artist_cache.misses,
+            "bytes": artist_cache.memory_usage(),
+        },
+        "genres": {"size": len(genre_cache), "bytes": genre_cache.memory_usage()},
+        "warmup": warmup,
+    }
+
+
 @app.get("/login")
 async def login(
     settings: SettingsDependency, spotify_client: SpotifyClientDependency
@@ -42,7 +246,7 @@ async def login(
     reply_url = await spotify_client.login(
         settings.spotify_client_id, settings.base_url, state
     )
-    print(reply_url)
+    _logger.debug("redirecting to Spotify login %s", reply_url)
 
     # using a redirect response here so it will work with just the backend
     response = RedirectResponse(reply_url)
@@ -128,36 +332,465 @@ async def refresh_auth_token(
     return new_token
 
 
-@app.get("/update_artists_from_spotify")
+async def prune_outbox(
+    settings: Settings,
+    db_session: AsyncSession,
+    outbox_crud: ArtistOutboxCrud,
+) -> int:
+    """Deletes the outbox records older than the retention"""
+    older_than = datetime.now(timezone.utc) - timedelta(
+        days=settings.outbox_retention_days
+    )
+    deleted = await outbox_crud.prune_changes(db_session, older_than)
+    _logger.info("pruned %d outbox records", deleted)
+    return deleted
+
+
+def _artists_response(
+    settings: Settings,
+    content: schemas.Artist | list[schemas.Artist] | None,
+    headers: dict[str, str] | None = None,
+) -> FastJSONResponse | None:
+    """Renders the validated artists with orjson (skipping the response model
+    validation) if fast json responses are enabled, otherwise returns None"""
+    if not settings.fast_json_responses:
+        return None
+    return FastJSONResponse(content, headers=headers)
+
+
+@app.get("/update_artists_from_spotify", response_model=list[schemas.Artist])
 async def update_artists_from_spotify(
     settings: SettingsDependency,
     db_session: DbSessionDependency,
     auth_token_crud: AuthTokenCrudDependency,
     artist_crud: ArtistCrudDependency,
     spotify_client: SpotifyClientDependency,
+) -> list[schemas.Artist] | Response:
+    """Update artists from Spotify (blocks until done, see POST for large sets)"""
+    try:
+        artists = await _fetch_and_store_artists(
+            settings, db_session, auth_token_crud, artist_crud, spotify_client
+        )
+    except FlushFailed as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return _artists_response(settings, artists) or artists
+
+
+@app.post("/update_artists_from_spotify", status_code=202)
+async def start_update_artists_job(
+    settings: SettingsDependency,
+    auth_token_crud: AuthTokenCrudDependency,
+    artist_crud: ArtistCrudDependency,
+    spotify_client: SpotifyClientDependency,
+    background_tasks: BackgroundTasks,
+) -> schemas.UpdateJob:
+    """Start updating artists from Spotify in the background.
+    Returns the already running job if there is one."""
+    job, created = update_jobs.start()
+    if not created:
+        return job
+
+    async def update(job: schemas.UpdateJob) -> None:
+        # excludes update cycles of the scheduler, the worker and other processes
+        async with hold_lock(_job_update_lock()) as acquired:
+            if not acquired:
+                metrics.jobs_skipped.inc(job="update artists")
+                job.errors.append("another update cycle is running")
+                return
+
+            # the request's session is closed when the response is sent
+            async with get_session_maker()() as db_session:
+                await _fetch_and_store_artists(
+                    settings,
+                    db_session,
+                    auth_token_crud,
+                    artist_crud,
+                    spotify_client,
+                    job,
+                )
+
+    background_tasks.add_task(update_jobs.run, job, update)
+    return job
+
+
+@lru_cache()
+def _job_update_lock() -> LeaseLock:
+    # its own holder, the embedded scheduler holds another instance
+    return create_update_lock(get_settings(), get_engine())
+
+
+@app.get("/update_jobs/{job_id}")
+async def get_update_job(job_id: str) -> schemas.UpdateJob:
+    """Get the status and progress of an update job"""
+    job = update_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@tracing.traced("main.fetch_and_store_artists")
+async def _fetch_and_store_artists(
+    settings: Settings,
+    db_session: AsyncSession,
+    auth_token_crud: AuthTokenCrud,
+    artist_crud: ArtistCrud,
+    spotify_client: SpotifyClient,
+    job: schemas.UpdateJob | None = None,
 ) -> list[schemas.Artist]:
-    """Update artists from Spotify"""
+    job = job or schemas.UpdateJob(id="")
 
-    auth_token = await auth_token_crud.read_auth_token(db_session)
-    if auth_token is None:
+    token_pool = await get_token_pool(
+        settings, db_session, auth_token_crud, spotify_client
+    )
+    if token_pool is None:
         _logger.error(
             "getting artists failed. No auth token. Please login first (visit /login)"
         )
+        job.errors.append("no auth token")
         return []
 
-    artists = await spotify_client.get_artists(settings.artists_to_track, auth_token)
-    await artist_crud.update_artists(db_session, artists)
-    return artists
+    artist_ids = settings.artists_to_track
+    shards = [
+        artist_ids[i : i + SPOTIFY_MAX_ARTISTS_PER_REQUEST]
+        for i in range(0, len(artist_ids), SPOTIFY_MAX_ARTISTS_PER_REQUEST)
+    ]
+    job.batches_total = len(shards)
+    fetch_limit = asyncio.Semaphore(
+        settings.spotify_max_concurrent_requests * token_pool.size
+    )
+
+    def on_flush(stats: FlushStats) -> None:
+        job.artists_written += stats.size
+
+    write_buffer = ArtistWriteBuffer(db_session, artist_crud, on_flush=on_flush)
+
+    async def fetch_shard(shard: list[str]) -> list[schemas.Artist]:
+        async with fetch_limit:
+            fetched = await token_pool.get_artists(spotify_client, shard)
+        await write_buffer.put(fetched)
+        job.batches_done += 1
+        job.artists_skipped += len(shard) - len(fetched)
+        return fetched
+
+    # raises FlushFailed if the fetched artists were not all stored
+    async with write_buffer:
+        fetched_shards = await asyncio.gather(*map(fetch_shard, shards))
+
+    return [artist for fetched in fetched_shards for artist in fetched]
+
+
+@tracing.traced("main.update_releases_from_spotify")
+async def update_releases_from_spotify(
+    settings: Settings,
+    db_session: AsyncSession,
+    auth_token_crud: AuthTokenCrud,
+    release_crud: ReleaseCrud,
+    spotify_client: SpotifyClient,
+) -> schemas.ReleaseUpdate:
+    """Fetches the albums and top tracks of the stored tracked artists, several
+    artists at once. The album pages of an artist are fetched one after another
+    and written in batches as they arrive, so memory does not grow with the
+    number of releases."""
+    result = schemas.ReleaseUpdate()
+    token_pool = await get_token_pool(
+        settings, db_session, auth_token_crud, spotify_client
+    )
+    if token_pool is None:
+        _logger.error("getting releases failed. No auth token")
+        result.errors.append("no auth token")
+        return result
+
+    artist_ids = await release_crud.read_stored_artist_ids(
+        db_session, settings.artists_to_track
+    )
+    result.artists_total = len(artist_ids)
+    started = datetime.now(timezone.utc)
+    fetch_limit = asyncio.Semaphore(
+        settings.spotify_max_concurrent_requests * token_pool.size
+    )
+    # artists whose albums were all fetched, their other album links are outdated
+    complete: list[str] = []
+
+    # both buffers flush with the same session, one after another
+    session_lock = asyncio.Lock()
+
+    async def write_albums(
+        session: AsyncSession, batch: list[tuple[str, schemas.Album]]
+    ) -> None:
+        async with session_lock:
+            written = await release_crud.write_artist_albums(session, batch, started)
+        result.albums_written += written
+
+    async def write_top_tracks(
+        session: AsyncSession, batch: list[tuple[str, list[schemas.Track]]]
+    ) -> None:
+        async with session_lock:
+            await release_crud.write_top_tracks(session, batch)
+        result.top_tracks_written += sum(len(tracks) for _, tracks in batch)
+
+    album_buffer = WriteBuffer(
+        db_session,
+        write_albums,
+        key=lambda item: (item[0], item[1].id),
+        name="albums",
+    )
+    top_track_buffer = WriteBuffer(
+        db_session, write_top_tracks, key=lambda item: item[0], name="top tracks"
+    )
+
+    async def fetch_artist(artist_id: str) -> None:
+        async with fetch_limit:
+            try:
+                async for albums in spotify_client.iter_artist_albums(
+                    artist_id, token_pool
+                ):
+                    await album_buffer.put([(artist_id, album) for album in albums])
+                complete.append(artist_id)
+            except SpotifyRequestFailed as e:
+                result.errors.append(f"albums of {artist_id}: {e}")
+
+            tracks = await token_pool.call(
+                lambda token: spotify_client.get_artist_top_tracks(
+                    artist_id, settings.spotify_market, token
+                )
+            )
+            if tracks is None:
+                result.errors.append(f"top tracks of {artist_id} failed")
+            else:
+                await top_track_buffer.put([(artist_id, tracks)])
+        result.artists_done += 1
+
+    try:
+        async with album_buffer, top_track_buffer:
+            await asyncio.gather(*map(fetch_artist, artist_ids))
+    except FlushFailed:
+        pass  # reported per buffer below
+
+    for buffer in [album_buffer, top_track_buffer]:
+        if buffer.failed_flushes != 0:
+            result.errors.append(
+                f"writing {buffer.failed_flushes} batches of {buffer.name} failed"
+            )
+    # links of a failed batch were not refreshed, they must not be pruned
+    if album_buffer.failed_flushes == 0:
+        result.albums_unlinked = await release_crud.prune_artist_albums(
+            db_session, complete, started
+        )
+    return result
+
+
+def _cache_headers(
+    settings: Settings,
+    version: schemas.ArtistVersion,
+    fields: tuple[str, ...] | None = None,
+) -> dict[str, str]:
+    if fields is None:
+        headers = {"ETag": f'"{version.content_hash}"'}
+    else:
+        # every projection is a different representation
+        headers = {"ETag": f'"{version.content_hash}.{".".join(fields)}"'}
+    if version.modified_manually:
+        # not refreshed by the update cycle, can change any time
+        headers["Cache-Control"] = "no-cache"
+        return headers
+
+    age = (datetime.now(timezone.utc) - version.refreshed).total_seconds()
+    max_age = max(0, int(settings.update_artists_interval - age))
+    headers["Cache-Control"] = f"public, max-age={max_age}"
+    return headers
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+_FieldsQuery = Annotated[
+    str | None,
+    Query(
+        description="Comma separated artist fields to return (e.g. `name,popularity`),"
+        " the id is always included. Only these fields are loaded from the database."
+    ),
+]
+
+
+def _parse_fields(fields: str | None) -> tuple[str, ...] | None:
+    if fields is None:
+        return None
+    try:
+        return schemas.artist_fields(
+            field.strip() for field in fields.split(",") if field.strip() != ""
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+@app.get("/artists", response_model=list[schemas.Artist])
+async def get_artists(
+    db_session: DbSessionDependency,
+    crud: ArtistCrudDependency,
+    fields: _FieldsQuery = None,
+) -> Response:
+    """Get all artists (streamed in batches)"""
+    return JSONArrayStreamingResponse(
+        crud.iter_artists(db_session, fields=_parse_fields(fields))
+    )
+
+
+_KEEPALIVE_INTERVAL = 15.0  # seconds
+
+
+async def _server_sent_events(
+    subscription: ChangeSubscription,
+) -> AsyncIterator[bytes]:
+    with subscription:
+        # the response (and its headers) starts before the first change
+        yield b": connected\n\n"
+        while True:
+            try:
+                change = await asyncio.wait_for(subscription.get(), _KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                # keeps proxies from closing idle connections
+                yield b": keepalive\n\n"
+                continue
+            yield b"event: artist_change\ndata: " + dumps(change) + b"\n\n"
+
+
+@app.get("/artists/outbox", response_model=schemas.OutboxPage)
+async def get_artist_outbox(
+    db_session: DbSessionDependency,
+    outbox_crud: ArtistOutboxCrudDependency,
+    after: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=10000)] = 1000,
+) -> schemas.OutboxPage:
+    """Changes of artists (id, changed fields, version) in the order they were
+    written, starting after the cursor `after`. Pass the returned cursor to
+    get the next page, an empty page means the consumer is up to date."""
+    return await outbox_crud.read_changes(db_session, after, limit)
+
+
+@app.get("/artist/{artist_id}/albums")
+async def get_artist_albums(
+    artist_id: str,
+    db_session: DbSessionDependency,
+    release_crud: ReleaseCrudDependency,
+    offset: Annotated[int, Query(ge=0)] = 0,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 50,
+) -> list[schemas.Album]:
+    """Albums of the artist, newest first, as of the last `update releases` job"""
+    return await release_crud.read_artist_albums(db_session, artist_id, offset, limit)
+
+
+@app.get("/artist/{artist_id}/top_tracks")
+async def get_artist_top_tracks(
+    artist_id: str,
+    db_session: DbSessionDependency,
+    release_crud: ReleaseCrudDependency,
+) -> list[schemas.Track]:
+    return await release_crud.read_top_tracks(db_session, artist_id)
+
+
+@app.get("/genres/stats")
+async def get_genre_stats(
+    db_session: DbSessionDependency,
+    genre_stats_crud: GenreStatsCrudDependency,
+    genre: Annotated[list[str], Query()] = [],
+    order_by: Literal["artist_count", "popularity", "followers"] = "artist_count",
+    limit: Annotated[int, Query(ge=1, le=10000)] = 100,
+) -> list[schemas.GenreStats]:
+    """Artist count, average popularity and total followers of the genres with
+    artists (or of the given genres), precomputed while artists are written"""
+    return await genre_stats_crud.read_stats(db_session, genre, order_by, limit)
+
+
+@app.get("/artists/changes")
+async def artist_changes(
+    artist_id: Annotated[list[str], Query()] = [],
+    genre: Annotated[list[str], Query()] = [],
+) -> StreamingResponse:
+    """Stream of artist changes as server-sent events. Optionally only for the
+    given artist ids and genres (repeat the parameter for several)."""
+    subscription = get_change_bus().subscribe(artist_id, genre)
+    return StreamingResponse(
+        _server_sent_events(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
-@app.get("/artist/{artist_id}")
+@app.websocket("/artists/changes/ws")
+async def artist_changes_websocket(
+    websocket: WebSocket,
+    artist_id: Annotated[list[str], Query()] = [],
+    genre: Annotated[list[str], Query()] = [],
+) -> None:
+    """Stream of artist changes over a websocket (same filters as /artists/changes)"""
+    await websocket.accept()
+    with get_change_bus().subscribe(artist_id, genre) as subscription:
+        # notices closed connections while there are no changes to send
+        disconnected = asyncio.create_task(_wait_for_disconnect(websocket))
+        try:
+            while True:
+                next_change = asyncio.create_task(subscription.get())
+                await asyncio.wait(
+                    {next_change, disconnected}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected.done():
+                    next_change.cancel()
+                    return
+                await websocket.send_text(dumps(next_change.result()).decode())
+        except WebSocketDisconnect:
+            pass
+        finally:
+            disconnected.cancel()
+
+
+async def _wait_for_disconnect(websocket: WebSocket) -> None:
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@app.get("/artist/{artist_id}", response_model=schemas.Artist | None)
 async def get_artist(
+    settings: SettingsDependency,
     db_session: DbSessionDependency,
     crud: ArtistCrudDependency,
+    response: Response,
     artist_id: str,
-) -> schemas.Artist | None:
-    """Get one artist by id"""
-    return await crud.read_artist(db_session, artist_id)
+    fields: _FieldsQuery = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> schemas.Artist | Response | None:
+    """Get one artist by id (supports conditional requests with If-None-Match)"""
+    projection = _parse_fields(fields)
+    version = await crud.read_artist_version(db_session, artist_id)
+    if version is None:
+        return None
+
+    headers: dict[str, str] = {}
+    if version.content_hash != "":
+        headers = _cache_headers(settings, version, projection)
+        if if_none_match is not None and _etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+    if projection is not None:
+        # not an `Artist`, so always rendered without the response model
+        partial_artist = await crud.read_artist(db_session, artist_id, projection)
+        return FastJSONResponse(partial_artist, headers=headers)
+
+    artist_cache = get_artist_cache()
+    artist = artist_cache.get(artist_id, version.content_hash)
+    if artist is None:
+        artist = await crud.read_artist(db_session, artist_id)
+        if artist is not None:
+            artist_cache.put(artist, version.content_hash)
+    fast_response = _artists_response(settings, artist, headers)
+    if fast_response is not None:
+        return fast_response
+
+    response.headers.update(headers)
+    return artist
 
 
 @app.put("/artist/{artist_id}")
@@ -172,6 +805,54 @@ async def update_artist(
     return await crud.update_artist(db_session, artist, False, True)
 
 
+@app.put("/artists")
+async def bulk_update_artists(
+    settings: SettingsDependency,
+    db_session: DbSessionDependency,
+    crud: ArtistCrudDependency,
+    items: Annotated[list[dict[str, Any]], Body()],
+) -> list[schemas.BulkArtistResult]:
+    """Manually edit (or create) many artists in one transaction.
+    Invalid items and repeated ids are reported per item and not written."""
+    if len(items) > settings.bulk_edit_max_artists:
+        raise HTTPException(
+            status_code=413,
+            detail=f"at most {settings.bulk_edit_max_artists} artists per request",
+        )
+
+    results: list[schemas.BulkArtistResult | None] = []
+    artists: list[schemas.Artist] = []
+    seen_ids: set[str] = set()
+    for item in items:
+        item_id = item.get("id")
+        try:
+            artist = schemas.Artist.parse_obj(item)
+        except ValidationError as e:
+            results.append(
+                schemas.BulkArtistResult(
+                    id=item_id if isinstance(item_id, str) else None,
+                    status=schemas.BulkArtistStatus.invalid,
+                    error=str(e),
+                )
+            )
+            continue
+        if artist.id in seen_ids:
+            results.append(
+                schemas.BulkArtistResult(
+                    id=artist.id,
+                    status=schemas.BulkArtistStatus.invalid,
+                    error="id is repeated in this request",
+                )
+            )
+            continue
+        seen_ids.add(artist.id)
+        artists.append(artist)
+        results.append(None)  # filled with the written result below
+
+    written = iter(await crud.bulk_update_artists(db_session, artists))
+    return [result or next(written) for result in results]
+
+
 @app.put("/artist/")
 async def create_artist(
     db_session: DbSessionDependency,
@@ -0,0 +1,413 @@
+import contextvars
+import fcntl
+import functools
+import inspect
+import json
+import math
+import os
+import socket
+import time
+from contextlib import contextmanager
+from logging import getLogger
+from typing import Any, Callable, Iterator, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from tracing import span
+
+
+_logger = getLogger(__file__)
+
+_DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    math.inf,
+)
+
+# a sample is (name, labels, value)
+_Sample = tuple[str, dict[str, str], float]
+
+
+class _Metric:
+    type = ""
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        registry.register(self)
+
+    def _key(self, labels: dict[str, str]) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: tuple[str, ...]) -> dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> list[_Sample]:
+        raise NotImplementedError()
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(
+        self, name: str, documentation: str, labelnames: tuple[str, ...] = ()
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> list[_Sample]:
+        return [
+            (f"{self.name}_total", self._labels(key), value)
+            for key, value in self._values.items()
+        ]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = _DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # per label set: counts per bucket (not cumulative), sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        if key not in self._values:
+            self._values[key] = ([0] * len(self.buckets), [0.0])
+        counts, total = self._values[key]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        total[0] += value
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list[_Sample]:
+        samples: list[_Sample] = []
+        for key, (counts, total) in self._values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else repr(bound)
+                samples.append(
+                    (f"{self.name}_bucket", {**labels, "le": le}, cumulative)
+                )
+            samples.append((f"{self.name}_sum", labels, total[0]))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        self._metrics[metric.name] = metric
+
+    def collect(self) -> dict[str, dict[str, Any]]:
+        return {
+            metric.name: {
+                "type": metric.type,
+                "help": metric.documentation,
+                "samples": metric.samples(),
+            }
+            for metric in self._metrics.values()
+        }
+
+
+registry = Registry()
+
+
+# (pid, file name) of this process, renewed in forked children
+_process_file: tuple[int, str] | None = None
+# pid of this process once it marked its metrics as final
+_exited_pid: int | None = None
+
+
+def _process_file_name() -> str:
+    # the api and the worker run in separate containers, where pids repeat
+    global _process_file
+    pid = os.getpid()
+    if _process_file is None or _process_file[0] != pid:
+        _process_file = (pid, f"{socket.gethostname()}-{pid}-{time.time_ns()}")
+    return _process_file[1]
+
+
+def write_process_metrics(directory: str, exited: bool = False) -> None:
+    """Stores the metrics of this process, so another process can serve them.
+    With exited, the process marks them as final and later writes are skipped,
+    they would count again after the file is archived."""
+    global _exited_pid
+    if _exited_pid == os.getpid():
+        return
+    name = _process_file_name()
+    path = os.path.join(directory, f"{name}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(registry.collect(), file)
+    os.replace(tmp_path, path)
+    if exited:
+        open(os.path.join(directory, f"{name}.exited"), "w").close()
+        _exited_pid = os.getpid()
+
+
+# metrics of exited processes, summed into one file
+_ARCHIVE_FILE = "exited.json"
+
+
+def collect_all_processes(directory: str) -> dict[str, dict[str, Any]]:
+    """Sums the metrics stored by all processes. The files of processes that
+    marked their exit are first folded into one archive, so their counts are
+    not lost (counters never decrease) and the directory does not grow."""
+    write_process_metrics(directory)
+    _archive_exited_processes(directory)
+    return _sum_files(
+        directory,
+        [name for name in sorted(os.listdir(directory)) if name.endswith(".json")],
+    )
+
+
+def _sum_files(directory: str, file_names: list[str]) -> dict[str, dict[str, Any]]:
+    merged: dict[str, dict[str, Any]] = {}
+    sums: dict[str, dict[tuple[str, tuple[tuple[str, str], ...]], float]] = {}
+    for file_name in file_names:
+        try:
+            with open(os.path.join(directory, file_name)) as file:
+                collected: dict[str, dict[str, Any]] = json.load(file)
+        except (OSError, ValueError):
+            _logger.warning("could not read metrics file %s", file_name)
+            continue
+
+        for name, metric in collected.items():
+            merged.setdefault(name, {"type": metric["type"], "help": metric["help"]})
+            metric_sums = sums.setdefault(name, {})
+            for sample_name, labels, value in metric["samples"]:
+                key = (sample_name, tuple(sorted(labels.items())))
+                metric_sums[key] = metric_sums.get(key, 0.0) + value
+
+    for name, metric in merged.items():
+        metric["samples"] = [
+            (sample_name, dict(labels), value)
+            for (sample_name, labels), value in sums[name].items()
+        ]
+    return merged
+
+
+def _archive_exited_processes(directory: str) -> None:
+    # one process at a time, so no file is archived twice
+    with open(os.path.join(directory, "archive.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        markers = [name for name in os.listdir(directory) if name.endswith(".exited")]
+        if len(markers) == 0:
+            return
+
+        exited = [f"{name[: -len('.exited')]}.json" for name in markers]
+        exited = [
+            name for name in exited if os.path.exists(os.path.join(directory, name))
+        ]
+
+        path = os.path.join(directory, _ARCHIVE_FILE)
+        if os.path.exists(path):
+            exited.append(_ARCHIVE_FILE)
+        archived = _sum_files(directory, exited)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(archived, file)
+        os.replace(f"{path}.tmp", path)
+        for name in exited:
+            if name != _ARCHIVE_FILE:
+                os.remove(os.path.join(directory, name))
+        for name in markers:
+            os.remove(os.path.join(directory, name))
+        _logger.info("archived the metrics of exited processes")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(collected: dict[str, dict[str, Any]]) -> str:
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines: list[str] = []
+    for name, metric in collected.items():
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for sample_name, labels, value in metric["samples"]:
+            if len(labels) != 0:
+                label_string = ",".join(
+                    f'{key}="{_escape(str(label))}"' for key, label in labels.items()
+                )
+                lines.append(f"{sample_name}{{{label_string}}} {float(value)!r}")
+            else:
+                lines.append(f"{sample_name} {float(value)!r}")
+    return "\n".join(lines) + "\n"
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds",
+    "Latency of http requests by route",
+    ("method", "route", "status"),
+)
+db_query_duration = Histogram(
+    "db_query_duration_seconds",
+    "Duration of database statements by crud method",
+    ("operation",),
+)
+spotify_request_duration = Histogram(
+    "spotify_request_duration_seconds",
+    "Latency of Spotify api calls by endpoint and status",
+    ("endpoint", "status"),
+)
+spotify_token_requests = Counter(
+    "spotify_token_requests",
+    "Spotify api calls by token of the token pool (client id, or user)",
+    ("token",),
+)
+spotify_rate_limited = Counter(
+    "spotify_rate_limited",
+    "Spotify api calls answered with 429 by token of the token pool",
+    ("token",),
+)
+job_duration = Histogram(
+    "job_duration_seconds",
+    "Duration of periodic job runs (worker and embedded scheduler)",
+    ("job",),
+)
+jobs_skipped = Counter(
+    "jobs_skipped",
+    "Job runs skipped because the previous run still held the lock",
+    ("job",),
+)
+
+
+# name of the crud method running in the current task, used to label db statements
+current_operation: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "current_operation", default="other"
+)
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def operation(name: str) -> Callable[[_F], _F]:
+    """Labels all statements executed by the decorated (async) function with `name`
+    and traces it in a span of that name"""
+
+    def decorator(func: _F) -> _F:
+        if inspect.isasyncgenfunction(func):
+
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+                # only label while the generator runs, not the consumer between items
+                generator = func(*args, **kwargs)
+                try:
+                    while True:
+                        token = current_operation.set(name)
+                        try:
+                            with span(name):
+                                item = await generator.__anext__()
+                        except StopAsyncIteration:
+                            return
+                        finally:
+                            current_operation.reset(token)
+                        yield item
+                finally:
+                    await generator.aclose()
+
+            return async_gen_wrapper  # type: ignore
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            token = current_operation.set(name)
+            try:
+                with span(name):
+                    return await func(*args, **kwargs)
+            finally:
+                current_operation.reset(token)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, many: bool
+) -> None:
+    # on the execution context, so a failed statement leaves nothing behind
+    context._metrics_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, many: bool
+) -> None:
+    start = context._metrics_query_start
+    db_query_duration.observe(
+        time.perf_counter() - start, operation=current_operation.get()
+    )
+
+
+class MetricsMiddleware:
+    """Observes the latency of every http request, labelled by the route template"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=str(status),
+            )
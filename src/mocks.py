@@ -1,11 +1,38 @@
+from datetime import datetime, timezone
+
+from catalog import Catalog, artist_index
 from db import DbSessionDependency
-from schemas import Artist, AuthToken, ExternalUrls, Followers, Genre, Image
+from schemas import (
+    Album,
+    AlbumPage,
+    Artist,
+    ArtistProjection,
+    ArtistVersion,
+    BulkArtistResult,
+    OutboxPage,
+    OutboxRecord,
+    BulkArtistStatus,
+    AuthToken,
+    ExternalUrls,
+    Followers,
+    Genre,
+    GenreStats,
+    Image,
+    Track,
+    artist_projection,
+)
 
 
 from pydantic import AnyHttpUrl, HttpUrl, parse_obj_as
 
 
-from typing import Sequence
+from typing import Any, AsyncGenerator, AsyncIterator, Sequence
+
+from spotify import (
+    SPOTIFY_MAX_ALBUMS_PER_PAGE,
+    SPOTIFY_MAX_ARTISTS_PER_REQUEST,
+    iter_pages,
+)
 
 
 class MockArtistCrud:
@@ -73,11 +100,168 @@ class MockArtistCrud:
 
         return updated_artists
 
+    @classmethod
+    async def bulk_update_artists(
+        cls, db_session: DbSessionDependency, updated_artists: Sequence[Artist]
+    ) -> list[BulkArtistResult]:
+        created = {artist.id for artist in updated_artists} - cls.artists.keys()
+        await cls.update_artists(db_session, updated_artists, False, True)
+        return [
+            BulkArtistResult(
+                id=artist.id,
+                status=BulkArtistStatus.created
+                if artist.id in created
+                else BulkArtistStatus.updated,
+                artist=artist,
+            )
+            for artist in updated_artists
+        ]
+
     @classmethod
     async def read_artist(
+        cls,
+        db_session: DbSessionDependency,
+        artist_id: str,
+        fields: tuple[str, ...] | None = None,
+    ) -> Artist | ArtistProjection | None:
+        artist = cls.artists.get(artist_id)
+        if artist is None:
+            return None
+        return cls._project(artist, fields)
+
+    @classmethod
+    async def iter_artists(
+        cls,
+        db_session: DbSessionDependency,
+        batch_size: int = 500,
+        fields: tuple[str, ...] | None = None,
+    ) -> AsyncGenerator[list[Artist | ArtistProjection], None]:
+        artists = sorted(cls.artists.values(), key=lambda artist: artist.id)
+        for i in range(0, len(artists), batch_size):
+            yield [cls._project(a, fields) for a in artists[i : i + batch_size]]
+
+    @staticmethod
+    def _project(
+        artist: Artist, fields: tuple[str, ...] | None
+    ) -> Artist | ArtistProjection:
+        if fields is None:
+            return artist
+        return artist_projection(fields)(
+            **{field: getattr(artist, field) for field in fields}
+        )
+
+    @classmethod
+    async def read_artist_version(
         cls, db_session: DbSessionDependency, artist_id: str
-    ) -> Artist | None:
-        return cls.artists.get(artist_id)
+    ) -> ArtistVersion | None:
+        artist = cls.artists.get(artist_id)
+        if artist is None:
+            return None
+        return ArtistVersion(
+            content_hash=artist.content_hash(),
+            refreshed=datetime.now(timezone.utc),
+            modified_manually=artist_id in cls.manual,
+        )
+
+
+class MockArtistOutboxCrud:
+    records = [
+        OutboxRecord(
+            position=position,
+            artist_id=artist_id,
+            fields=["popularity"],
+            version=f"version {position}",
+            created=datetime(2023, 1, 1, tzinfo=timezone.utc),
+        )
+        for position, artist_id in enumerate(["a", "b", "a"], start=1)
+    ]
+
+    @classmethod
+    async def read_changes(
+        cls, db_session: DbSessionDependency, after: int = 0, limit: int = 1000
+    ) -> OutboxPage:
+        records = [r for r in cls.records if r.position > after][:limit]
+        return OutboxPage(
+            records=records, cursor=records[-1].position if records else after
+        )
+
+    @classmethod
+    async def prune_changes(
+        cls,
+        db_session: DbSessionDependency,
+        older_than: datetime,
+        batch_size: int = 10000,
+    ) -> int:
+        return 0
+
+
+class MockGenreStatsCrud:
+    stats = [
+        GenreStats(
+            name="test genre",
+            artist_count=2,
+            average_popularity=1.5,
+            total_followers=3,
+        ),
+        GenreStats(
+            name="other genre", artist_count=1, average_popularity=2, total_followers=1
+        ),
+    ]
+
+    @classmethod
+    async def read_stats(
+        cls,
+        db_session: DbSessionDependency,
+        genres: Sequence[str] = (),
+        order_by: str = "artist_count",
+        limit: int = 100,
+    ) -> list[GenreStats]:
+        return [s for s in cls.stats if len(genres) == 0 or s.name in genres][:limit]
+
+
+class MockReleaseCrud:
+    albums = {
+        "a": [
+            Album(
+                id=f"album {i}",
+                name=f"test album {i}",
+                album_type="album",
+                album_group="album",
+                release_date=f"{2023 - i}",
+                total_tracks=10,
+                uri="",
+            )
+            for i in range(3)
+        ]
+    }
+    top_tracks = {
+        "a": [
+            Track(
+                id="track 0",
+                name="test track",
+                popularity=1,
+                duration_ms=180000,
+                uri="",
+                album_id="album 0",
+            )
+        ]
+    }
+
+    @classmethod
+    async def read_artist_albums(
+        cls,
+        db_session: DbSessionDependency,
+        artist_id: str,
+        offset: int = 0,
+        limit: int = 50,
+    ) -> list[Album]:
+        return cls.albums.get(artist_id, [])[offset : offset + limit]
+
+    @classmethod
+    async def read_top_tracks(
+        cls, db_session: DbSessionDependency, artist_id: str
+    ) -> list[Track]:
+        return cls.top_tracks.get(artist_id, [])
 
 
 class MockAuthTokenCrud:
@@ -122,7 +306,6 @@ class MockSpotifyClient:
     async def login(
         cls, client_id: str, base_url: AnyHttpUrl, state: str
     ) -> AnyHttpUrl:
-        print()
         return parse_obj_as(AnyHttpUrl, "http://example.com/spotify_sim")
 
     @classmethod
@@ -143,8 +326,76 @@ class MockSpotifyClient:
             token_type="token_type_test",
         )
 
+    @classmethod
+    async def get_client_credentials_token(cls, auth_header: str) -> AuthToken | None:
+        return AuthToken(
+            access_token=f"access_token_test_{auth_header}",
+            refresh_token="",
+            expires_in=3600,
+            scope="",
+            token_type="token_type_test",
+        )
+
     @classmethod
     async def get_artists(
         cls, artist_ids: list[str], auth_token: AuthToken
     ) -> list[Artist]:
         return list(MockArtistCrud.artists.values())
+
+
+class CatalogSpotifyClient(MockSpotifyClient):
+    """Serves the artists of a synthetic catalog at the current snapshot.
+    Unknown ids are left out of replies, like the nulls of the Spotify api."""
+
+    catalog = Catalog()
+    snapshot = 0
+
+    @classmethod
+    async def get_artists(
+        cls, artist_ids: list[str], auth_token: AuthToken
+    ) -> list[Artist]:
+        if len(artist_ids) > SPOTIFY_MAX_ARTISTS_PER_REQUEST:
+            # Spotify replies 400, which SpotifyClient logs
+            return []
+        indexes = [artist_index(artist_id) for artist_id in artist_ids]
+        return [
+            cls.catalog.artist(index, cls.snapshot)
+            for index in indexes
+            if index is not None and index < cls.catalog.size
+        ]
+
+    @classmethod
+    async def get_artist_albums(
+        cls,
+        artist_id: str,
+        auth_token: AuthToken,
+        offset: int = 0,
+        limit: int = SPOTIFY_MAX_ALBUMS_PER_PAGE,
+    ) -> AlbumPage | None:
+        index = artist_index(artist_id)
+        if index is None or index >= cls.catalog.size:
+            # Spotify replies 404, which SpotifyClient logs
+            return None
+        return AlbumPage.parse_obj(cls.catalog.albums_page(index, offset, limit))
+
+    @classmethod
+    async def iter_artist_albums(
+        cls, artist_id: str, token_pool: Any
+    ) -> AsyncIterator[list[Album]]:
+        async for page in iter_pages(
+            lambda token, offset: cls.get_artist_albums(artist_id, token, offset),
+            token_pool,
+        ):
+            yield page.items
+
+    @classmethod
+    async def get_artist_top_tracks(
+        cls, artist_id: str, market: str, auth_token: AuthToken
+    ) -> list[Track] | None:
+        index = artist_index(artist_id)
+        if index is None or index >= cls.catalog.size:
+            return None
+        return [
+            Track.parse_obj({**track, "album_id": track["album"]["id"]})
+            for track in cls.catalog.top_tracks_data(index)
+        ]
@@ -4,7 +4,7 @@ from typing import Any
 from datetime import datetime
 
 from sqlalchemy import Column, ForeignKey, Table
-from sqlalchemy import String, Integer, DateTime
+from sqlalchemy import JSON, BigInteger, String, Integer, DateTime
 from sqlalchemy.sql import func
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import mapped_column
@@ -54,16 +54,42 @@ class Genre(Base):
         return {"id": self.id, "name": self.name}
 
 
+class GenreStats(Base):
+    # aggregates over the artists of the genre, updated with every artist write
+    # (see ArtistCrud._write_genre_stats)
+    __tablename__ = "genre_stats"
+    genre_id: Mapped[int] = mapped_column(ForeignKey("genre.id"), primary_key=True)
+    artist_count: Mapped[int] = mapped_column(
+        Integer, nullable=False, default=0, index=True
+    )
+    popularity_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    followers_sum: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+    def repr_dict(self) -> dict[str, Any]:
+        return {"genre_id": self.genre_id, "artist_count": self.artist_count}
+
+
+# links are written in bulk by the crud (see ArtistCrud._write_image_links)
+image_association_table = Table(
+    "artist_image_association_table",
+    Base.metadata,
+    Column("artist_id", ForeignKey("artist.id", ondelete="CASCADE"), primary_key=True),
+    Column("image_id", ForeignKey("image_url.id"), primary_key=True, index=True),
+    # of the image in the artist's list
+    Column("position", Integer, nullable=False, default=0),
+)
+
+
 class Image(Base):
-    __tablename__ = "image"
+    # stored once per url, shared by the artists linking it
+    __tablename__ = "image_url"
     id: Mapped[int] = mapped_column(primary_key=True)
-    url: Mapped[str] = mapped_column(String(_STR_SIZE_LONG), nullable=False)
+    url: Mapped[str] = mapped_column(
+        String(_STR_SIZE_LONG), nullable=False, unique=True
+    )
     height: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
     width: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
-    artist_id: Mapped[str] = mapped_column(ForeignKey("artist.id"))
-    artist: Mapped[Artist] = relationship(back_populates="images")
-
     def repr_dict(self) -> dict[str, Any]:
         return {"id": self.id}
 
@@ -74,7 +100,7 @@ class ExternalUrls(Base):
     spotify: Mapped[str] = mapped_column(String(_STR_SIZE_LONG), nullable=False)
 
     # one to one
-    artist_id: Mapped[str] = mapped_column(ForeignKey("artist.id"))
+    artist_id: Mapped[str] = mapped_column(ForeignKey("artist.id"), index=True)
     artist: Mapped[Artist] = relationship(back_populates="external_urls")
 
     def repr_dict(self) -> dict[str, Any]:
@@ -88,7 +114,7 @@ class Followers(Base):
     total: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
     # one to one
-    artist_id: Mapped[str] = mapped_column(ForeignKey("artist.id"))
+    artist_id: Mapped[str] = mapped_column(ForeignKey("artist.id"), index=True)
     artist: Mapped[Artist] = relationship(back_populates="followers")
 
     def repr_dict(self) -> dict[str, Any]:
@@ -108,6 +134,15 @@ class Artist(Base):
 
     modified_manually: Mapped[bool] = mapped_column(nullable=False, default=False)
 
+    # hash of the stored representation, used as ETag
+    content_hash: Mapped[str] = mapped_column(
+        String(_STR_SIZE_SHORT), nullable=False, default=""
+    )
+    # last time the artist was written (by the update cycle or manually)
+    refreshed: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
     genres: Mapped[list[Genre]] = relationship(
         secondary=association_table, back_populates="artists"
     )
@@ -121,8 +156,77 @@ class Artist(Base):
     )
 
     images: Mapped[list[Image]] = relationship(
-        back_populates="artist", cascade="all, delete-orphan"
+        secondary=image_association_table,
+        order_by=image_association_table.c.position,
+        viewonly=True,
     )
 
     def repr_dict(self) -> dict[str, Any]:
         return {"id": self.id, "name": self.name}
+
+
+# written in bulk by the crud (see ReleaseCrud.write_artist_albums)
+album_association_table = Table(
+    "artist_album_association_table",
+    Base.metadata,
+    Column("artist_id", ForeignKey("artist.id", ondelete="CASCADE"), primary_key=True),
+    Column("album_id", ForeignKey("album.id"), primary_key=True, index=True),
+    Column("album_group", String(_STR_SIZE_SHORT), nullable=False, default=""),
+    # last fetch listing the album, older links are pruned after a complete fetch
+    Column("refreshed", DateTime(timezone=True), nullable=False),
+)
+
+
+class Album(Base):
+    __tablename__ = "album"
+    id: Mapped[str] = mapped_column(String(_STR_SIZE_LONG), primary_key=True)
+    name: Mapped[str] = mapped_column(String(_STR_SIZE_HUGE), nullable=False)
+    album_type: Mapped[str] = mapped_column(String(_STR_SIZE_SHORT), nullable=False)
+    release_date: Mapped[str] = mapped_column(String(_STR_SIZE_SHORT), nullable=False)
+    total_tracks: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    uri: Mapped[str] = mapped_column(String(_STR_SIZE_LONG), nullable=False)
+
+    def repr_dict(self) -> dict[str, Any]:
+        return {"id": self.id, "name": self.name}
+
+
+class TopTrack(Base):
+    # the top tracks of an artist are replaced as a whole
+    __tablename__ = "top_track"
+    artist_id: Mapped[str] = mapped_column(
+        ForeignKey("artist.id", ondelete="CASCADE"), primary_key=True
+    )
+    position: Mapped[int] = mapped_column(Integer, primary_key=True)
+    track_id: Mapped[str] = mapped_column(String(_STR_SIZE_LONG), nullable=False)
+    name: Mapped[str] = mapped_column(String(_STR_SIZE_HUGE), nullable=False)
+    popularity: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    duration_ms: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    uri: Mapped[str] = mapped_column(String(_STR_SIZE_LONG), nullable=False)
+    # not a foreign key, the album is not necessarily one of the artist's albums
+    album_id: Mapped[str | None] = mapped_column(String(_STR_SIZE_LONG), nullable=True)
+
+    def repr_dict(self) -> dict[str, Any]:
+        return {"artist_id": self.artist_id, "position": self.position}
+
+
+class ArtistOutbox(Base):
+    # compact change records, written in the transaction of the change
+    __tablename__ = "artist_outbox"
+    # the cursor of consumers, autoincrement needs INTEGER on sqlite
+    id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True
+    )
+    artist_id: Mapped[str] = mapped_column(String(_STR_SIZE_LONG), nullable=False)
+    # names of the changed fields, all fields for a created artist
+    fields: Mapped[list[str]] = mapped_column(JSON, nullable=False)
+    # content hash of the artist after the change (its ETag), empty if deleted
+    version: Mapped[str] = mapped_column(
+        String(_STR_SIZE_SHORT), nullable=False, default=""
+    )
+    deleted: Mapped[bool] = mapped_column(nullable=False, default=False)
+    created: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False, index=True
+    )
+
+    def repr_dict(self) -> dict[str, Any]:
+        return {"id": self.id, "artist_id": self.artist_id}
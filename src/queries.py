@@ -0,0 +1,122 @@
+import contextvars
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import current_operation
+
+
+@dataclass
+class Statement:
+    operation: str  # crud method, see metrics.operation
+    sql: str  # normalized, see normalize_sql
+    duration: float  # seconds
+
+
+@dataclass
+class QueryLog:
+    """Statements executed while a `count_queries` block is active"""
+
+    statements: list[Statement] = field(default_factory=list)
+
+    def count(self, operation: str | None = None) -> int:
+        return len(self._select(operation))
+
+    def duration(self, operation: str | None = None) -> float:
+        return sum(statement.duration for statement in self._select(operation))
+
+    def sql(self, operation: str | None = None) -> Counter[str]:
+        """Number of executions per normalized statement"""
+        return Counter(statement.sql for statement in self._select(operation))
+
+    def clear(self) -> None:
+        self.statements.clear()
+
+    def report(self) -> str:
+        lines = []
+        for operation in dict.fromkeys(s.operation for s in self.statements):
+            lines.append(
+                f"{operation}: {self.count(operation)} statements,"
+                f" {self.duration(operation) * 1000:.1f} ms"
+            )
+            for sql, count in self.sql(operation).most_common():
+                lines.append(f"  {count:4}x {sql}")
+        return "\n".join(lines)
+
+    def _select(self, operation: str | None) -> list[Statement]:
+        if operation is None:
+            return self.statements
+        return [s for s in self.statements if s.operation == operation]
+
+
+_PLACEHOLDER = r"(?:\?|\$\d+|%s|%\(\w+\)s|:\w+)"
+# (?, ?, ?) of expanded IN clauses
+_PLACEHOLDER_LIST = re.compile(rf"\(\s*{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+\s*\)")
+# VALUES (?), (?), (?) of multi row inserts
+_REPEATED_ROWS = re.compile(r"(\([^()]*\))(?:\s*,\s*\([^()]*\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str) -> str:
+    """The statement without its varying parts (whitespace, number of parameters
+    in IN lists and of inserted rows), so executions of the same query match"""
+    sql = _WHITESPACE.sub(" ", sql).strip()
+    sql = _PLACEHOLDER_LIST.sub("(...)", sql)
+    return _REPEATED_ROWS.sub(r"\1, ...", sql)
+
+
+# logs of the current context (task) and logs recording every statement
+_context_logs: contextvars.ContextVar[tuple[QueryLog, ...]] = contextvars.ContextVar(
+    "query_logs", default=()
+)
+_global_logs: list[QueryLog] = []
+
+
+@contextmanager
+def count_queries(all_tasks: bool = False) -> Iterator[QueryLog]:
+    """Records the statements executed inside the block by the current task, or by
+    every task and thread with `all_tasks` (e.g. requests of a TestClient)"""
+    log = QueryLog()
+    if all_tasks:
+        _global_logs.append(log)
+        try:
+            yield log
+        finally:
+            _global_logs.remove(log)
+        return
+
+    token = _context_logs.set((*_context_logs.get(), log))
+    try:
+        yield log
+    finally:
+        _context_logs.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, many: bool
+) -> None:
+    # on the execution context, so a failed statement leaves nothing behind
+    context._queries_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, many: bool
+) -> None:
+    start = context._queries_start
+    logs = (*_context_logs.get(), *_global_logs)
+    if len(logs) == 0:
+        return
+
+    recorded = Statement(
+        current_operation.get(), normalize_sql(statement), time.perf_counter() - start
+    )
+    for log in logs:
+        log.statements.append(recorded)
@@ -0,0 +1,104 @@
+import sys
+from typing import Any
+
+import schemas
+
+
+def _intern(value: str) -> str:
+    # urls are str subclasses (HttpUrl), which can not be interned themselves
+    return sys.intern(str(value))
+
+
+class ArtistRecord:
+    """Compact in-memory form of `schemas.Artist` for caches. Nested models are
+    flattened into tuples and genre names, types and urls are interned, so values
+    repeated across artists are stored only once."""
+
+    __slots__ = (
+        "id",
+        "type",
+        "href",
+        "name",
+        "popularity",
+        "uri",
+        "genres",
+        "external_url",
+        "followers_href",
+        "followers_total",
+        "images",
+    )
+
+    def __init__(
+        self,
+        id: str,
+        type: str,
+        href: str,
+        name: str,
+        popularity: int,
+        uri: str,
+        genres: tuple[str, ...],
+        external_url: str,
+        followers_href: str | None,
+        followers_total: int,
+        images: tuple[tuple[str, int, int], ...],  # url, height, width
+    ) -> None:
+        self.id = id
+        self.type = type
+        self.href = href
+        self.name = name
+        self.popularity = popularity
+        self.uri = uri
+        self.genres = genres
+        self.external_url = external_url
+        self.followers_href = followers_href
+        self.followers_total = followers_total
+        self.images = images
+
+    @classmethod
+    def from_artist(cls, artist: schemas.Artist) -> "ArtistRecord":
+        return cls(
+            artist.id,
+            _intern(artist.type),
+            _intern(artist.href),
+            artist.name,
+            artist.popularity,
+            artist.uri,
+            tuple(_intern(genre.name) for genre in artist.genres),
+            _intern(artist.external_urls.spotify),
+            None if artist.followers.href is None else _intern(artist.followers.href),
+            artist.followers.total,
+            tuple(
+                (_intern(image.url), image.height, image.width)
+                for image in artist.images
+            ),
+        )
+
+    def to_artist(self) -> schemas.Artist:
+        """Constructed without validation (the record was built from a valid artist)"""
+        return schemas.Artist.construct(
+            id=self.id,
+            type=self.type,
+            href=self.href,
+            name=self.name,
+            popularity=self.popularity,
+            uri=self.uri,
+            genres=[schemas.Genre.construct(__root__=genre) for genre in self.genres],
+            external_urls=schemas.ExternalUrls.construct(spotify=self.external_url),
+            followers=schemas.Followers.construct(
+                href=self.followers_href, total=self.followers_total
+            ),
+            images=[
+                schemas.Image.construct(url=url, height=height, width=width)
+                for url, height, width in self.images
+            ],
+        )
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, ArtistRecord):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        return f"ArtistRecord(id={self.id}, name={self.name})"
@@ -0,0 +1,59 @@
+from typing import Any, AsyncIterable, AsyncIterator, Sequence
+
+import orjson
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
+
+
+def _default(obj: Any) -> Any:
+    # nested models are serialized from their fields directly, without .dict() copies
+    if isinstance(obj, BaseModel):
+        if "__root__" in obj.__fields__:
+            return obj.__root__  # type: ignore
+        return obj.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson directly from (already validated)
+    pydantic models. Returning it from an endpoint also skips FastAPI's
+    validation against the response model and jsonable_encoder."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+async def _json_array_chunks(
+    batches: AsyncIterable[Sequence[BaseModel]],
+) -> AsyncIterator[bytes]:
+    separator = b"["
+    async for batch in batches:
+        if len(batch) == 0:
+            continue
+        items = [dumps(item) for item in batch]
+        yield separator + b",".join(items)
+        separator = b","
+
+    yield b"[]" if separator == b"[" else b"]"
+
+
+class JSONArrayStreamingResponse(StreamingResponse):
+    """Streams a json array batch by batch, so large lists are never
+    materialized completely and the first bytes are sent early"""
+
+    def __init__(
+        self,
+        batches: AsyncIterable[Sequence[BaseModel]],
+        status_code: int = 200,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        super().__init__(
+            _json_array_chunks(batches),
+            status_code=status_code,
+            headers=headers,
+            media_type="application/json",
+        )
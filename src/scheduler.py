@@ -0,0 +1,62 @@
+import asyncio
+import random
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Awaitable, Callable
+
+from metrics import job_duration
+import tracing
+
+
+_logger = getLogger(__file__)
+
+
+@dataclass
+class PeriodicJob:
+    name: str
+    interval: float  # seconds
+    func: Callable[[], Awaitable[None]]
+    jitter: float = 0.0  # seconds, added randomly to every interval
+
+
+class Scheduler:
+    """Runs periodic jobs as asyncio tasks inside the current process.
+    A job is never started again before its previous run has finished."""
+
+    def __init__(self, jobs: list[PeriodicJob]) -> None:
+        self.jobs = jobs
+        self._stopping = asyncio.Event()
+        self._tasks: list[asyncio.Task[None]] = []
+
+    def start(self) -> None:
+        self._stopping.clear()
+        self._tasks = [asyncio.create_task(self._run(job)) for job in self.jobs]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Lets running jobs finish within `timeout` seconds, then cancels them"""
+        self._stopping.set()
+        if len(self._tasks) == 0:
+            return
+
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+        for task in pending:
+            _logger.warning("cancelling job task %s on shutdown", task.get_name())
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, job: PeriodicJob) -> None:
+        while not self._stopping.is_set():
+            delay = job.interval + random.uniform(0, job.jitter)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+            _logger.info("running job %s", job.name)
+            try:
+                with job_duration.time(job=job.name), tracing.span(f"job {job.name}"):
+                    await job.func()
+            except Exception:
+                _logger.exception("job %s failed", job.name)
@@ -1,6 +1,9 @@
+import hashlib
 from datetime import datetime, timedelta, timezone
-from typing import Any, Union, TYPE_CHECKING
-from pydantic import BaseModel, Field, HttpUrl
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Iterable, Union, TYPE_CHECKING
+from pydantic import BaseModel, Field, HttpUrl, create_model
 from pydantic.utils import GetterDict
 
 if TYPE_CHECKING:
@@ -18,9 +21,10 @@ class AuthToken(BaseModel):
     class Config:
         orm_mode = True
 
-    def expired(self) -> bool:
+    def expired(self, margin: float = 0.0) -> bool:
+        """Whether the token expired or expires within `margin` seconds"""
         return datetime.now(timezone.utc) > self.created + timedelta(
-            seconds=self.expires_in
+            seconds=self.expires_in - margin
         )
 
 
@@ -95,6 +99,22 @@ class _UserGetter(GetterDict):
         return super().get(key, default)
 
 
+def _trusted_field(obj: Any, name: str) -> Any:
+    if name == "genres":
+        return [Genre.construct(__root__=genre.name) for genre in obj.genres]
+    if name == "external_urls":
+        return ExternalUrls.construct(spotify=obj.external_urls.spotify)
+    if name == "followers":
+        followers = obj.followers
+        return Followers.construct(href=followers.href, total=followers.total)
+    if name == "images":
+        return [
+            Image.construct(url=image.url, height=image.height, width=image.width)
+            for image in obj.images
+        ]
+    return getattr(obj, name)
+
+
 class Artist(BaseModel):
     id: str
     type: str
@@ -110,3 +130,169 @@ class Artist(BaseModel):
     class Config:
         orm_mode = True
         getter_dict = _UserGetter
+
+    def content_hash(self) -> str:
+        return hashlib.sha256(self.json(sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def from_orm_trusted(cls, obj: Any) -> "Artist":
+        """Like `from_orm`, but without validation, for rows that were validated when
+        they were written. Urls are kept as plain strings."""
+        return cls.construct(
+            **{name: _trusted_field(obj, name) for name in cls.__fields__}
+        )
+
+
+class ArtistProjection(BaseModel):
+    """Base of the artist models with only some of the fields
+    (see `artist_projection`)"""
+
+    class Config:
+        orm_mode = True
+        getter_dict = _UserGetter
+
+    @classmethod
+    def from_orm_trusted(cls, obj: Any) -> "ArtistProjection":
+        """See `Artist.from_orm_trusted`"""
+        return cls.construct(
+            **{name: _trusted_field(obj, name) for name in cls.__fields__}
+        )
+
+
+def artist_fields(requested: Iterable[str]) -> tuple[str, ...]:
+    """The requested artist fields in declaration order, always including the id.
+    Raises ValueError for unknown fields."""
+    requested = set(requested)
+    unknown = requested - Artist.__fields__.keys()
+    if len(unknown) != 0:
+        raise ValueError(f"unknown artist fields: {', '.join(sorted(unknown))}")
+    return tuple(
+        name for name in Artist.__fields__ if name == "id" or name in requested
+    )
+
+
+@lru_cache()
+def artist_projection(fields: tuple[str, ...]) -> type[ArtistProjection]:
+    """Artist model with only the given fields (as returned by `artist_fields`)"""
+    return create_model(  # type: ignore
+        f"Artist[{','.join(fields)}]",
+        __base__=ArtistProjection,
+        **{name: (Artist.__fields__[name].annotation, ...) for name in fields},
+    )
+
+
+class Album(BaseModel):
+    id: str
+    name: str
+    album_type: str  # album, single or compilation
+    # relation to the artist: album, single, compilation or appears_on
+    album_group: str = ""
+    release_date: str  # "2023", "2023-05" or "2023-05-01"
+    total_tracks: int
+    uri: str
+
+    class Config:
+        orm_mode = True
+
+
+class AlbumPage(BaseModel):
+    """Paging object of the Spotify api"""
+
+    items: list[Album]
+    total: int
+    offset: int
+    limit: int
+    next: str | None  # url of the next page
+
+
+class Track(BaseModel):
+    id: str
+    name: str
+    popularity: int
+    duration_ms: int
+    uri: str
+    album_id: str | None = None
+
+    class Config:
+        orm_mode = True
+
+
+class GenreStats(BaseModel):
+    name: str
+    artist_count: int
+    average_popularity: float
+    total_followers: int
+
+
+class ArtistChange(BaseModel):
+    artist_id: str
+    genres: list[str]  # genres of the artist before and after the change
+    changes: dict[str, Any] = {}  # changed fields with their new values
+    deleted: bool = False
+
+
+class OutboxRecord(BaseModel):
+    position: int  # of the record in the outbox, see OutboxPage.cursor
+    artist_id: str
+    fields: list[str]  # changed fields, all fields for a created artist
+    version: str  # content hash of the artist after the change (its ETag)
+    deleted: bool = False
+    created: datetime
+
+
+class OutboxPage(BaseModel):
+    records: list[OutboxRecord]
+    # position of the last record, pass as `after` to fetch the next page
+    cursor: int
+
+
+class ArtistVersion(BaseModel):
+    content_hash: str
+    refreshed: datetime
+    modified_manually: bool
+
+    class Config:
+        orm_mode = True
+
+
+class BulkArtistStatus(str, Enum):
+    created = "created"
+    updated = "updated"
+    invalid = "invalid"
+
+
+class BulkArtistResult(BaseModel):
+    id: str | None
+    status: BulkArtistStatus
+    artist: Artist | None = None
+    error: str | None = None
+
+
+class ReleaseUpdate(BaseModel):
+    """Result of fetching the albums and top tracks of the tracked artists"""
+
+    artists_total: int = 0
+    artists_done: int = 0
+    albums_written: int = 0  # new or changed
+    albums_unlinked: int = 0  # no longer listed by Spotify
+    top_tracks_written: int = 0
+    errors: list[str] = []
+
+
+class UpdateJobStatus(str, Enum):
+    running = "running"
+    succeeded = "succeeded"
+    failed = "failed"
+
+
+class UpdateJob(BaseModel):
+    id: str
+    status: UpdateJobStatus = UpdateJobStatus.running
+    created: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    finished: datetime | None = None
+
+    batches_total: int = 0
+    batches_done: int = 0
+    artists_written: int = 0
+    artists_skipped: int = 0  # requested but not returned by Spotify
+    errors: list[str] = []
@@ -1,50 +1,130 @@
 from logging import getLogger
-from typing import Annotated
+from typing import Annotated, AsyncIterator, Awaitable, Callable, TYPE_CHECKING
 from fastapi import Depends
-from httpx import AsyncClient
+import time
+from httpx import AsyncClient, Request, Response
 from pydantic import AnyHttpUrl, parse_obj_as
 import schemas
+from metrics import spotify_request_duration
+from tracing import span, traced
+
+if TYPE_CHECKING:
+    from token_pool import TokenPool
 
 
 _logger = getLogger(__file__)
 
+# the several artists endpoint accepts at most 50 ids
+SPOTIFY_MAX_ARTISTS_PER_REQUEST = 50
+# largest page of the albums of an artist
+SPOTIFY_MAX_ALBUMS_PER_PAGE = 50
+
+_http_client: AsyncClient | None = None
+
+
+class SpotifyRateLimited(Exception):
+    """The token exceeded the rate limit of Spotify (429 reply)"""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"rate limited, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class SpotifyRequestFailed(Exception):
+    """A page could not be fetched, the pages before it were already yielded"""
+
+
+async def iter_pages(
+    get_page: Callable[[schemas.AuthToken, int], Awaitable[schemas.AlbumPage | None]],
+    token_pool: "TokenPool",
+) -> AsyncIterator[schemas.AlbumPage]:
+    """Fetches the pages one after another with tokens of the pool, so only one
+    page is held in memory. `get_page` gets the token and the offset."""
+    offset = 0
+    while True:
+        page = await token_pool.call(lambda token: get_page(token, offset))
+        if page is None:
+            raise SpotifyRequestFailed(f"getting the page at offset {offset} failed")
+        yield page
+        offset += len(page.items)
+        if page.next is None or len(page.items) == 0:
+            return
+
+
+async def _mark_request_start(request: Request) -> None:
+    request.extensions["start"] = time.perf_counter()
+
+
+async def _observe_response(response: Response) -> None:
+    start = response.request.extensions.get("start")
+    if start is not None:
+        # paths with ids are labelled by their route, the label values are bounded
+        endpoint = response.request.extensions.get("route", response.request.url.path)
+        spotify_request_duration.observe(
+            time.perf_counter() - start,
+            endpoint=endpoint,
+            status=str(response.status_code),
+        )
+
+
+def get_http_client() -> AsyncClient:
+    """Shared client, so connections to Spotify are pooled between calls"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = AsyncClient(
+            event_hooks={
+                "request": [_mark_request_start],
+                "response": [_observe_response],
+            }
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 
 class SpotifyClient:
     @staticmethod
+    @traced("SpotifyClient.login")
     async def login(client_id: str, base_url: AnyHttpUrl, state: str) -> AnyHttpUrl:
-        async with AsyncClient() as client:
-            reply = await client.get(
-                "https://accounts.spotify.com/authorize",
-                params={
-                    "client_id": client_id,
-                    "response_type": "code",
-                    "scope": "user-read-private user-read-email",
-                    "redirect_uri": f"{base_url}/login_response",
-                    "state": state,
-                },
-                follow_redirects=True,
-            )
+        client = get_http_client()
+        reply = await client.get(
+            "https://accounts.spotify.com/authorize",
+            params={
+                "client_id": client_id,
+                "response_type": "code",
+                "scope": "user-read-private user-read-email",
+                "redirect_uri": f"{base_url}/login_response",
+                "state": state,
+            },
+            follow_redirects=True,
+        )
         url_str = str(reply.url)
         return parse_obj_as(AnyHttpUrl, url_str)
 
     @staticmethod
+    @traced("SpotifyClient.get_token")
     async def get_token(
         base_url: AnyHttpUrl, auth_header: str, code: str
     ) -> schemas.AuthToken | None:
-        async with AsyncClient() as client:
-            reply = await client.post(
-                "https://accounts.spotify.com/api/token",
-                data={
-                    "grant_type": "authorization_code",
-                    "code": code,
-                    "redirect_uri": f"{base_url}/login_response",
-                },
-                headers={
-                    "Authorization": f"Basic {auth_header}",
-                    "Content-Type": "application/x-www-form-urlencoded",
-                },
-                follow_redirects=True,
-            )
+        client = get_http_client()
+        reply = await client.post(
+            "https://accounts.spotify.com/api/token",
+            data={
+                "grant_type": "authorization_code",
+                "code": code,
+                "redirect_uri": f"{base_url}/login_response",
+            },
+            headers={
+                "Authorization": f"Basic {auth_header}",
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+            follow_redirects=True,
+        )
         if reply.is_error:
             _logger.error("getting auth tokens failed. Reply was %s", reply)
 
@@ -53,22 +133,23 @@ class SpotifyClient:
         return schemas.AuthToken.validate(reply_json)
 
     @staticmethod
+    @traced("SpotifyClient.refresh_token")
     async def refresh_token(
         old_token: schemas.AuthToken, auth_header: str
     ) -> schemas.AuthToken | None:
-        async with AsyncClient() as client:
-            reply = await client.post(
-                "https://accounts.spotify.com/api/token",
-                data={
-                    "grant_type": "refresh_token",
-                    "refresh_token": old_token.refresh_token,
-                },
-                headers={
-                    "Authorization": f"Basic {auth_header}",
-                    "Content-Type": "application/x-www-form-urlencoded",
-                },
-                follow_redirects=True,
-            )
+        client = get_http_client()
+        reply = await client.post(
+            "https://accounts.spotify.com/api/token",
+            data={
+                "grant_type": "refresh_token",
+                "refresh_token": old_token.refresh_token,
+            },
+            headers={
+                "Authorization": f"Basic {auth_header}",
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+            follow_redirects=True,
+        )
         if reply.is_error:
             _logger.error("getting auth tokens failed. Reply was %s", reply)
             return
@@ -78,25 +159,122 @@ class SpotifyClient:
         return schemas.AuthToken.validate(reply_json)
 
     @staticmethod
+    @traced("SpotifyClient.get_client_credentials_token")
+    async def get_client_credentials_token(
+        auth_header: str,
+    ) -> schemas.AuthToken | None:
+        """App token without a user, enough for the catalog endpoints"""
+        client = get_http_client()
+        reply = await client.post(
+            "https://accounts.spotify.com/api/token",
+            data={"grant_type": "client_credentials"},
+            headers={
+                "Authorization": f"Basic {auth_header}",
+                "Content-Type": "application/x-www-form-urlencoded",
+            },
+            follow_redirects=True,
+        )
+        if reply.is_error:
+            _logger.error(
+                "getting a client credentials token failed. Reply was %s", reply
+            )
+            return None
+
+        reply_json = reply.json()
+        # the client credentials flow has neither a refresh token nor scopes
+        reply_json.setdefault("refresh_token", "")
+        reply_json.setdefault("scope", "")
+        return schemas.AuthToken.validate(reply_json)
+
+    @staticmethod
+    @traced("SpotifyClient.get_artists")
     async def get_artists(
         artist_ids: list[str], auth_token: schemas.AuthToken
     ) -> list[schemas.Artist]:
-        async with AsyncClient() as client:
-            reply = await client.get(
-                "https://api.spotify.com/v1/artists",
-                params={"ids": ",".join(artist_ids)},
-                headers={"Authorization": f"Bearer {auth_token.access_token}"},
-                follow_redirects=True,
-            )
+        client = get_http_client()
+        reply = await client.get(
+            "https://api.spotify.com/v1/artists",
+            params={"ids": ",".join(artist_ids)},
+            headers={"Authorization": f"Bearer {auth_token.access_token}"},
+            follow_redirects=True,
+        )
+        if reply.status_code == 429:
+            raise SpotifyRateLimited(float(reply.headers.get("Retry-After", 1)))
         if reply.is_error:
             _logger.error("getting artists failed. Reply was %s", reply)
             return []
 
-        reply_json = reply.json()
-
-        artists = parse_obj_as(list[schemas.Artist], reply_json.get("artists"))
+        with span("parse artists"):
+            reply_json = reply.json()
+            artists = parse_obj_as(list[schemas.Artist], reply_json.get("artists"))
         _logger.debug("got artists %s", artists)
         return artists
 
+    @staticmethod
+    @traced("SpotifyClient.get_artist_albums")
+    async def get_artist_albums(
+        artist_id: str,
+        auth_token: schemas.AuthToken,
+        offset: int = 0,
+        limit: int = SPOTIFY_MAX_ALBUMS_PER_PAGE,
+    ) -> schemas.AlbumPage | None:
+        client = get_http_client()
+        reply = await client.get(
+            f"https://api.spotify.com/v1/artists/{artist_id}/albums",
+            params={
+                "include_groups": "album,single,compilation,appears_on",
+                "offset": offset,
+                "limit": limit,
+            },
+            headers={"Authorization": f"Bearer {auth_token.access_token}"},
+            follow_redirects=True,
+            extensions={"route": "/v1/artists/{id}/albums"},
+        )
+        if reply.status_code == 429:
+            raise SpotifyRateLimited(float(reply.headers.get("Retry-After", 1)))
+        if reply.is_error:
+            _logger.error("getting albums failed. Reply was %s", reply)
+            return None
+
+        with span("parse albums"):
+            return schemas.AlbumPage.parse_raw(reply.content)
+
+    @staticmethod
+    async def iter_artist_albums(
+        artist_id: str, token_pool: "TokenPool"
+    ) -> AsyncIterator[list[schemas.Album]]:
+        """All albums of the artist, page by page"""
+        async for page in iter_pages(
+            lambda token, offset: SpotifyClient.get_artist_albums(
+                artist_id, token, offset
+            ),
+            token_pool,
+        ):
+            yield page.items
+
+    @staticmethod
+    @traced("SpotifyClient.get_artist_top_tracks")
+    async def get_artist_top_tracks(
+        artist_id: str, market: str, auth_token: schemas.AuthToken
+    ) -> list[schemas.Track] | None:
+        client = get_http_client()
+        reply = await client.get(
+            f"https://api.spotify.com/v1/artists/{artist_id}/top-tracks",
+            params={"market": market},
+            headers={"Authorization": f"Bearer {auth_token.access_token}"},
+            follow_redirects=True,
+            extensions={"route": "/v1/artists/{id}/top-tracks"},
+        )
+        if reply.status_code == 429:
+            raise SpotifyRateLimited(float(reply.headers.get("Retry-After", 1)))
+        if reply.is_error:
+            _logger.error("getting top tracks failed. Reply was %s", reply)
+            return None
+
+        return [
+            schemas.Track.parse_obj({**track, "album_id": track["album"]["id"]})
+            for track in reply.json()["tracks"]
+        ]
+
 
 SpotifyClientDependency = Annotated[SpotifyClient, Depends(SpotifyClient)]
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from cache import ArtistCache, get_genre_cache
+from catalog import Catalog, artist_id
+from db import Base
+from mocks import MockArtistCrud
+from warmup import warm_up_caches
+
+
+def test_artist_cache_checks_content_hash():
+    artist = MockArtistCrud.artists["a"].copy(deep=True)
+    cache = ArtistCache(10)
+    cache.put(artist, artist.content_hash())
+
+    assert cache.get("a", artist.content_hash()) == artist
+    assert cache.get("a", "outdated") is None
+    assert cache.get("b", artist.content_hash()) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_artist_cache_evicts_least_recently_used():
+    a, b = [artist.copy(deep=True) for artist in MockArtistCrud.artists.values()]
+    c = a.copy(update={"id": "c"})
+    cache = ArtistCache(2)
+    cache.put(a, a.content_hash())
+    cache.put(b, b.content_hash())
+    cache.get("a", a.content_hash())
+
+    cache.put(c, c.content_hash())
+
+    assert len(cache) == 2
+    assert cache.get("b", b.content_hash()) is None
+    assert cache.get("a", a.content_hash()) is not None
+
+
+def test_artist_cache_disabled():
+    cache = ArtistCache(0)
+    cache.put(MockArtistCrud.artists["a"], "hash")
+
+    assert len(cache) == 0
+
+
+def test_artist_cache_warm_never_evicts():
+    a, b = [artist.copy(deep=True) for artist in MockArtistCrud.artists.values()]
+    c = a.copy(update={"id": "c"})
+    cache = ArtistCache(2)
+    cache.put(a, a.content_hash())
+
+    assert cache.warm(b, b.content_hash())
+    assert not cache.warm(c, c.content_hash())
+    # preloaded artists are evicted first
+    cache.put(c, c.content_hash())
+    assert cache.get("b", b.content_hash()) is None
+    assert cache.get("a", a.content_hash()) is not None
+
+
+def test_artist_cache_memory_usage():
+    artist = MockArtistCrud.artists["a"]
+    cache = ArtistCache(100)
+    empty = cache.memory_usage()
+    for i in range(50):
+        cache.put(artist.copy(update={"id": f"artist {i}"}), "hash")
+
+    assert empty < cache.memory_usage(sample_size=10) < 50 * 10_000
+
+
+@pytest.mark.asyncio
+async def test_warm_up_caches():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    catalog = Catalog(size=100, genres=20)
+    await catalog.fill_database(session_maker)
+    cache = ArtistCache(1000)
+
+    report = await warm_up_caches(session_maker, cache, 30, 10.0, batch_size=7)
+
+    assert report.artists == len(cache) == 30
+    genres = {g.__root__ for i in range(100) for g in catalog.artist(i).genres}
+    assert report.genres == len(get_genre_cache(engine.sync_engine)) == len(genres)
+    assert not report.budget_exhausted
+    assert report.artist_cache_bytes > 0 and report.genre_cache_bytes > 0
+    popularity = sorted((catalog.artist(i).popularity for i in range(100)))
+    cached = [
+        cache.get(artist_id(i), catalog.artist(i).content_hash()) for i in range(100)
+    ]
+    assert sorted(artist.popularity for artist in cached if artist is not None) == (
+        popularity[-30:]
+    )
+
+    # stops after the first batch without time budget
+    report = await warm_up_caches(session_maker, ArtistCache(1000), 30, 0.0, 7)
+    assert report.artists == 7 and report.budget_exhausted
+    await engine.dispose()
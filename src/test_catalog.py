@@ -0,0 +1,150 @@
+import io
+import logging
+import sqlite3
+import sys
+from collections import Counter
+from contextlib import closing
+from pathlib import Path
+
+import orjson
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from catalog import (
+    PLACEHOLDER_SETTINGS,
+    Catalog,
+    artist_id,
+    artist_index,
+    genre_vocabulary,
+    main,
+)
+from config import get_settings
+from crud import ArtistCrud
+from db import create_db_and_tables
+from events import get_change_bus
+from mocks import CatalogSpotifyClient, MockSpotifyClient
+import models
+
+
+def test_deterministic():
+    catalog = Catalog(size=100, seed=1)
+
+    assert catalog.artist_data(42) == Catalog(size=100, seed=1).artist_data(42)
+    assert catalog.artist_data(42) != Catalog(size=100, seed=2).artist_data(42)
+    assert catalog.artist(42).id == artist_id(42)
+    assert artist_index(artist_id(42)) == 42
+    assert artist_index("4Z8W4fKeB5YxbusRsdQVPb") is None
+
+
+def test_distributions():
+    catalog = Catalog(size=2000, genres=500)
+    artists = list(catalog.iter_data())
+
+    ranks = sorted(catalog.rank(i) for i in range(catalog.size))
+    assert ranks == list(range(1, catalog.size + 1))
+    top = max(artists, key=lambda artist: artist["followers"]["total"])
+    assert top["followers"]["total"] == catalog.max_followers
+    assert top["popularity"] == 100
+    popularity = sorted(artist["popularity"] for artist in artists)
+    assert popularity[len(popularity) // 2] < 50
+
+    genres = Counter(genre for artist in artists for genre in artist["genres"])
+    assert set(genres) <= set(catalog.vocabulary)
+    assert genres.most_common(1)[0][0] == catalog.vocabulary[0]
+    image_counts = Counter(len(artist["images"]) for artist in artists)
+    assert image_counts.most_common(1)[0][0] == 3
+    assert len(set(genre_vocabulary(5000))) == 5000
+
+
+def test_churn():
+    catalog = Catalog(size=1000, churn=0.2)
+
+    changed = [i for i in range(catalog.size) if catalog.changed(i, 1)]
+    assert 100 < len(changed) < 300
+    unchanged = next(i for i in range(catalog.size) if i not in changed)
+    assert catalog.artist_data(unchanged, 1) == catalog.artist_data(unchanged, 0)
+    assert catalog.artist_data(changed[0], 1) != catalog.artist_data(changed[0], 0)
+
+
+def test_albums_pages():
+    catalog = Catalog(size=100, max_albums=120)
+    top = next(i for i in range(catalog.size) if catalog.rank(i) == 1)
+
+    pages = [catalog.albums_page(top, offset, 50) for offset in range(0, 150, 50)]
+
+    assert [len(page["items"]) for page in pages] == [50, 50, 20]
+    assert [page["next"] is None for page in pages] == [False, False, True]
+    ids = [album["id"] for page in pages for album in page["items"]]
+    assert len(set(ids)) == catalog.album_count(top) == 120
+    dates = [album["release_date"] for page in pages for album in page["items"]]
+    assert dates == sorted(dates, reverse=True)
+    assert len(catalog.top_tracks_data(top)) == 10
+
+
+def test_write_ndjson():
+    catalog = Catalog(size=10)
+    file = io.BytesIO()
+
+    assert catalog.write_ndjson(file) == 10
+    lines = file.getvalue().splitlines()
+    assert [orjson.loads(line) for line in lines] == list(catalog.iter_data())
+
+
+@pytest.mark.asyncio
+async def test_fill_database():
+    engine = create_async_engine("sqlite+aiosqlite://")
+    await create_db_and_tables(engine)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    catalog = Catalog(size=30)
+
+    await catalog.fill_database(session_maker, batch_size=7)
+
+    async with session_maker() as session:
+        count = await session.scalar(select(func.count()).select_from(models.Artist))
+    assert count == 30
+    async with session_maker() as session:
+        stored = await ArtistCrud.read_artist(session, artist_id(3))
+    # the order of genres is not stored
+    expected = catalog.artist(3)
+    assert stored.copy(update={"genres": []}) == expected.copy(update={"genres": []})
+    assert {g.name for g in stored.genres} == {g.name for g in expected.genres}
+    await engine.dispose()
+
+
+def test_main_fills_database_without_app_settings(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, caplog: pytest.LogCaptureFixture
+):
+    for key in PLACEHOLDER_SETTINGS:
+        monkeypatch.delenv(key, raising=False)
+    # read again without the environment, and with it by later tests
+    get_settings.cache_clear()
+    get_change_bus.cache_clear()
+    path = tmp_path / "catalog.db"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["catalog.py", "--size", "5", "--database-url", f"sqlite+aiosqlite:///{path}"],
+    )
+
+    try:
+        main()
+    finally:
+        get_settings.cache_clear()
+        get_change_bus.cache_clear()
+
+    with closing(sqlite3.connect(path)) as connection:
+        (count,) = connection.execute("SELECT count(*) FROM artist").fetchone()
+    assert count == 5
+    # e.g. publishing the changes did not fail on missing settings
+    assert [r for r in caplog.records if r.levelno >= logging.ERROR] == []
+
+
+@pytest.mark.asyncio
+async def test_catalog_spotify_client():
+    ids = [artist_id(1), artist_id(5), "unknown", artist_id(10_000)]
+
+    artists = await CatalogSpotifyClient.get_artists(ids, MockSpotifyClient.login_token)
+
+    assert [artist.id for artist in artists] == [artist_id(1), artist_id(5)]
+    assert artists[0] == CatalogSpotifyClient.catalog.artist(1)
@@ -0,0 +1,101 @@
+import asyncio
+import gzip
+
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from compression import CompressionMiddleware, negotiate_encoding
+
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+
+@app.get("/small")
+async def small() -> PlainTextResponse:
+    return PlainTextResponse("x" * 10)
+
+
+@app.get("/large")
+async def large() -> PlainTextResponse:
+    return PlainTextResponse("x" * 1000)
+
+
+@app.get("/stream")
+async def stream() -> StreamingResponse:
+    async def chunks():
+        for i in range(10):
+            yield f"chunk {i};".encode()
+
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
+@app.get("/events")
+async def events() -> StreamingResponse:
+    async def chunks():
+        for i in range(3):
+            yield f"data: {i}\n\n".encode()
+
+    return StreamingResponse(chunks(), media_type="text/event-stream")
+
+
+client = TestClient(app)
+
+
+def test_negotiate_encoding():
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("gzip;q=0") is None
+    assert negotiate_encoding("identity") is None
+    assert negotiate_encoding("*") in {"br", "gzip"}
+
+
+def test_compress_large_response():
+    response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert int(response.headers["Content-Length"]) < 1000
+    assert response.text == "x" * 1000
+
+
+def test_small_response_not_compressed():
+    response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+    assert response.text == "x" * 10
+
+
+def test_compress_streamed_response():
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as r:
+        raw = b"".join(r.iter_raw())
+
+    assert r.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in r.headers
+    assert gzip.decompress(raw) == b"".join(f"chunk {i};".encode() for i in range(10))
+
+
+def test_event_stream_not_compressed():
+    with client.stream("GET", "/events", headers={"Accept-Encoding": "gzip"}) as r:
+        raw = b"".join(r.iter_raw())
+
+    assert "Content-Encoding" not in r.headers
+    assert raw == b"data: 0\n\ndata: 1\n\ndata: 2\n\n"
+
+
+def test_event_stream_headers_sent_immediately():
+    sent: list[str] = []
+
+    async def event_stream(scope, receive, send) -> None:
+        headers = [(b"content-type", b"text/event-stream")]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        # still waiting for the first event
+        assert sent == ["http.response.start"]
+
+    async def send(message) -> None:
+        sent.append(message["type"])
+
+    middleware = CompressionMiddleware(event_stream)
+    scope = {"type": "http", "headers": [(b"accept-encoding", b"gzip")]}
+    asyncio.run(middleware(scope, None, send))  # type: ignore
+
+    assert sent == ["http.response.start"]
@@ -1,13 +1,35 @@
-from typing import AsyncGenerator
+from datetime import datetime, timedelta, timezone
+from typing import AsyncGenerator, Sequence
 from pydantic import HttpUrl, parse_obj_as
 import pytest
 import pytest_asyncio
-from sqlalchemy import select
+from sqlalchemy import inspect, select, text, update
 
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
-from db import Base
-from crud import ArtistCrud, AuthTokenCrud
+from events import ChangeBus, get_change_bus
+from queries import QueryLog
+from db import (
+    SCHEMA_VERSION,
+    Base,
+    SchemaMismatch,
+    create_db_and_tables,
+    schema_version_table,
+)
+from catalog import Catalog, artist_id
+from cache import get_genre_cache
+from config import get_settings
+from crud import (
+    ArtistCrud,
+    ArtistOutboxCrud,
+    AuthTokenCrud,
+    GenreStatsCrud,
+    ReleaseCrud,
+)
+from main import update_releases_from_spotify
+from mocks import CatalogSpotifyClient, MockAuthTokenCrud
+from token_pool import reset_token_pool
+import crud
 import schemas
 import models
 
@@ -214,3 +236,737 @@ async def test_delete_artist(session_maker_fixture: async_sessionmaker[AsyncSess
         artist_in_db = await ArtistCrud.read_artist(session, artist_id=artist.id)
 
     assert artist_in_db is None
+
+
+@pytest.mark.asyncio
+async def test_update_artists_keeps_genres_per_artist(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    _url = parse_obj_as(HttpUrl, "http://example.com/a")
+    artists = [
+        schemas.Artist(
+            id=artist_id,
+            type="artist",
+            href=_url,
+            name=f"test artist {artist_id}",
+            popularity=1,
+            uri="",
+            genres=[schemas.Genre(__root__=f"genre {artist_id}")],
+            external_urls=schemas.ExternalUrls(spotify=_url),
+            followers=schemas.Followers(href=None, total=1),
+            images=[schemas.Image(url=_url, height=10, width=20)],
+        )
+        for artist_id in ["a", "b"]
+    ]
+
+    async with session_maker_fixture() as session:
+        returned_artists = await ArtistCrud.update_artists(session, artists)
+
+    assert sorted(returned_artists, key=lambda a: a.id) == artists
+
+
+@pytest.mark.asyncio
+async def test_read_artist_version(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    _url = parse_obj_as(HttpUrl, "http://example.com/a")
+    artist = schemas.Artist(
+        id="a",
+        type="artist",
+        href=_url,
+        name="test artist a",
+        popularity=1,
+        uri="",
+        genres=[schemas.Genre(__root__="test genre")],
+        external_urls=schemas.ExternalUrls(spotify=_url),
+        followers=schemas.Followers(href=None, total=1),
+        images=[schemas.Image(url=_url, height=10, width=20)],
+    )
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artist(session, artist)
+
+    async with session_maker_fixture() as session:
+        version = await ArtistCrud.read_artist_version(session, artist.id)
+
+    assert version is not None
+    assert version.content_hash == artist.content_hash()
+    assert not version.modified_manually
+
+    async with session_maker_fixture() as session:
+        artist.popularity = 2
+        await ArtistCrud.update_artist(session, artist)
+
+    async with session_maker_fixture() as session:
+        updated_version = await ArtistCrud.read_artist_version(session, artist.id)
+
+    assert updated_version is not None
+    assert updated_version.content_hash != version.content_hash
+
+
+@pytest.mark.asyncio
+async def test_update_artists_shared_genre_created_once(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    _url = parse_obj_as(HttpUrl, "http://example.com/a")
+    artists = [
+        schemas.Artist(
+            id=artist_id,
+            type="artist",
+            href=_url,
+            name=f"test artist {artist_id}",
+            popularity=1,
+            uri="",
+            genres=[schemas.Genre(__root__="shared genre")],
+            external_urls=schemas.ExternalUrls(spotify=_url),
+            followers=schemas.Followers(href=None, total=1),
+            images=[schemas.Image(url=_url, height=10, width=20)],
+        )
+        for artist_id in ["a", "b", "c"]
+    ]
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artists(session, artists)
+
+    async with session_maker_fixture() as session:
+        genres_in_db = (await session.execute(select(models.Genre))).scalars().all()
+
+    assert [genre.name for genre in genres_in_db] == ["shared genre"]
+
+
+@pytest.mark.asyncio
+async def test_update_artists_shared_image_stored_once(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    shared = schemas.Image(url="http://example.com/shared", height=10, width=20)
+    own = schemas.Image(url="http://example.com/own", height=10, width=20)
+    artists = [
+        _artist_without_images(artist_id).copy(update={"images": [shared]})
+        for artist_id in ["a", "b"]
+    ]
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artists(session, artists)
+    async with session_maker_fixture() as session:
+        updated = artists[0].copy(update={"images": [own, shared]})
+        assert await ArtistCrud.update_artist(session, updated) == updated
+
+    async with session_maker_fixture() as session:
+        assert (await ArtistCrud.read_artist(session, "b")).images == [shared]
+        images_in_db = (await session.execute(select(models.Image))).scalars().all()
+        assert sorted(image.url for image in images_in_db) == [own.url, shared.url]
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.delete_artist(session, "a")
+    async with session_maker_fixture() as session:
+        images_in_db = (await session.execute(select(models.Image))).scalars().all()
+        # the shared image is still linked by b
+        assert [image.url for image in images_in_db] == [shared.url]
+
+
+@pytest.mark.asyncio
+async def test_update_artists_image_table_does_not_grow_with_churn(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    catalog = Catalog(size=20, churn=1.0)
+
+    for snapshot in range(12):
+        artists = [catalog.artist(i, snapshot) for i in range(catalog.size)]
+        async with session_maker_fixture() as session:
+            await ArtistCrud.update_artists(session, artists)
+
+        async with session_maker_fixture() as session:
+            stored = [await ArtistCrud.read_artist(session, a.id) for a in artists]
+            images_in_db = (await session.execute(select(models.Image))).scalars()
+        urls = {image.url for artist in artists for image in artist.images}
+        assert {image.url for image in images_in_db} == urls
+        assert [artist.images for artist in stored] == [a.images for a in artists]
+
+
+@pytest.mark.asyncio
+async def test_outbox(session_maker_fixture: async_sessionmaker[AsyncSession]):
+    artists = [_artist_without_images(artist_id) for artist_id in ["a", "b"]]
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artists(session, artists)
+        # unchanged artists are not recorded
+        await ArtistCrud.update_artists(session, artists)
+        changed = artists[1].copy(update={"popularity": 2})
+        await ArtistCrud.update_artist(session, changed)
+        await ArtistCrud.create_artist(session, _artist_without_images("c"))
+        await ArtistCrud.delete_artist(session, "a")
+        await ArtistCrud.delete_artist(session, "unknown")
+
+        first_page = await ArtistOutboxCrud.read_changes(session, limit=3)
+        second_page = await ArtistOutboxCrud.read_changes(session, first_page.cursor)
+        last_page = await ArtistOutboxCrud.read_changes(session, second_page.cursor)
+
+    records = first_page.records + second_page.records
+    assert [(r.artist_id, r.deleted) for r in records] == [
+        ("a", False),
+        ("b", False),
+        ("b", False),
+        ("c", False),
+        ("a", True),
+    ]
+    assert set(records[0].fields) == set(schemas.Artist.__fields__)
+    assert records[2].fields == ["popularity"]
+    assert records[2].version == changed.content_hash()
+    assert records[4].version == ""
+    assert [r.position for r in records] == sorted(r.position for r in records)
+    assert last_page.records == []
+    assert last_page.cursor == second_page.cursor
+
+
+@pytest.mark.asyncio
+async def test_outbox_prune(session_maker_fixture: async_sessionmaker[AsyncSession]):
+    async with session_maker_fixture() as session:
+        for i in range(5):
+            await ArtistCrud.update_artist(session, _artist_without_images(str(i)))
+        created = (await ArtistOutboxCrud.read_changes(session)).records[2].created
+
+        deleted = await ArtistOutboxCrud.prune_changes(
+            session, created + timedelta(microseconds=1), batch_size=2
+        )
+        page = await ArtistOutboxCrud.read_changes(session)
+
+    assert deleted == 3
+    assert [record.artist_id for record in page.records] == ["3", "4"]
+
+
+async def _computed_genre_stats(session: AsyncSession) -> dict[str, tuple]:
+    """The stats aggregated from all artists, to compare the table with"""
+    async with session.begin():
+        query = GenreStatsCrud._aggregate_query().add_columns(models.Genre.name)
+        rows = (await session.execute(query)).all()
+    return {row.name: (row[1], row[2] / row[1], row[3]) for row in rows if row[1] != 0}
+
+
+def _stats_dict(stats: list[schemas.GenreStats]) -> dict[str, tuple]:
+    return {
+        s.name: (s.artist_count, s.average_popularity, s.total_followers) for s in stats
+    }
+
+
+@pytest.mark.asyncio
+async def test_genre_stats(session_maker_fixture: async_sessionmaker[AsyncSession]):
+    catalog = Catalog(size=100, genres=20, churn=0.5)
+    await catalog.fill_database(session_maker_fixture, batch_size=30)
+
+    async with session_maker_fixture() as session:
+        # changed genres, popularity and followers
+        for snapshot in range(1, 11):
+            changed = [catalog.artist(i, snapshot) for i in range(0, 100, 3)]
+            await ArtistCrud.update_artists(session, changed)
+        await ArtistCrud.delete_artist(session, artist_id(1))
+        await ArtistCrud.delete_artist(session, artist_id(2))
+        new_artist = catalog.artist(1).copy(update={"id": "new"})
+        await ArtistCrud.create_artist(session, new_artist)
+        # the same artist twice in one batch
+        await ArtistCrud.bulk_update_artists(
+            session, [catalog.artist(4, 11), catalog.artist(4, 12)]
+        )
+
+        stats = await GenreStatsCrud.read_stats(session, limit=1000)
+        computed = await _computed_genre_stats(session)
+
+    assert len(stats) == len(computed) > 10
+    assert _stats_dict(stats) == pytest.approx(computed)
+    assert [s.artist_count for s in stats] == sorted(
+        (s.artist_count for s in stats), reverse=True
+    )
+
+
+@pytest.mark.asyncio
+async def test_genre_stats_read_and_rebuild(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    catalog = Catalog(size=50, genres=10)
+    await catalog.fill_database(session_maker_fixture)
+
+    async with session_maker_fixture() as session:
+        stats = await GenreStatsCrud.read_stats(session)
+        by_followers = await GenreStatsCrud.read_stats(
+            session, order_by="followers", limit=3
+        )
+        selected = await GenreStatsCrud.read_stats(session, [stats[0].name, "unknown"])
+
+        async with session.begin():
+            await session.execute(
+                update(models.GenreStats).values(artist_count=0, followers_sum=0)
+            )
+        genres = await GenreStatsCrud.rebuild_stats(session)
+        rebuilt = await GenreStatsCrud.read_stats(session)
+
+    assert genres == len(catalog.vocabulary)
+    assert [s.total_followers for s in by_followers] == sorted(
+        (s.total_followers for s in stats), reverse=True
+    )[:3]
+    assert [s.name for s in selected] == [stats[0].name]
+    assert rebuilt == stats
+
+
+@pytest.mark.asyncio
+async def test_write_artist_albums(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    catalog = Catalog(size=2, max_albums=6)
+    albums = [
+        (artist_id(index), schemas.Album.parse_obj(catalog.album_data(index, p)))
+        for index in range(2)
+        for p in range(catalog.album_count(index))
+    ]
+    first = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    second = first + timedelta(days=1)
+
+    async with session_maker_fixture() as session:
+        await catalog.fill_database(session_maker_fixture)
+        # in two batches, as written while the pages arrive
+        written = await ReleaseCrud.write_artist_albums(session, albums[:4], first)
+        written += await ReleaseCrud.write_artist_albums(session, albums[4:], first)
+        stored = await ReleaseCrud.read_artist_albums(session, artist_id(0))
+        assert written == len(albums)
+        assert {album.id for album in stored} == {
+            album.id for id, album in albums if id == artist_id(0)
+        }
+        assert stored == sorted(stored, key=lambda album: album.release_date)[::-1]
+
+        # the next fetch lists one album less, one changed, one in another group
+        changed = albums[0][1].copy(update={"name": "renamed"})
+        regrouped = albums[1][1].copy(update={"album_group": "appears_on"})
+        refetched = [
+            (albums[0][0], changed),
+            (albums[1][0], regrouped),
+            *albums[2:-1],
+        ]
+        written = await ReleaseCrud.write_artist_albums(session, refetched, second)
+        unlinked = await ReleaseCrud.prune_artist_albums(
+            session, [artist_id(0), artist_id(1)], second
+        )
+        assert written == 1
+        assert unlinked == 1
+        stored = await ReleaseCrud.read_artist_albums(session, albums[1][0])
+        assert {album.id: album.album_group for album in stored}[
+            regrouped.id
+        ] == "appears_on"
+        albums_in_db = (await session.scalars(select(models.Album))).all()
+
+    assert len(albums_in_db) == len(albums) - 1
+    assert "renamed" in {album.name for album in albums_in_db}
+
+
+@pytest.mark.asyncio
+async def test_write_top_tracks(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    catalog = Catalog(size=1)
+    tracks = [
+        schemas.Track.parse_obj({**track, "album_id": track["album"]["id"]})
+        for track in catalog.top_tracks_data(0)
+    ]
+
+    async with session_maker_fixture() as session:
+        await catalog.fill_database(session_maker_fixture)
+        await ReleaseCrud.write_top_tracks(session, [(artist_id(0), tracks)])
+        await ReleaseCrud.write_top_tracks(session, [(artist_id(0), tracks[::-1])])
+        stored = await ReleaseCrud.read_top_tracks(session, artist_id(0))
+
+        await ArtistCrud.delete_artist(session, artist_id(0))
+        after_delete = await ReleaseCrud.read_top_tracks(session, artist_id(0))
+
+    assert stored == tracks[::-1]
+    assert after_delete == []
+
+
+class ReleaseCatalogSpotifyClient(CatalogSpotifyClient):
+    catalog = Catalog(size=20, max_albums=120)
+
+
+@pytest.mark.asyncio
+async def test_update_releases_from_spotify(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    catalog = ReleaseCatalogSpotifyClient.catalog
+    tracked = [artist_id(index) for index in range(10)]
+    settings = get_settings().copy(
+        update={
+            # the last one is not stored
+            "artists_to_track": [*tracked, artist_id(100)],
+            "spotify_requests_per_second": 10000,
+            "spotify_request_burst": 100,
+        }
+    )
+    reset_token_pool()
+    MockAuthTokenCrud.reset()
+    await catalog.fill_database(session_maker_fixture)
+
+    async with session_maker_fixture() as session:
+        result = await update_releases_from_spotify(
+            settings,
+            session,
+            MockAuthTokenCrud,  # type: ignore
+            ReleaseCrud,  # type: ignore
+            ReleaseCatalogSpotifyClient,  # type: ignore
+        )
+        albums = await ReleaseCrud.read_artist_albums(session, tracked[0], limit=1000)
+        tracks = await ReleaseCrud.read_top_tracks(session, tracked[0])
+
+        # fewer releases listed by the next fetch
+        ReleaseCatalogSpotifyClient.catalog = Catalog(size=20, max_albums=60)
+        try:
+            second_result = await update_releases_from_spotify(
+                settings,
+                session,
+                MockAuthTokenCrud,  # type: ignore
+                ReleaseCrud,  # type: ignore
+                ReleaseCatalogSpotifyClient,  # type: ignore
+            )
+        finally:
+            ReleaseCatalogSpotifyClient.catalog = catalog
+            reset_token_pool()
+
+    album_count = sum(catalog.album_count(index) for index in range(10))
+    assert result.errors == []
+    assert (result.artists_total, result.artists_done) == (10, 10)
+    assert result.albums_written == album_count
+    assert result.top_tracks_written == 100
+    assert len(albums) == catalog.album_count(0)
+    assert [track.id for track in tracks] == [
+        track["id"] for track in catalog.top_tracks_data(0)
+    ]
+    # unchanged albums are not written again
+    assert second_result.albums_written == 0
+    assert second_result.albums_unlinked == album_count - sum(
+        Catalog(size=20, max_albums=60).album_count(index) for index in range(10)
+    )
+
+
+@pytest.mark.asyncio
+async def test_create_genres_if_missing_outdated_cache(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    async with session_maker_fixture() as session:
+        async with session.begin() as transaction:
+            (stored,) = await ArtistCrud._create_genres_if_missing(
+                transaction, ["stored"]
+            )
+        genre_cache = get_genre_cache(session.get_bind())
+        # e.g. cached before the tables were recreated
+        genre_cache.add_many([("other", stored.id)])
+
+        async with session.begin() as transaction:
+            await session.get(models.Genre, stored.id)
+            genres = await ArtistCrud._create_genres_if_missing(
+                transaction, ["stored", "other"]
+            )
+
+    assert sorted(genre.name for genre in genres) == ["other", "stored"]
+    assert len({genre.id for genre in genres}) == 2
+    assert genre_cache.get_many(["other"]) == {}
+
+
+@pytest.mark.asyncio
+async def test_create_db_and_tables_clears_genre_cache():
+    test_engine = create_async_engine(TEST_DATABASE_URL)
+    genre_cache = get_genre_cache(test_engine.sync_engine)
+    genre_cache.add_many([("dropped", 1)])
+
+    await create_db_and_tables(test_engine)
+
+    assert len(genre_cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_create_db_and_tables_skipped_when_current():
+    test_engine = create_async_engine(TEST_DATABASE_URL)
+
+    await create_db_and_tables(test_engine)
+
+    async with test_engine.begin() as conn:
+        version = (
+            await conn.execute(select(schema_version_table.c.version))
+        ).scalar_one()
+        await conn.run_sync(lambda c: models.Genre.__table__.drop(c))
+
+    # a current schema version means no tables are created
+    await create_db_and_tables(test_engine)
+
+    async with test_engine.begin() as conn:
+        table_names = await conn.run_sync(lambda c: inspect(c).get_table_names())
+
+    assert version == SCHEMA_VERSION
+    assert models.Artist.__tablename__ in table_names
+    assert models.Genre.__tablename__ not in table_names
+
+
+@pytest.mark.asyncio
+async def test_create_db_and_tables_refuses_changed_tables():
+    test_engine = create_async_engine(TEST_DATABASE_URL)
+    async with test_engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE genre (id INTEGER PRIMARY KEY)"))
+        await conn.run_sync(schema_version_table.create)
+        await conn.execute(schema_version_table.insert().values(version=1))
+
+    with pytest.raises(SchemaMismatch, match="genre lacks name"):
+        await create_db_and_tables(test_engine)
+
+    async with test_engine.begin() as conn:
+        version = (
+            await conn.execute(select(schema_version_table.c.version))
+        ).scalar_one()
+    assert version == 1
+
+
+@pytest.mark.asyncio
+async def test_create_db_and_tables_drops_replaced_tables():
+    test_engine = create_async_engine(TEST_DATABASE_URL)
+    async with test_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(
+            text(
+                "CREATE TABLE image (id INTEGER PRIMARY KEY,"
+                " artist_id VARCHAR REFERENCES artist (id))"
+            )
+        )
+        await conn.execute(schema_version_table.insert().values(version=1))
+
+    assert await create_db_and_tables(test_engine)
+
+    async with test_engine.begin() as conn:
+        table_names = await conn.run_sync(lambda c: inspect(c).get_table_names())
+        version = (
+            await conn.execute(select(schema_version_table.c.version))
+        ).scalar_one()
+    assert "image" not in table_names
+    assert version == SCHEMA_VERSION
+
+
+@pytest.mark.asyncio
+async def test_update_artist_publishes_changed_fields(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    _url = parse_obj_as(HttpUrl, "http://example.com/a")
+    artist = schemas.Artist(
+        id="a",
+        type="artist",
+        href=_url,
+        name="test artist a",
+        popularity=1,
+        uri="",
+        genres=[schemas.Genre(__root__="test genre")],
+        external_urls=schemas.ExternalUrls(spotify=_url),
+        followers=schemas.Followers(href=None, total=1),
+        images=[schemas.Image(url=_url, height=10, width=20)],
+    )
+
+    with get_change_bus().subscribe(artist_ids=["a"]) as subscription:
+        async with session_maker_fixture() as session:
+            await ArtistCrud.update_artist(session, artist)
+
+        async with session_maker_fixture() as session:
+            await ArtistCrud.update_artist(session, artist)
+
+        async with session_maker_fixture() as session:
+            artist.popularity = 2
+            await ArtistCrud.update_artist(session, artist)
+
+        created = await subscription.get()
+        updated = await subscription.get()
+
+        # the unchanged update is not published
+        assert subscription.queue.empty()
+
+    assert created.changes["name"] == "test artist a"
+    assert updated.changes == {"popularity": 2}
+    assert updated.genres == ["test genre"]
+
+
+class FailingChangeBus(ChangeBus):
+    async def publish(self, changes: Sequence[schemas.ArtistChange]) -> None:
+        raise ConnectionError("redis is down")
+
+
+@pytest.mark.asyncio
+async def test_update_artist_survives_failing_change_bus(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(crud, "get_change_bus", FailingChangeBus)
+    artist = _artist_without_images("a")
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artist(session, artist)
+        await ArtistCrud.delete_artist(session, "a")
+
+    # stored and recorded in the outbox, although publishing failed
+    async with session_maker_fixture() as session:
+        page = await ArtistOutboxCrud.read_changes(session)
+    assert [(r.artist_id, r.deleted) for r in page.records] == [
+        ("a", False),
+        ("a", True),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_artists(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    _url = parse_obj_as(HttpUrl, "http://example.com/a")
+    artists = [
+        schemas.Artist(
+            id=artist_id,
+            type="artist",
+            href=_url,
+            name=f"test artist {artist_id}",
+            popularity=1,
+            uri="",
+            genres=[schemas.Genre(__root__="test genre")],
+            external_urls=schemas.ExternalUrls(spotify=_url),
+            followers=schemas.Followers(href=None, total=1),
+            images=[schemas.Image(url=_url, height=10, width=20)],
+        )
+        for artist_id in ["a", "b"]
+    ]
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artist(session, artists[0], manual=True)
+
+    artists[0].popularity = 100
+    async with session_maker_fixture() as session:
+        results = await ArtistCrud.bulk_update_artists(session, artists)
+
+    assert [(r.id, r.status) for r in results] == [
+        ("a", schemas.BulkArtistStatus.updated),
+        ("b", schemas.BulkArtistStatus.created),
+    ]
+    assert [r.artist for r in results] == artists
+
+    async with session_maker_fixture() as session:
+        version = await ArtistCrud.read_artist_version(session, "b")
+    assert version is not None and version.modified_manually
+
+
+@pytest.mark.asyncio
+async def test_read_artist_fields(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+):
+    _url = parse_obj_as(HttpUrl, "http://example.com/a")
+    artist = schemas.Artist(
+        id="a",
+        type="artist",
+        href=_url,
+        name="test artist a",
+        popularity=1,
+        uri="",
+        genres=[schemas.Genre(__root__="test genre")],
+        external_urls=schemas.ExternalUrls(spotify=_url),
+        followers=schemas.Followers(href=None, total=1),
+        images=[schemas.Image(url=_url, height=10, width=20)],
+    )
+
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artist(session, artist)
+
+    fields = schemas.artist_fields(["popularity", "genres"])
+    async with session_maker_fixture() as session:
+        partial_artist = await ArtistCrud.read_artist(session, "a", fields)
+        batches = [b async for b in ArtistCrud.iter_artists(session, fields=fields)]
+
+    assert partial_artist is not None
+    assert partial_artist.dict() == artist.dict(include={"id", "popularity", "genres"})
+    assert batches == [[partial_artist]]
+
+
+def _artist_without_images(artist_id: str) -> schemas.Artist:
+    _url = parse_obj_as(HttpUrl, "http://example.com/a")
+    return schemas.Artist(
+        id=artist_id,
+        type="artist",
+        href=_url,
+        name=f"test artist {artist_id}",
+        popularity=1,
+        uri="",
+        genres=[schemas.Genre(__root__=f"genre {artist_id}")],
+        external_urls=schemas.ExternalUrls(spotify=_url),
+        followers=schemas.Followers(href=None, total=1),
+        images=[],
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("count", [1, 50])
+async def test_update_artists_query_budget(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+    query_log: QueryLog,
+    count: int,
+):
+    # without images, orm inserts of images are one statement per row on SQLite
+    artists = [_artist_without_images(str(i)) for i in range(count)]
+
+    async with session_maker_fixture() as session:
+        query_log.clear()
+        await ArtistCrud.update_artists(session, artists)
+        # genres: select, insert, select; artists: select, 4 relations, 4 inserts
+        assert query_log.count("ArtistCrud.update_artists") <= 9, query_log.report()
+        assert query_log.count("ArtistCrud._create_genres_if_missing") <= 5
+        assert query_log.count("ArtistCrud._write_genre_stats") == 1
+
+        query_log.clear()
+        for artist in artists:
+            artist.popularity += 1
+        await ArtistCrud.update_artists(session, artists)
+        # the genres were cached by the first update
+        assert query_log.count("ArtistCrud._create_genres_if_missing") == 0
+        # one insert for all changes
+        assert query_log.count("ArtistCrud._write_outbox") == 1
+        # one executemany of increments for all changed genres
+        assert query_log.count("ArtistCrud._write_genre_stats") == 1
+        # artists: select, 4 relations, updates of artist, external_urls, followers
+        assert query_log.count("ArtistCrud.update_artists") <= 8, query_log.report()
+
+
+@pytest.mark.asyncio
+async def test_update_artists_images_query_budget(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+    query_log: QueryLog,
+):
+    artists = [Catalog(image_count_weights=(0, 0, 0, 1)).artist(i) for i in range(50)]
+
+    async with session_maker_fixture() as session:
+        query_log.clear()
+        await ArtistCrud.update_artists(session, artists)
+        # savepoint, select, insert of all 150 images, release
+        assert query_log.count("ArtistCrud._create_images_if_missing") <= 4
+        assert query_log.count("ArtistCrud._write_image_links") == 1
+
+        query_log.clear()
+        for artist in artists:
+            artist.popularity += 1
+        await ArtistCrud.update_artists(session, artists)
+        # unchanged images are not written
+        assert query_log.count("ArtistCrud._write_image_links") == 0, query_log.report()
+
+        query_log.clear()
+        for artist in artists:
+            artist.images = artist.images[1:]
+        await ArtistCrud.update_artists(session, artists)
+        # links: delete, insert (the moved images), unused images: delete
+        assert query_log.count("ArtistCrud._write_image_links") == 3, query_log.report()
+
+
+@pytest.mark.asyncio
+async def test_read_artist_query_budget(
+    session_maker_fixture: async_sessionmaker[AsyncSession],
+    query_log: QueryLog,
+):
+    async with session_maker_fixture() as session:
+        await ArtistCrud.update_artist(session, _artist_without_images("a"))
+
+        query_log.clear()
+        await ArtistCrud.read_artist(session, "a")
+        await ArtistCrud.read_artist(session, "a", schemas.artist_fields(["name"]))
+        await ArtistCrud.read_artist_version(session, "a")
+
+    # artist and 4 relations, projection without relations, version
+    assert query_log.count("ArtistCrud.read_artist") == 6, query_log.report()
+    assert query_log.count("ArtistCrud.read_artist_version") == 1
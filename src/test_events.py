@@ -0,0 +1,106 @@
+import asyncio
+from typing import Any, AsyncIterator
+
+import pytest
+
+from events import ChangeBus, RedisChangeBus
+from responses import dumps
+import schemas
+
+
+def _change(artist_id: str, genres: list[str]) -> schemas.ArtistChange:
+    return schemas.ArtistChange(
+        artist_id=artist_id, genres=genres, changes={"popularity": 1}
+    )
+
+
+@pytest.mark.asyncio
+async def test_change_bus_filters_subscriptions():
+    bus = ChangeBus()
+    everything = bus.subscribe()
+    by_artist = bus.subscribe(artist_ids=["a"])
+    by_genre = bus.subscribe(genres=["rock"])
+
+    bus.dispatch([_change("a", ["pop"]), _change("b", ["rock"])])
+
+    assert everything.queue.qsize() == 2
+    assert (await by_artist.get()).artist_id == "a"
+    assert by_artist.queue.empty()
+    assert (await by_genre.get()).artist_id == "b"
+    assert by_genre.queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_change_bus_unsubscribe():
+    bus = ChangeBus()
+    with bus.subscribe(artist_ids=["a"], genres=["rock"]) as subscription:
+        assert bus.subscriber_count == 1
+
+    bus.dispatch([_change("a", ["rock"])])
+
+    assert bus.subscriber_count == 0
+    assert subscription.queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_change_subscription_keeps_newest_changes():
+    bus = ChangeBus()
+    subscription = bus.subscribe()
+    subscription.queue = type(subscription.queue)(2)
+
+    bus.dispatch([_change(artist_id, []) for artist_id in ["a", "b", "c"]])
+
+    assert subscription.dropped == 1
+    assert (await subscription.get()).artist_id == "b"
+    assert (await subscription.get()).artist_id == "c"
+
+
+@pytest.mark.asyncio
+async def test_change_bus_many_idle_subscribers():
+    bus = ChangeBus()
+    subscriptions = [bus.subscribe(artist_ids=[str(i)]) for i in range(10_000)]
+
+    bus.dispatch([_change("42", [])])
+
+    assert [s for s in subscriptions if not s.queue.empty()] == [subscriptions[42]]
+
+
+class FlakyPubSub:
+    """Fails to subscribe on the first connection, then delivers one message"""
+
+    connections = 0
+
+    async def __aenter__(self) -> "FlakyPubSub":
+        FlakyPubSub.connections += 1
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    async def subscribe(self, channel: str) -> None:
+        if FlakyPubSub.connections == 1:
+            raise ConnectionError("connection lost")
+
+    async def listen(self) -> AsyncIterator[dict[str, Any]]:
+        yield {"type": "subscribe", "data": 1}
+        yield {"type": "message", "data": dumps([_change("a", [])])}
+        await asyncio.Event().wait()
+
+
+class FlakyRedis:
+    def pubsub(self) -> FlakyPubSub:
+        return FlakyPubSub()
+
+
+@pytest.mark.asyncio
+async def test_redis_change_bus_reconnects():
+    bus = RedisChangeBus(FlakyRedis())  # type: ignore
+    bus.reconnect_delay = 0
+
+    with bus.subscribe() as subscription:
+        change = await asyncio.wait_for(subscription.get(), 1)
+
+    assert change.artist_id == "a"
+    assert FlakyPubSub.connections == 2
+    assert bus._listener is not None
+    bus._listener.cancel()
@@ -0,0 +1,21 @@
+import loadtest
+
+
+def test_summarize():
+    stats = {"get_artist": loadtest._Stats([0.001 * i for i in range(1, 101)], 2)}
+
+    summary = loadtest.summarize(stats, duration=10.0)
+
+    assert summary["get_artist"]["requests"] == 100
+    assert summary["get_artist"]["throughput"] == 10.0
+    assert summary["get_artist"]["p50_ms"] == 51.0
+    assert summary["get_artist"]["p99_ms"] == 99.0
+    assert summary["total"]["errors"] == 2
+
+
+def test_load_test_smoke():
+    report = loadtest.run(catalog=20, concurrency=2, duration=0.5)
+
+    results = report["results"]
+    assert results["total"]["requests"] > 0
+    assert results["total"]["errors"] == 0
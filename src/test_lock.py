@@ -0,0 +1,112 @@
+import asyncio
+import time
+from typing import Any
+
+import pytest
+
+from lock import LockLost, MemoryLeaseLock, RedisLeaseLock, hold_lock
+
+
+class FakeRedis:
+    """Stand-in for redis implementing just what RedisLeaseLock uses"""
+
+    def __init__(self) -> None:
+        self.values: dict[str, tuple[str, float]] = {}
+
+    def _get(self, key: str) -> str | None:
+        value = self.values.get(key)
+        if value is None or value[1] < time.monotonic():
+            return None
+        return value[0]
+
+    async def set(self, key: str, value: str, nx: bool, px: int) -> bool | None:
+        if nx and self._get(key) is not None:
+            return None
+        self.values[key] = (value, time.monotonic() + px / 1000)
+        return True
+
+    async def eval(self, script: str, numkeys: int, key: str, *args: Any) -> int:
+        if self._get(key) != args[0]:
+            return 0
+        if script == RedisLeaseLock._RENEW_SCRIPT:
+            self.values[key] = (args[0], time.monotonic() + args[1] / 1000)
+        else:
+            del self.values[key]
+        return 1
+
+
+@pytest.mark.asyncio
+async def test_memory_lock_contended():
+    first = MemoryLeaseLock("test_memory_lock_contended", ttl=10)
+    second = MemoryLeaseLock("test_memory_lock_contended", ttl=10)
+
+    async with hold_lock(first) as first_acquired:
+        async with hold_lock(second) as second_acquired:
+            assert first_acquired
+            assert not second_acquired
+
+    assert second.contended == 1
+
+    async with hold_lock(second) as second_acquired:
+        assert second_acquired
+
+
+@pytest.mark.asyncio
+async def test_memory_lock_expires():
+    first = MemoryLeaseLock("test_memory_lock_expires", ttl=0.01)
+    second = MemoryLeaseLock("test_memory_lock_expires", ttl=0.01)
+
+    assert await first.acquire()
+    await asyncio.sleep(0.02)
+
+    assert await second.acquire()
+    assert not await first.renew()
+
+
+@pytest.mark.asyncio
+async def test_lock_is_renewed_while_held():
+    first = MemoryLeaseLock("test_lock_is_renewed_while_held", ttl=0.03)
+    second = MemoryLeaseLock("test_lock_is_renewed_while_held", ttl=0.03)
+
+    async with hold_lock(first):
+        await asyncio.sleep(0.1)
+        assert not await second.acquire()
+
+
+@pytest.mark.asyncio
+async def test_lost_lock_stops_holder():
+    first = MemoryLeaseLock("test_lost_lock_stops_holder", ttl=0.03)
+    second = MemoryLeaseLock("test_lost_lock_stops_holder", ttl=10)
+    steps = 0
+
+    with pytest.raises(LockLost):
+        async with hold_lock(first):
+            # e.g. the lease expired during a long pause of the holder
+            del MemoryLeaseLock._leases[first.key]
+            assert await second.acquire()
+            for _ in range(10):
+                await asyncio.sleep(0.01)
+                steps += 1
+
+    # stopped at the first renewal (after 10 ms)
+    assert steps < 5
+    # the lock of the new holder is kept
+    assert await second.renew()
+
+
+@pytest.mark.asyncio
+async def test_redis_lock():
+    redis: Any = FakeRedis()
+    first = RedisLeaseLock(redis, "test_redis_lock", ttl=10)
+    second = RedisLeaseLock(redis, "test_redis_lock", ttl=10)
+
+    async with hold_lock(first) as first_acquired:
+        assert first_acquired
+        assert not await second.acquire()
+        assert not await second.renew()
+
+        # only the holder may release the lock
+        await second.release()
+        assert await first.renew()
+
+    assert await second.acquire()
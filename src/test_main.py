@@ -1,7 +1,28 @@
+import asyncio
+
+import pytest
 from fastapi.testclient import TestClient
-from mocks import MockArtistCrud, MockAuthTokenCrud, MockSpotifyClient
-from crud import ArtistCrud, AuthTokenCrud
+from fastapi.encoders import jsonable_encoder
+from mocks import (
+    MockArtistCrud,
+    MockArtistOutboxCrud,
+    MockAuthTokenCrud,
+    MockGenreStatsCrud,
+    MockReleaseCrud,
+    MockSpotifyClient,
+)
+from crud import (
+    ArtistCrud,
+    ArtistOutboxCrud,
+    AuthTokenCrud,
+    GenreStatsCrud,
+    ReleaseCrud,
+)
 
+from config import get_settings
+from jobs import update_jobs
+from lock import MemoryLeaseLock
+import main
 from main import app
 
 from schemas import AuthToken, Artist
@@ -20,6 +41,15 @@ app.dependency_overrides[AuthTokenCrud] = MockAuthTokenCrud
 app.dependency_overrides[ArtistCrud] = MockArtistCrud
 
 
+app.dependency_overrides[ArtistOutboxCrud] = MockArtistOutboxCrud
+
+
+app.dependency_overrides[ReleaseCrud] = MockReleaseCrud
+
+
+app.dependency_overrides[GenreStatsCrud] = MockGenreStatsCrud
+
+
 app.dependency_overrides[SpotifyClient] = MockSpotifyClient
 
 
@@ -30,6 +60,18 @@ def test_root():
     assert response.json() == {"msg": "Hello World"}
 
 
+def test_metrics():
+    client.get("/artist/a")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert (
+        'http_request_duration_seconds_count{method="GET",route="/artist/{artist_id}"'
+        in response.text
+    )
+
+
 def test_login():
     response = client.get("/login", follow_redirects=False)
 
@@ -106,6 +148,99 @@ def test_update_artists_from_spotify():
     assert len(artists) == 2
 
 
+class FailingArtistCrud(MockArtistCrud):
+    @classmethod
+    async def update_artists(cls, *args, **kwargs):
+        raise RuntimeError("database unavailable")
+
+
+def test_update_artists_from_spotify_write_failed():
+    app.dependency_overrides[ArtistCrud] = FailingArtistCrud
+    try:
+        response = client.get("/update_artists_from_spotify")
+    finally:
+        app.dependency_overrides[ArtistCrud] = MockArtistCrud
+
+    assert response.status_code == 500
+    assert response.json()["detail"] == "writing 1 batches of artists failed"
+
+
+@pytest.fixture
+def memory_update_lock(monkeypatch: pytest.MonkeyPatch) -> MemoryLeaseLock:
+    """The update lock of jobs, in memory instead of the configured backend"""
+    lock = MemoryLeaseLock("test_update_lock", ttl=10)
+    monkeypatch.setattr(main, "_job_update_lock", lambda: lock)
+    return lock
+
+
+def test_start_update_artists_job(memory_update_lock: MemoryLeaseLock):
+    response = client.post("/update_artists_from_spotify")
+
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+
+    response = client.get(f"/update_jobs/{job_id}")
+
+    assert response.status_code == 200
+    job = response.json()
+    assert job["status"] == "succeeded"
+    assert job["batches_done"] == job["batches_total"] == 1
+    assert job["artists_written"] == 2
+    assert job["errors"] == []
+
+
+def test_start_update_artists_job_write_failed(memory_update_lock: MemoryLeaseLock):
+    app.dependency_overrides[ArtistCrud] = FailingArtistCrud
+    try:
+        response = client.post("/update_artists_from_spotify")
+    finally:
+        app.dependency_overrides[ArtistCrud] = MockArtistCrud
+
+    job = client.get(f"/update_jobs/{response.json()['id']}").json()
+    assert job["status"] == "failed"
+    assert job["errors"] == ["FlushFailed('writing 1 batches of artists failed')"]
+
+
+def test_start_update_artists_job_locked(memory_update_lock: MemoryLeaseLock):
+    # another holder, e.g. the worker
+    lock = MemoryLeaseLock(memory_update_lock.key, ttl=10)
+    assert asyncio.run(lock.acquire())
+    try:
+        response = client.post("/update_artists_from_spotify")
+    finally:
+        asyncio.run(lock.release())
+
+    job = client.get(f"/update_jobs/{response.json()['id']}").json()
+    assert job["status"] == "failed"
+    assert job["errors"] == ["another update cycle is running"]
+    assert job["batches_done"] == 0
+
+
+def test_start_update_artists_job_deduplicated():
+    running_job, _ = update_jobs.start()
+    try:
+        response = client.post("/update_artists_from_spotify")
+    finally:
+        update_jobs._running = None
+
+    assert response.status_code == 202
+    assert response.json()["id"] == running_job.id
+
+
+def test_get_update_job_not_found():
+    response = client.get("/update_jobs/unknown")
+
+    assert response.status_code == 404
+
+
+def test_get_artists():
+    response = client.get("/artists")
+
+    assert response.status_code == 200
+    artists = [Artist.validate(j) for j in response.json()]
+    assert [artist.id for artist in artists] == ["a", "b"]
+
+
 def test_get_artist():
     response = client.get("/artist/a")
 
@@ -115,6 +250,39 @@ def test_get_artist():
     assert artist.id == "a"
 
 
+def test_get_artist_not_modified():
+    response = client.get("/artist/a")
+    etag = response.headers["ETag"]
+    assert "max-age" in response.headers["Cache-Control"]
+
+    response = client.get("/artist/a", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+
+def test_get_artist_modified():
+    response = client.get("/artist/a", headers={"If-None-Match": '"outdated"'})
+
+    assert response.status_code == 200
+    artist = Artist.validate(response.json())
+    assert response.headers["ETag"] == f'"{artist.content_hash()}"'
+
+
+def test_get_artist_fast_json():
+    default_response = client.get("/artist/a")
+    get_settings().fast_json_responses = True
+    try:
+        response = client.get("/artist/a")
+    finally:
+        get_settings().fast_json_responses = False
+
+    assert response.status_code == 200
+    assert response.json() == default_response.json()
+    assert response.headers["ETag"] == default_response.headers["ETag"]
+
+
 def test_update_artist():
     artist = MockArtistCrud.artists["a"]
     artist.followers.total = 1000_000
@@ -126,3 +294,109 @@ def test_update_artist():
     json = response.json()
     response_artist = Artist.validate(json)
     assert response_artist.followers.total == artist.followers.total
+
+
+def test_bulk_update_artists():
+    updated = MockArtistCrud.artists["b"].copy(deep=True)
+    updated.popularity = 50
+    created = updated.copy(update={"id": "bulk"})
+
+    response = client.put(
+        "/artists",
+        json=[
+            jsonable_encoder(updated),
+            jsonable_encoder(created),
+            {"id": "invalid"},
+            jsonable_encoder(updated),
+        ],
+    )
+
+    assert response.status_code == 200
+    results = response.json()
+    assert [(r["id"], r["status"]) for r in results] == [
+        ("b", "updated"),
+        ("bulk", "created"),
+        ("invalid", "invalid"),
+        ("b", "invalid"),
+    ]
+    assert Artist.validate(results[0]["artist"]).popularity == 50
+    assert results[2]["artist"] is None
+    assert "b" in MockArtistCrud.manual and "bulk" in MockArtistCrud.manual
+    del MockArtistCrud.artists["bulk"]
+
+
+def test_get_artist_fields():
+    response = client.get("/artist/a?fields=name,popularity")
+
+    assert response.status_code == 200
+    artist = MockArtistCrud.artists["a"]
+    assert response.json() == {
+        "id": "a",
+        "name": artist.name,
+        "popularity": artist.popularity,
+    }
+    assert response.headers["ETag"] != client.get("/artist/a").headers["ETag"]
+
+
+def test_get_artist_unknown_fields():
+    response = client.get("/artist/a?fields=name,unknown")
+
+    assert response.status_code == 422
+
+
+def test_get_artists_fields():
+    response = client.get("/artists?fields=genres")
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": artist_id, "genres": ["test genre"]} for artist_id in ["a", "b"]
+    ]
+
+
+def test_get_artist_outbox():
+    response = client.get("/artists/outbox", params={"after": 1, "limit": 1})
+
+    assert response.status_code == 200
+    page = response.json()
+    assert [record["artist_id"] for record in page["records"]] == ["b"]
+    assert page["cursor"] == 2
+
+    response = client.get("/artists/outbox", params={"after": page["cursor"]})
+    assert [record["position"] for record in response.json()["records"]] == [3]
+    response = client.get("/artists/outbox", params={"after": 3})
+    assert response.json() == {"records": [], "cursor": 3}
+    assert client.get("/artists/outbox", params={"limit": 0}).status_code == 422
+
+
+def test_get_artist_albums():
+    response = client.get("/artist/a/albums", params={"offset": 1, "limit": 1})
+
+    assert response.status_code == 200
+    assert [album["id"] for album in response.json()] == ["album 1"]
+
+
+def test_get_artist_top_tracks():
+    response = client.get("/artist/a/top_tracks")
+
+    assert response.status_code == 200
+    assert response.json()[0]["album_id"] == "album 0"
+
+
+def test_get_genre_stats():
+    response = client.get("/genres/stats", params={"genre": "other genre"})
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {
+            "name": "other genre",
+            "artist_count": 1,
+            "average_popularity": 2.0,
+            "total_followers": 1,
+        }
+    ]
+
+
+def test_get_genre_stats_unknown_order():
+    response = client.get("/genres/stats", params={"order_by": "name"})
+
+    assert response.status_code == 422
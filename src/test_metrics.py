@@ -0,0 +1,86 @@
+import json
+from pathlib import Path
+
+import metrics
+
+
+def test_render_histogram():
+    histogram = metrics.Histogram(
+        "test_render_histogram_seconds", "test", ("name",), buckets=(0.1, 1.0)
+    )
+    histogram.observe(0.05, name="a")
+    histogram.observe(0.5, name="a")
+
+    rendered = metrics.render(metrics.registry.collect())
+
+    assert "# TYPE test_render_histogram_seconds histogram" in rendered
+    assert 'test_render_histogram_seconds_bucket{name="a",le="0.1"} 1.0' in rendered
+    assert 'test_render_histogram_seconds_bucket{name="a",le="1.0"} 2.0' in rendered
+    assert 'test_render_histogram_seconds_count{name="a"} 2.0' in rendered
+
+
+def _stored(name: str, value: float) -> str:
+    # the file of another process
+    return json.dumps(
+        {
+            name: {
+                "type": "counter",
+                "help": "test",
+                "samples": [[f"{name}_total", {"name": "a"}, value]],
+            }
+        }
+    )
+
+
+def test_collect_all_processes(tmp_path: Path):
+    counter = metrics.Counter("test_collect_all_processes", "test", ("name",))
+    counter.inc(2, name="a")
+    # a live process in another container, with a pid that is free here
+    (tmp_path / "worker-999999-1.json").write_text(
+        _stored("test_collect_all_processes", 3.0)
+    )
+
+    collected = metrics.collect_all_processes(str(tmp_path))
+
+    assert (tmp_path / f"{metrics._process_file_name()}.json").exists()
+    assert (tmp_path / "worker-999999-1.json").exists()
+    assert collected["test_collect_all_processes"]["samples"] == [
+        ("test_collect_all_processes_total", {"name": "a"}, 5.0)
+    ]
+
+
+def test_collect_all_processes_archives_exited(tmp_path: Path):
+    counter = metrics.Counter("test_archives_exited", "test", ("name",))
+    (tmp_path / "worker-7-1.json").write_text(_stored("test_archives_exited", 3.0))
+    (tmp_path / "worker-7-1.exited").touch()
+
+    collected = metrics.collect_all_processes(str(tmp_path))
+
+    assert not (tmp_path / "worker-7-1.json").exists()
+    assert not (tmp_path / "worker-7-1.exited").exists()
+    assert collected["test_archives_exited"]["samples"] == [
+        ("test_archives_exited_total", {"name": "a"}, 3.0)
+    ]
+
+    # a later process with the same pid has its own file, the archive is kept
+    (tmp_path / "worker-7-2.json").write_text(_stored("test_archives_exited", 1.0))
+    counter.inc(2, name="a")
+    collected = metrics.collect_all_processes(str(tmp_path))
+
+    assert collected["test_archives_exited"]["samples"] == [
+        ("test_archives_exited_total", {"name": "a"}, 6.0)
+    ]
+
+
+def test_write_process_metrics_exited(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(metrics, "_process_file", None)
+    monkeypatch.setattr(metrics, "_exited_pid", None)
+    name = metrics._process_file_name()
+    metrics.write_process_metrics(str(tmp_path), exited=True)
+    assert (tmp_path / f"{name}.exited").exists()
+
+    metrics.collect_all_processes(str(tmp_path))
+    metrics.write_process_metrics(str(tmp_path))
+
+    # no write after the exit, the archived file does not come back
+    assert [path.name for path in tmp_path.glob("*.json")] == ["exited.json"]
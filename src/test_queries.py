@@ -0,0 +1,122 @@
+import asyncio
+from typing import AsyncGenerator, Iterator
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from cache import get_artist_cache
+from crud import ArtistCrud
+from db import Base, get_session
+from main import app
+from metrics import operation
+from mocks import MockArtistCrud
+from queries import QueryLog, count_queries, normalize_sql
+
+
+def test_normalize_sql():
+    assert (
+        normalize_sql("SELECT genre.id\n  FROM genre WHERE genre.name IN (?, ?, ?)")
+        == "SELECT genre.id FROM genre WHERE genre.name IN (...)"
+    )
+    assert (
+        normalize_sql("INSERT INTO genre (name) VALUES ($1), ($2), ($3)")
+        == "INSERT INTO genre (name) VALUES ($1), ..."
+    )
+
+
+@pytest.mark.asyncio
+async def test_count_queries_only_current_task():
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    @operation("test")
+    async def query() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    with count_queries() as log:
+        await query()
+        # not recorded, the task is created outside of the block
+        other_task = asyncio.create_task(asyncio.sleep(0))
+    await asyncio.gather(other_task, query())
+
+    assert log.count() == 1
+    assert log.count("test") == 1
+    assert log.sql("test") == {"SELECT 1": 1}
+
+
+@pytest.fixture
+def db_client() -> Iterator[TestClient]:
+    """The app with the real crud on an in memory database"""
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async def create_tables() -> None:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    async def session() -> AsyncGenerator[AsyncSession, None]:
+        async with session_maker() as db_session:
+            yield db_session
+
+    asyncio.run(create_tables())
+    overrides = dict(app.dependency_overrides)
+    app.dependency_overrides.pop(ArtistCrud, None)
+    app.dependency_overrides[get_session] = session
+    get_artist_cache().clear()
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.clear()
+        app.dependency_overrides.update(overrides)
+        get_artist_cache().clear()
+
+
+def test_get_artist_query_budget(db_client: TestClient, query_log: QueryLog):
+    artist = MockArtistCrud.artists["a"]
+    db_client.put(f"/artist/{artist.id}", json=artist.dict())
+
+    query_log.clear()
+    db_client.get(f"/artist/{artist.id}")
+    # version, artist and 4 relations
+    assert query_log.count() == 6, query_log.report()
+
+    query_log.clear()
+    db_client.get(f"/artist/{artist.id}")
+    # served from the artist cache
+    assert query_log.count() == 1, query_log.report()
+
+
+def test_get_artist_cached_with_genres_in_another_order(
+    db_client: TestClient, query_log: QueryLog
+):
+    artist = MockArtistCrud.artists["a"]
+    genres = [{"__root__": "zeta"}]
+    db_client.put("/artist/b", json={**artist.dict(), "id": "b", "genres": genres})
+    # read back in the order of the genre ids: zeta, mid
+    genres = [{"__root__": "mid"}, {"__root__": "zeta"}]
+    db_client.put("/artist/a", json={**artist.dict(), "genres": genres})
+    db_client.get("/artist/a")
+
+    query_log.clear()
+    response = db_client.get("/artist/a")
+
+    assert response.json()["genres"] == ["zeta", "mid"]
+    # served from the artist cache
+    assert query_log.count() == 1, query_log.report()
+
+
+def test_get_artists_query_budget(db_client: TestClient, query_log: QueryLog):
+    for artist in MockArtistCrud.artists.values():
+        db_client.put(f"/artist/{artist.id}", json=artist.dict())
+
+    query_log.clear()
+    db_client.get("/artists", params={"fields": "name"})
+    # one batch and the empty batch ending the keyset pagination
+    assert query_log.count() == 2, query_log.report()
@@ -0,0 +1,20 @@
+from mocks import MockArtistCrud
+from records import ArtistRecord
+
+
+def test_artist_record_round_trip():
+    artist = MockArtistCrud.artists["a"]
+
+    record = ArtistRecord.from_artist(artist)
+
+    assert record.to_artist() == artist
+    assert record.to_artist().content_hash() == artist.content_hash()
+
+
+def test_artist_record_interns_genres():
+    a, b = [
+        ArtistRecord.from_artist(artist.copy(deep=True))
+        for artist in MockArtistCrud.artists.values()
+    ]
+
+    assert a.genres[0] is b.genres[0]
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from scheduler import PeriodicJob, Scheduler
+
+
+@pytest.mark.asyncio
+async def test_scheduler_runs_jobs_without_overlap():
+    running = 0
+    max_running = 0
+    runs = 0
+
+    async def slow_job() -> None:
+        nonlocal running, max_running, runs
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        runs += 1
+
+    scheduler = Scheduler([PeriodicJob("slow", 0.001, slow_job, jitter=0.001)])
+    scheduler.start()
+    await asyncio.sleep(0.1)
+    await scheduler.stop()
+
+    assert runs >= 2
+    assert max_running == 1
+
+
+@pytest.mark.asyncio
+async def test_scheduler_stop_waits_for_running_job():
+    finished = False
+
+    async def job() -> None:
+        nonlocal finished
+        await asyncio.sleep(0.05)
+        finished = True
+
+    scheduler = Scheduler([PeriodicJob("job", 0.001, job)])
+    scheduler.start()
+    await asyncio.sleep(0.01)
+    await scheduler.stop(timeout=1)
+
+    assert finished
+
+
+@pytest.mark.asyncio
+async def test_scheduler_keeps_running_after_failing_job():
+    runs = 0
+
+    async def failing_job() -> None:
+        nonlocal runs
+        runs += 1
+        raise RuntimeError("job failed")
+
+    scheduler = Scheduler([PeriodicJob("failing", 0.001, failing_job)])
+    scheduler.start()
+    await asyncio.sleep(0.05)
+    await scheduler.stop()
+
+    assert runs >= 2
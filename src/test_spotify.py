@@ -0,0 +1,22 @@
+import time
+
+import pytest
+from httpx import Request, Response
+
+import metrics
+from spotify import _observe_response
+
+
+@pytest.mark.asyncio
+async def test_observe_response_labels_route():
+    request = Request(
+        "GET",
+        "https://api.spotify.com/v1/artists/0TnOYISbd1XYRBk9myaseg/albums",
+        extensions={"start": time.perf_counter(), "route": "/v1/artists/{id}/albums"},
+    )
+
+    await _observe_response(Response(200, request=request))
+
+    rendered = metrics.render(metrics.registry.collect())
+    assert 'endpoint="/v1/artists/{id}/albums"' in rendered
+    assert "0TnOYISbd1XYRBk9myaseg" not in rendered
@@ -0,0 +1,162 @@
+import time
+
+import pytest
+
+from config import get_settings
+from catalog import artist_id
+from mocks import CatalogSpotifyClient, MockAuthTokenCrud, MockSpotifyClient
+from schemas import Artist, AuthToken
+from spotify import SpotifyRateLimited
+from token_pool import USER_TOKEN, TokenPool, get_token_pool, reset_token_pool
+
+
+def _token(name: str) -> AuthToken:
+    return AuthToken(
+        access_token=name,
+        refresh_token="",
+        expires_in=3600,
+        scope="",
+        token_type="Bearer",
+    )
+
+
+def _pool(names: list[str], rate: float = 1000.0, burst: float = 2) -> TokenPool:
+    pool = TokenPool(rate, burst)
+    pool.update({name: _token(name) for name in names})
+    return pool
+
+
+@pytest.mark.asyncio
+async def test_acquire_spreads_requests():
+    pool = _pool(["a", "b", "c"])
+
+    for _ in range(6):
+        await pool.acquire()
+
+    assert [token.requests for token in pool.tokens.values()] == [2, 2, 2]
+
+
+@pytest.mark.asyncio
+async def test_acquire_throughput_grows_with_tokens():
+    durations = []
+    for names in [["a"], ["a", "b", "c", "d"]]:
+        pool = _pool(names, rate=50, burst=1)
+        start = time.perf_counter()
+        for _ in range(8):
+            await pool.acquire()
+        durations.append(time.perf_counter() - start)
+
+    # 7 refills of one token (0.14 s) against one refill of each token (0.02 s)
+    assert durations[0] >= 0.12
+    assert durations[1] < durations[0] / 2
+
+
+@pytest.mark.asyncio
+async def test_update_keeps_rate_state():
+    pool = _pool(["a", "b"])
+    await pool.acquire()
+    used = next(token for token in pool.tokens.values() if token.requests == 1)
+
+    pool.update({"a": _token("a2"), "c": _token("c")})
+
+    assert list(pool.tokens) == ["a", "c"]
+    assert pool.tokens["a"].auth_token.access_token == "a2"
+    assert pool.tokens["a"].requests == (1 if used.name == "a" else 0)
+
+
+class RateLimitedSpotifyClient(CatalogSpotifyClient):
+    """Replies 429 to requests with the token "limited" """
+
+    calls: list[str] = []
+
+    @classmethod
+    async def get_artists(
+        cls, artist_ids: list[str], auth_token: AuthToken
+    ) -> list[Artist]:
+        cls.calls.append(auth_token.access_token)
+        if auth_token.access_token == "limited":
+            raise SpotifyRateLimited(retry_after=30)
+        return await super().get_artists(artist_ids, auth_token)
+
+
+@pytest.mark.asyncio
+async def test_get_artists_rate_limited():
+    RateLimitedSpotifyClient.calls = []
+    pool = _pool(["limited", "ok"], burst=1)
+    pool.tokens["limited"].available = 2  # chosen first
+
+    ids = [artist_id(0), artist_id(1)]
+
+    artists = await pool.get_artists(RateLimitedSpotifyClient, ids)
+
+    assert [artist.id for artist in artists] == ids
+    assert RateLimitedSpotifyClient.calls == ["limited", "ok"]
+    limited = pool.tokens["limited"]
+    assert limited.rate_limited == 1
+    assert limited.blocked_until > time.monotonic() + 25
+
+    # skipped while blocked, although it has the most capacity
+    limited.available = 2
+    await pool.get_artists(RateLimitedSpotifyClient, ids)
+    assert RateLimitedSpotifyClient.calls[-1] == "ok"
+
+
+@pytest.mark.asyncio
+async def test_get_artists_gives_up():
+    pool = _pool(["limited"])
+    ids = [artist_id(0)]
+
+    artists = await pool.get_artists(RateLimitedSpotifyClient, ids, max_attempts=1)
+
+    assert artists == []
+
+
+class CountingSpotifyClient(MockSpotifyClient):
+    token_requests = 0
+
+    @classmethod
+    async def get_client_credentials_token(cls, auth_header: str) -> AuthToken | None:
+        cls.token_requests += 1
+        return await super().get_client_credentials_token(auth_header)
+
+
+@pytest.mark.asyncio
+async def test_get_token_pool_client_credentials():
+    reset_token_pool()
+    settings = get_settings().copy(
+        update={
+            "spotify_client_credentials": True,
+            "spotify_extra_credentials": ["second:secret2", "third:secret3"],
+        }
+    )
+
+    for _ in range(2):
+        pool = await get_token_pool(
+            settings, None, MockAuthTokenCrud, CountingSpotifyClient  # type: ignore
+        )
+
+    assert pool is not None
+    assert list(pool.tokens) == [settings.spotify_client_id, "second", "third"]
+    # cached until shortly before they expire
+    assert CountingSpotifyClient.token_requests == 3
+    reset_token_pool()
+
+
+@pytest.mark.asyncio
+async def test_get_token_pool_user_token():
+    reset_token_pool()
+    MockAuthTokenCrud.reset()
+
+    pool = await get_token_pool(
+        get_settings(), None, MockAuthTokenCrud, MockSpotifyClient  # type: ignore
+    )
+
+    assert pool is not None
+    assert list(pool.tokens) == [USER_TOKEN]
+    assert pool.tokens[USER_TOKEN].auth_token == MockAuthTokenCrud.auth_token
+    # not rate limited, e.g. a large update sends all its requests at once
+    start = time.perf_counter()
+    for _ in range(100):
+        await pool.acquire()
+    assert time.perf_counter() - start < 0.1
+    reset_token_pool()
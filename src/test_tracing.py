@@ -0,0 +1,84 @@
+from typing import Iterator
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from metrics import operation
+import tracing
+
+
+@pytest.fixture
+def exporter() -> Iterator[tracing.MemoryExporter]:
+    exporter = tracing.MemoryExporter()
+    tracing.set_exporter(exporter)
+    yield exporter
+    tracing.set_exporter(None)
+
+
+def test_no_spans_without_exporter():
+    with tracing.span("test") as span:
+        assert span is None
+        assert tracing.inject() == {}
+
+
+@pytest.mark.asyncio
+async def test_db_spans_nested_in_operation(exporter: tracing.MemoryExporter):
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    @operation("Crud.read")
+    async def read() -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async with engine.connect() as conn:
+        # outside of a span
+        await conn.execute(text("SELECT 2"))
+    with tracing.span("update cycle"):
+        await read()
+    await engine.dispose()
+
+    spans = {span.name: span for span in exporter.spans}
+    assert set(spans) == {"update cycle", "Crud.read", "db"}
+    assert spans["db"].attributes["statement"] == "SELECT 1"
+    assert spans["db"].parent_id == spans["Crud.read"].span_id
+    assert spans["Crud.read"].parent_id == spans["update cycle"].span_id
+    assert len({span.trace_id for span in exporter.spans}) == 1
+
+
+def test_span_records_error(exporter: tracing.MemoryExporter):
+    with pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError("invalid")
+    assert exporter.spans[0].error == "ValueError('invalid')"
+
+
+def test_propagation(exporter: tracing.MemoryExporter):
+    with tracing.span("publisher") as publisher:
+        headers = tracing.inject()
+    assert tracing.extract(headers["traceparent"]) == publisher.context
+    assert tracing.extract("invalid") is None
+
+    # e.g. in the celery worker
+    with tracing.remote_parent(headers["traceparent"]):
+        with tracing.span("task") as task:
+            pass
+    assert task.trace_id == publisher.trace_id
+    assert task.parent_id == publisher.span_id
+
+    with tracing.span("next") as unrelated:
+        pass
+    assert unrelated.trace_id != publisher.trace_id
+
+
+def test_render_traces():
+    spans = [
+        {"name": "db", "trace_id": "t", "span_id": "b", "parent_id": "a"},
+        {"name": "worker", "trace_id": "t", "span_id": "a", "parent_id": "remote"},
+    ]
+    for start, span in enumerate(reversed(spans)):
+        span.update(start=start, duration=0.001, error=None)
+
+    assert tracing.render_traces(spans) == (
+        "trace t\n       1.00 ms  worker\n         1.00 ms  db"
+    )
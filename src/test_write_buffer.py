@@ -0,0 +1,111 @@
+import asyncio
+from typing import Any, Sequence
+
+import pytest
+
+from mocks import MockArtistCrud
+from schemas import Artist
+from write_buffer import ArtistWriteBuffer, FlushFailed
+
+
+class RecordingArtistCrud:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.batches: list[list[str]] = []
+
+    async def update_artists(
+        self, db_session: Any, updated_artists: Sequence[Artist]
+    ) -> Sequence[Artist]:
+        await asyncio.sleep(self.delay)
+        self.batches.append([artist.id for artist in updated_artists])
+        return updated_artists
+
+
+def _artists(count: int, prefix: str) -> list[Artist]:
+    template = MockArtistCrud.artists["a"]
+    return [template.copy(update={"id": f"{prefix}{i}"}) for i in range(count)]
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_coalesces_concurrent_puts():
+    crud = RecordingArtistCrud()
+
+    async with ArtistWriteBuffer(None, crud, max_delay=0.05) as buffer:  # type: ignore
+        await asyncio.gather(*(buffer.put(_artists(10, f"s{s}_")) for s in range(5)))
+
+    assert len(crud.batches) == 1
+    assert len(crud.batches[0]) == 50
+    assert buffer.flushes[0].size == 50
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_flushes_full_batches():
+    crud = RecordingArtistCrud()
+
+    buffer = ArtistWriteBuffer(
+        None, crud, max_batch_size=20, max_delay=10  # type: ignore
+    )
+    async with buffer:
+        await buffer.put(_artists(50, "a"))
+
+    assert [len(batch) for batch in crud.batches] == [20, 20, 10]
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_deduplicates_pending_artists():
+    crud = RecordingArtistCrud()
+
+    async with ArtistWriteBuffer(None, crud, max_delay=0.05) as buffer:  # type: ignore
+        await buffer.put(_artists(3, "a"))
+        await buffer.put(_artists(3, "a"))
+
+    assert crud.batches == [["a0", "a1", "a2"]]
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_backpressure():
+    crud = RecordingArtistCrud(delay=0.05)
+    buffer = ArtistWriteBuffer(
+        None, crud, max_batch_size=10, max_delay=0, max_pending=10  # type: ignore
+    )
+
+    async with buffer:
+        await buffer.put(_artists(10, "a"))
+        # the first batch is being written, the second fills the buffer again
+        await buffer.put(_artists(10, "b"))
+        blocked_put = asyncio.create_task(buffer.put(_artists(10, "c")))
+        await asyncio.sleep(0.01)
+        assert not blocked_put.done()
+        await blocked_put
+
+    assert [len(batch) for batch in crud.batches] == [10, 10, 10]
+
+
+class FailingArtistCrud(RecordingArtistCrud):
+    """Fails to write batches containing the artist "fail" """
+
+    async def update_artists(
+        self, db_session: Any, updated_artists: Sequence[Artist]
+    ) -> Sequence[Artist]:
+        if any(artist.id == "fail" for artist in updated_artists):
+            raise RuntimeError("write failed")
+        return await super().update_artists(db_session, updated_artists)
+
+
+@pytest.mark.asyncio
+async def test_write_buffer_raises_failed_flushes():
+    crud = FailingArtistCrud()
+    buffer = ArtistWriteBuffer(
+        None, crud, max_batch_size=2, max_delay=10  # type: ignore
+    )
+
+    with pytest.raises(FlushFailed, match="writing 1 batches of artists failed"):
+        async with buffer:
+            failing = _artists(1, "fail")[0].copy(update={"id": "fail"})
+            # batches of a0 and a1, fail and x0, b0 and b1
+            await buffer.put([*_artists(2, "a"), failing, *_artists(1, "x")])
+            await buffer.put(_artists(2, "b"))
+
+    # the other batches are still written
+    assert crud.batches == [["a0", "a1"], ["b0", "b1"]]
+    assert buffer.failed_flushes == 1
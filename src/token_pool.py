@@ -0,0 +1,209 @@
+import asyncio
+import math
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Any, Awaitable, Callable, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import Settings, auth_header
+from metrics import spotify_rate_limited, spotify_token_requests
+from spotify import SpotifyRateLimited
+import schemas
+
+
+_logger = getLogger(__file__)
+
+_T = TypeVar("_T")
+
+# the token of the interactive login (see /login)
+USER_TOKEN = "user"
+
+
+@dataclass
+class PooledToken:
+    name: str  # client id of the app, or USER_TOKEN
+    auth_token: schemas.AuthToken
+    rate: float  # requests per second
+    burst: float  # requests that can be sent at once after a pause
+    available: float = 0.0  # token bucket, requests that can be sent now
+    refilled: float = 0.0  # monotonic time of the last refill
+    blocked_until: float = 0.0  # monotonic time, after a 429 reply
+    requests: int = 0
+    rate_limited: int = 0
+
+    def refill(self, now: float) -> None:
+        if math.isinf(self.rate):
+            self.available = self.burst  # not limited
+        else:
+            self.available = min(
+                self.burst, self.available + (now - self.refilled) * self.rate
+            )
+        self.refilled = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a request can be sent with this token"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return max(0.0, (1 - self.available) / self.rate)
+
+
+class TokenPool:
+    """Spreads Spotify requests over several tokens (e.g. of several apps in the
+    client credentials flow), so the throughput grows with their number.
+    Every token has its own rate limit (token bucket) and is skipped for the
+    Retry-After time of a 429 reply. The token with the most capacity is used."""
+
+    def __init__(
+        self,
+        rate: float,
+        burst: float,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self.tokens: dict[str, PooledToken] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.tokens)
+
+    def update(self, auth_tokens: dict[str, schemas.AuthToken]) -> None:
+        """Replaces the tokens, the rate state of known names is kept"""
+        now = self._clock()
+        tokens: dict[str, PooledToken] = {}
+        for name, auth_token in auth_tokens.items():
+            token = self.tokens.get(name)
+            if token is None:
+                token = PooledToken(
+                    name, auth_token, self.rate, self.burst, self.burst, now
+                )
+            token.auth_token = auth_token
+            tokens[name] = token
+        self.tokens = tokens
+
+    async def acquire(self) -> PooledToken:
+        if len(self.tokens) == 0:
+            raise ValueError("the token pool is empty")
+        while True:
+            now = self._clock()
+            ready: list[PooledToken] = []
+            for token in self.tokens.values():
+                token.refill(now)
+                if token.blocked_until <= now and token.available >= 1:
+                    ready.append(token)
+
+            if len(ready) != 0:
+                # no await until the request is counted, so concurrent
+                # acquirers never take the same capacity
+                token = max(ready, key=lambda token: token.available)
+                token.available -= 1
+                token.requests += 1
+                spotify_token_requests.inc(token=token.name)
+                return token
+
+            await asyncio.sleep(
+                min(token.wait_time(now) for token in self.tokens.values())
+            )
+
+    def block(self, token: PooledToken, retry_after: float) -> None:
+        token.blocked_until = max(token.blocked_until, self._clock() + retry_after)
+        token.rate_limited += 1
+        spotify_rate_limited.inc(token=token.name)
+
+    async def call(
+        self,
+        request: Callable[[schemas.AuthToken], Awaitable[_T]],
+        max_attempts: int = 3,
+    ) -> _T | None:
+        """Sends the request with the next available token, rate limited requests
+        are retried with another one. None if every attempt was rate limited."""
+        for _ in range(max_attempts):
+            token = await self.acquire()
+            try:
+                return await request(token.auth_token)
+            except SpotifyRateLimited as e:
+                _logger.warning(
+                    "token %s rate limited for %.1f s", token.name, e.retry_after
+                )
+                self.block(token, e.retry_after)
+        _logger.error("request failed, rate limited %d times", max_attempts)
+        return None
+
+    async def get_artists(
+        self, spotify_client: Any, artist_ids: list[str], max_attempts: int = 3
+    ) -> list[schemas.Artist]:
+        artists = await self.call(
+            lambda token: spotify_client.get_artists(artist_ids, token), max_attempts
+        )
+        return artists if artists is not None else []
+
+
+_pool: TokenPool | None = None
+# tokens of the client credentials flow by client id, obtained without a user,
+# so they are kept per process instead of being stored
+_app_tokens: dict[str, schemas.AuthToken] = {}
+
+
+async def _app_token(
+    spotify_client: Any, client_id: str, client_secret: str
+) -> schemas.AuthToken | None:
+    token = _app_tokens.get(client_id)
+    # renewed a minute early, so it does not expire during an update cycle
+    if token is None or token.expired(margin=60):
+        token = await spotify_client.get_client_credentials_token(
+            auth_header(client_id, client_secret)
+        )
+        if token is None:
+            _logger.error("getting a client credentials token of %s failed", client_id)
+            _app_tokens.pop(client_id, None)
+            return None
+        _app_tokens[client_id] = token
+    return token
+
+
+async def get_token_pool(
+    settings: Settings,
+    db_session: AsyncSession,
+    auth_token_crud: Any,
+    spotify_client: Any,
+) -> TokenPool | None:
+    """The pool of this process with current tokens, None without any token"""
+    global _pool
+    if _pool is None:
+        # the login token was never limited, only 429 replies block it
+        rate = (
+            settings.spotify_requests_per_second
+            if settings.spotify_client_credentials
+            else math.inf
+        )
+        _pool = TokenPool(rate, settings.spotify_request_burst)
+
+    auth_tokens: dict[str, schemas.AuthToken] = {}
+    if settings.spotify_client_credentials:
+        credentials = settings.get_app_credentials()
+        app_tokens = await asyncio.gather(
+            *[
+                _app_token(spotify_client, client_id, client_secret)
+                for client_id, client_secret in credentials
+            ]
+        )
+        for (client_id, _), token in zip(credentials, app_tokens):
+            if token is not None:
+                auth_tokens[client_id] = token
+    else:
+        user_token = await auth_token_crud.read_auth_token(db_session)
+        if user_token is not None:
+            auth_tokens[USER_TOKEN] = user_token
+
+    _pool.update(auth_tokens)
+    return _pool if _pool.size != 0 else None
+
+
+def reset_token_pool() -> None:
+    """Forgets the pool and the app tokens of this process (e.g. in tests)"""
+    global _pool
+    _pool = None
+    _app_tokens.clear()
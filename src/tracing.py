@@ -0,0 +1,309 @@
+"""Lightweight tracing: spans nested through contextvars, W3C traceparent
+propagation (http requests and celery tasks) and exporters to the console
+or a json lines file.
+
+Print the traces of a file with `python tracing.py traces.jsonl`"""
+import contextvars
+import functools
+import inspect
+import json
+import re
+import secrets
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from logging import getLogger
+from typing import Any, Callable, Iterator, TextIO, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+_logger = getLogger(__file__)
+
+
+@dataclass
+class SpanContext:
+    trace_id: str  # 32 hex digits
+    span_id: str  # 16 hex digits
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None
+    start: float  # unix time
+    duration: float = 0.0  # seconds
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: str | None = None
+
+    @property
+    def context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id)
+
+
+class SpanExporter:
+    def export(self, span: Span) -> None:
+        raise NotImplementedError()
+
+
+class ConsoleExporter(SpanExporter):
+    def __init__(self, stream: TextIO = sys.stderr) -> None:
+        self.stream = stream
+
+    def export(self, span: Span) -> None:
+        error = f" error={span.error}" if span.error is not None else ""
+        self.stream.write(
+            f"trace={span.trace_id} span={span.span_id} parent={span.parent_id}"
+            f" {span.duration * 1000:9.2f} ms {span.name}{error}\n"
+        )
+
+
+class FileExporter(SpanExporter):
+    """Appends every span as a json line"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+
+    def export(self, span: Span) -> None:
+        self._file.write(json.dumps(asdict(span), default=str) + "\n")
+
+
+class MemoryExporter(SpanExporter):
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+_exporter: SpanExporter | None = None
+
+# the innermost active span, or the parent received from another process
+_current: contextvars.ContextVar[Span | SpanContext | None] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def set_exporter(exporter: SpanExporter | None) -> None:
+    """Tracing is disabled (spans are not even created) without an exporter"""
+    global _exporter
+    _exporter = exporter
+
+
+def configure(trace_exporter: str, trace_file: str) -> None:
+    if trace_exporter == "console":
+        set_exporter(ConsoleExporter())
+    elif trace_exporter == "file":
+        set_exporter(FileExporter(trace_file))
+    else:
+        set_exporter(None)
+
+
+def current_span() -> Span | None:
+    current = _current.get()
+    return current if isinstance(current, Span) else None
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span | None]:
+    """Child of the current span (or a new trace), exported when the block ends"""
+    exporter = _exporter
+    if exporter is None:
+        yield None
+        return
+
+    parent = _current.get()
+    new_span = Span(
+        name=name,
+        trace_id=parent.trace_id if parent is not None else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent is not None else None,
+        start=time.time(),
+        attributes=attributes,
+    )
+    token = _current.set(new_span)
+    start = time.perf_counter()
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.error = repr(e)
+        raise
+    finally:
+        new_span.duration = time.perf_counter() - start
+        _current.reset(token)
+        exporter.export(new_span)
+
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def traced(name: str) -> Callable[[_F], _F]:
+    """Runs the decorated (async) function or async generator in a span"""
+
+    def decorator(func: _F) -> _F:
+        if inspect.isasyncgenfunction(func):
+
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+                # one span per item, not covering the consumer between items
+                generator = func(*args, **kwargs)
+                try:
+                    while True:
+                        with span(name):
+                            try:
+                                item = await generator.__anext__()
+                            except StopAsyncIteration:
+                                return
+                        yield item
+                finally:
+                    await generator.aclose()
+
+            return async_gen_wrapper  # type: ignore
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper  # type: ignore
+
+    return decorator
+
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def inject() -> dict[str, str]:
+    """Headers carrying the current span to another process"""
+    current = _current.get()
+    if current is None:
+        return {}
+    return {"traceparent": f"00-{current.trace_id}-{current.span_id}-01"}
+
+
+def extract(traceparent: str | None) -> SpanContext | None:
+    if traceparent is None:
+        return None
+    match = _TRACEPARENT.match(traceparent.strip().lower())
+    if match is None:
+        return None
+    return SpanContext(match.group(1), match.group(2))
+
+
+@contextmanager
+def remote_parent(traceparent: str | None) -> Iterator[None]:
+    """Spans started inside the block (also by tasks created in it) continue
+    the trace of the given traceparent header"""
+    parent = extract(traceparent)
+    if parent is None:
+        yield
+        return
+
+    token = _current.set(parent)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class TracingMiddleware:
+    """Traces every http request, continuing the trace of an incoming traceparent"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or _exporter is None:
+            await self.app(scope, receive, send)
+            return
+
+        traceparent = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                traceparent = value.decode("latin-1")
+
+        with remote_parent(traceparent):
+            with span(f"{scope['method']} {scope['path']}") as request_span:
+
+                async def send_with_status(message: Message) -> None:
+                    if message["type"] == "http.response.start" and request_span:
+                        request_span.attributes["http.status_code"] = message["status"]
+                    await send(message)
+
+                await self.app(scope, receive, send_with_status)
+                route = scope.get("route")
+                if request_span is not None and route is not None:
+                    request_span.name = f"{scope['method']} {route.path}"
+
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, many: bool
+) -> None:
+    # statements are only traced inside a span (e.g. of a crud method)
+    if _exporter is None or current_span() is None:
+        conn.info.setdefault("tracing_spans", []).append(None)
+        return
+
+    db_span = span("db", statement=_WHITESPACE.sub(" ", statement)[:500])
+    db_span.__enter__()
+    conn.info.setdefault("tracing_spans", []).append(db_span)
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(
+    conn: Any, cursor: Any, statement: str, parameters: Any, context: Any, many: bool
+) -> None:
+    db_span = conn.info["tracing_spans"].pop()
+    if db_span is not None:
+        db_span.__exit__(None, None, None)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(context: Any) -> None:
+    if context.connection is None:
+        return
+    spans = context.connection.info.get("tracing_spans")
+    if spans:
+        db_span = spans.pop()
+        if db_span is not None:
+            error = context.original_exception
+            db_span.__exit__(type(error), error, error.__traceback__)
+
+
+def render_traces(spans: list[dict[str, Any]]) -> str:
+    """The spans as indented trees, one per trace"""
+    children: dict[str | None, list[dict[str, Any]]] = {}
+    span_ids = {s["span_id"] for s in spans}
+    for s in sorted(spans, key=lambda s: s["start"]):
+        # spans of a parent that is not in the file (e.g. another process) are roots
+        parent_id = s["parent_id"] if s["parent_id"] in span_ids else None
+        children.setdefault(parent_id, []).append(s)
+
+    lines: list[str] = []
+
+    def add(s: dict[str, Any], depth: int) -> None:
+        error = f"  error={s['error']}" if s["error"] is not None else ""
+        lines.append(
+            f"{'  ' * depth}{s['duration'] * 1000:9.2f} ms  {s['name']}{error}"
+        )
+        for child in children.get(s["span_id"], []):
+            add(child, depth + 1)
+
+    for root in children.get(None, []):
+        lines.append(f"trace {root['trace_id']}")
+        add(root, 1)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    with open(sys.argv[1]) as trace_file:
+        print(render_traces([json.loads(line) for line in trace_file if line.strip()]))
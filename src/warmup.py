@@ -0,0 +1,85 @@
+import asyncio
+import time
+from contextlib import aclosing
+from dataclasses import asdict, dataclass
+from logging import getLogger
+from typing import Any
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from cache import ArtistCache, get_genre_cache
+from crud import ArtistCrud
+
+_logger = getLogger(__file__)
+
+
+@dataclass
+class WarmupReport:
+    artists: int
+    genres: int
+    duration: float  # seconds
+    artist_cache_bytes: int  # estimated
+    genre_cache_bytes: int
+    budget_exhausted: bool  # stopped by max_seconds before max_artists
+
+    def dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+async def warm_up_caches(
+    session_maker: async_sessionmaker[AsyncSession],
+    artist_cache: ArtistCache,
+    max_artists: int,
+    max_seconds: float,
+    batch_size: int = 500,
+) -> WarmupReport:
+    """Loads all genres and the most popular artists into the caches of this
+    process, so the first requests after a restart do not all hit the database.
+    Artists already cached by requests are kept, preloaded ones never evict
+    them. Yields to requests between batches."""
+    start = time.perf_counter()
+    deadline = start + max_seconds
+    artists = 0
+    budget_exhausted = False
+
+    async with session_maker() as db_session:
+        genre_cache = get_genre_cache(db_session.get_bind())
+        genre_cache.add_many(await ArtistCrud.read_genres(db_session))
+
+        batch_size = min(batch_size, max_artists)
+        if batch_size > 0:
+            batches = ArtistCrud.iter_popular_artists(db_session, batch_size)
+            async with aclosing(batches):
+                async for batch in batches:
+                    for artist, content_hash in batch[: max_artists - artists]:
+                        if not artist_cache.warm(artist, content_hash):
+                            break
+                        artists += 1
+                    if (
+                        artists >= max_artists
+                        or len(artist_cache) >= artist_cache.max_size
+                    ):
+                        break
+                    if time.perf_counter() >= deadline:
+                        budget_exhausted = True
+                        break
+                    await asyncio.sleep(0)
+
+    report = WarmupReport(
+        artists=artists,
+        genres=len(genre_cache),
+        duration=time.perf_counter() - start,
+        artist_cache_bytes=artist_cache.memory_usage(),
+        genre_cache_bytes=genre_cache.memory_usage(),
+        budget_exhausted=budget_exhausted,
+    )
+    _logger.info(
+        "caches warmed up in %.2f s: %d artists (~%d kB), %d genres (%d kB)%s",
+        report.duration,
+        report.artists,
+        report.artist_cache_bytes // 1024,
+        report.genres,
+        report.genre_cache_bytes // 1024,
+        ", time budget exhausted" if budget_exhausted else "",
+    )
+    return report
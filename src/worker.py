@@ -1,19 +1,24 @@
+from functools import lru_cache
 from typing import AsyncGenerator
 from logging import getLogger
 import asyncio
 
 from celery import Celery
-from sqlalchemy.ext.asyncio import (
-    AsyncSession,
-    async_sessionmaker,
-    create_async_engine,
+from celery.signals import (
+    before_task_publish,
+    worker_process_shutdown,
+    worker_shutdown,
 )
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import get_settings
 import main
-from db import DATABASE_URL
-from crud import ArtistCrud, AuthTokenCrud
+from db import get_engine, get_session_maker
+from crud import ArtistCrud, ArtistOutboxCrud, AuthTokenCrud, ReleaseCrud
 from spotify import SpotifyClient
+from lock import LeaseLock, create_update_lock, hold_lock
+import metrics
+import tracing
 
 _logger = getLogger(__file__)
 
@@ -25,50 +30,143 @@ celery = Celery(
 
 
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    engine = create_async_engine(DATABASE_URL)
-    session_maker = async_sessionmaker(engine, expire_on_commit=False)
-    async with session_maker() as session:
+    async with get_session_maker()() as session:
         yield session
 
 
+@lru_cache()
+def get_update_lock() -> LeaseLock:
+    return create_update_lock(get_settings(), get_engine())
+
+
 event_loop = asyncio.get_event_loop()
 
+tracing.configure(get_settings().trace_exporter, get_settings().trace_file)
+
+
+@before_task_publish.connect  # type: ignore
+def _propagate_trace(headers: dict[str, str], **kwargs) -> None:
+    # tasks sent inside a span continue its trace in the worker
+    headers.update(tracing.inject())
+
 
 @celery.on_after_configure.connect  # type: ignore
 def setup_periodic_tasks(sender: Celery, **kwargs) -> None:
-    sender.add_periodic_task(60.0, update_artists.s(), name="update artists")
+    settings = get_settings()
+    sender.add_periodic_task(
+        settings.update_artists_interval, update_artists.s(), name="update artists"
+    )
 
-    sender.add_periodic_task(30.0, refresh_token.s(), name="check refresh token")
+    sender.add_periodic_task(
+        settings.refresh_token_interval, refresh_token.s(), name="check refresh token"
+    )
 
+    sender.add_periodic_task(
+        settings.prune_outbox_interval, prune_outbox.s(), name="prune outbox"
+    )
 
-@celery.task(name="update_artists")
-def update_artists() -> None:
-    asyncio.ensure_future(_update_artists(), loop=event_loop)
+    sender.add_periodic_task(
+        settings.update_releases_interval,
+        update_releases.s(),
+        name="update releases",
+    )
 
 
-async def _update_artists() -> None:
-    _logger.info("running update_artists")
-    settings = get_settings()
-    db_session = await anext(get_session())
-    auth_token_crud = AuthTokenCrud()
-    artist_crud = ArtistCrud()
-    spotify_client = SpotifyClient()
-    await main.update_artists_from_spotify(
-        settings, db_session, auth_token_crud, artist_crud, spotify_client
-    )
+@celery.task(name="update_artists", bind=True)
+def update_artists(self) -> None:
+    # the future copies the context, including the parent span
+    with tracing.remote_parent(self.request.get("traceparent")):
+        asyncio.ensure_future(_update_artists(), loop=event_loop)
+
+
+def _write_metrics() -> None:
+    metrics_dir = get_settings().metrics_dir
+    if metrics_dir is not None:
+        metrics.write_process_metrics(metrics_dir)
 
 
-@celery.task(name="refresh_token")
-def refresh_token() -> None:
-    asyncio.ensure_future(_refresh_token(), loop=event_loop)
+@worker_process_shutdown.connect  # type: ignore
+@worker_shutdown.connect  # type: ignore
+def mark_metrics_exited(**kwargs) -> None:
+    # pool processes and the main process, each stores its final metrics
+    metrics_dir = get_settings().metrics_dir
+    if metrics_dir is not None:
+        metrics.write_process_metrics(metrics_dir, exited=True)
 
 
+@tracing.traced("worker.update_artists")
+async def _update_artists() -> None:
+    _logger.info("running update_artists")
+    async with hold_lock(get_update_lock()) as acquired:
+        if not acquired:
+            _logger.info("skipping update_artists, previous cycle still running")
+            metrics.jobs_skipped.inc(job="update artists")
+            _write_metrics()
+            return
+
+        settings = get_settings()
+        db_session = await anext(get_session())
+        auth_token_crud = AuthTokenCrud()
+        artist_crud = ArtistCrud()
+        spotify_client = SpotifyClient()
+        with metrics.job_duration.time(job="update artists"):
+            await main.update_artists_from_spotify(
+                settings, db_session, auth_token_crud, artist_crud, spotify_client
+            )
+    _write_metrics()
+
+
+@celery.task(name="refresh_token", bind=True)
+def refresh_token(self) -> None:
+    with tracing.remote_parent(self.request.get("traceparent")):
+        asyncio.ensure_future(_refresh_token(), loop=event_loop)
+
+
+@tracing.traced("worker.refresh_token")
 async def _refresh_token() -> None:
     _logger.info("running refresh_token")
-    loop2 = asyncio.get_event_loop()
-    print(loop2)
     settings = get_settings()
     db_session = await anext(get_session())
     auth_token_crud = AuthTokenCrud()
     spotify_client = SpotifyClient()
-    await main.refresh_auth_token(settings, db_session, auth_token_crud, spotify_client)
+    with metrics.job_duration.time(job="check refresh token"):
+        await main.refresh_auth_token(
+            settings, db_session, auth_token_crud, spotify_client
+        )
+    _write_metrics()
+
+
+@celery.task(name="prune_outbox", bind=True)
+def prune_outbox(self) -> None:
+    with tracing.remote_parent(self.request.get("traceparent")):
+        asyncio.ensure_future(_prune_outbox(), loop=event_loop)
+
+
+@tracing.traced("worker.prune_outbox")
+async def _prune_outbox() -> None:
+    _logger.info("running prune_outbox")
+    async with get_session_maker()() as db_session:
+        with metrics.job_duration.time(job="prune outbox"):
+            await main.prune_outbox(get_settings(), db_session, ArtistOutboxCrud())
+    _write_metrics()
+
+
+@celery.task(name="update_releases", bind=True)
+def update_releases(self) -> None:
+    with tracing.remote_parent(self.request.get("traceparent")):
+        asyncio.ensure_future(_update_releases(), loop=event_loop)
+
+
+@tracing.traced("worker.update_releases")
+async def _update_releases() -> None:
+    _logger.info("running update_releases")
+    async with get_session_maker()() as db_session:
+        with metrics.job_duration.time(job="update releases"):
+            await main.update_releases_from_spotify(
+                get_settings(),
+                db_session,
+                AuthTokenCrud(),
+                ReleaseCrud(),
+                SpotifyClient(),
+            )
+    _write_metrics()
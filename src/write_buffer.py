@@ -0,0 +1,161 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from logging import getLogger
+from types import TracebackType
+from typing import Any, Awaitable, Callable, Generic, Hashable, Sequence, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import schemas
+
+
+_logger = getLogger(__file__)
+
+_T = TypeVar("_T")
+
+
+class FlushFailed(Exception):
+    """Raised by `close` if writing any batch failed, the failures are logged"""
+
+    def __init__(self, failed_flushes: int, name: str) -> None:
+        super().__init__(f"writing {failed_flushes} batches of {name} failed")
+        self.failed_flushes = failed_flushes
+
+
+@dataclass
+class FlushStats:
+    size: int
+    duration: float  # seconds
+
+
+class WriteBuffer(Generic[_T]):
+    """Collects items from concurrent fetchers and writes them with one `write`
+    call (transaction) per flush instead of one per fetch.
+
+    A flush happens when `max_batch_size` items are pending or the oldest pending
+    item waited `max_delay` seconds. `put` blocks while `max_pending` items
+    are waiting, so fetchers are slowed down when the database falls behind.
+    Flushes run one after another, so a single session can be used. A failed
+    flush does not stop the following ones, `close` raises `FlushFailed`
+    afterwards."""
+
+    def __init__(
+        self,
+        db_session: AsyncSession,
+        write: Callable[[AsyncSession, list[_T]], Awaitable[Any]],
+        key: Callable[[_T], Hashable],
+        max_batch_size: int = 500,
+        max_delay: float = 0.5,
+        max_pending: int = 5000,
+        on_flush: Callable[[FlushStats], None] | None = None,
+        name: str = "items",
+    ) -> None:
+        self.db_session = db_session
+        self.write = write
+        self.key = key
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.on_flush = on_flush
+
+        self.flushes: list[FlushStats] = []
+        self.failed_flushes = 0
+
+        # a later fetch of the same item replaces the pending one
+        self._pending: dict[Hashable, _T] = {}
+        self._changed = asyncio.Condition()
+        self._closing = False
+        self._flusher: asyncio.Task[None] | None = None
+
+    async def __aenter__(self) -> "WriteBuffer[_T]":
+        self._flusher = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        # an exception of the block takes precedence over failed flushes
+        await self.close(raise_failed=exc is None)
+
+    async def put(self, items: Sequence[_T]) -> None:
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: len(self._pending) < self.max_pending or self._closing
+            )
+            for item in items:
+                self._pending[self.key(item)] = item
+            self._changed.notify_all()
+
+    async def close(self, raise_failed: bool = True) -> None:
+        """Writes everything still pending and stops the background flusher.
+        Raises `FlushFailed` if any flush failed (unless `raise_failed` is False)."""
+        async with self._changed:
+            self._closing = True
+            self._changed.notify_all()
+        if self._flusher is not None:
+            await self._flusher
+            self._flusher = None
+        if raise_failed and self.failed_flushes != 0:
+            raise FlushFailed(self.failed_flushes, self.name)
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: len(self._pending) > 0 or self._closing
+                )
+                if len(self._pending) == 0:
+                    return
+
+                deadline = time.monotonic() + self.max_delay
+                while len(self._pending) < self.max_batch_size and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+
+                batch_keys = list(self._pending.keys())[: self.max_batch_size]
+                batch = [self._pending.pop(key) for key in batch_keys]
+                # the batch left the buffer, blocked fetchers may continue
+                self._changed.notify_all()
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[_T]) -> None:
+        start = time.perf_counter()
+        try:
+            await self.write(self.db_session, batch)
+        except Exception:
+            self.failed_flushes += 1
+            _logger.exception("flushing %d %s failed", len(batch), self.name)
+            return
+
+        stats = FlushStats(len(batch), time.perf_counter() - start)
+        self.flushes.append(stats)
+        if self.on_flush is not None:
+            self.on_flush(stats)
+        _logger.info(
+            "flushed %d %s in %.3f seconds", stats.size, self.name, stats.duration
+        )
+
+
+class ArtistWriteBuffer(WriteBuffer[schemas.Artist]):
+    """Writes the artists with `update_artists`, keyed by id"""
+
+    def __init__(self, db_session: AsyncSession, artist_crud: Any, **kwargs: Any):
+        super().__init__(
+            db_session,
+            artist_crud.update_artists,
+            key=lambda artist: artist.id,
+            name="artists",
+            **kwargs,
+        )
+        self.artist_crud = artist_crud